@@ -1,8 +1,16 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, g
 from flask_cors import CORS
 from config import Config
 from models.analysis import UrbanAnalysis
+from services.heatmap_service import HeatmapService
+from utils import cache as cache_module
+from utils.metrics import REGISTRO, DURACAO_REQUISICAO, REJEICOES_RATE_LIMIT, ultimo_status_upstream
+from utils.profiling import perfilar_se_solicitado, token_valido, listar_perfis, ler_perfil
+from utils.jobs import criar_fila
+from utils.admissao import ControleAdmissao, SobrecargaError
+from utils.limite_taxa import LimiteTaxa
 import logging
+import threading
 import time
 from functools import wraps
 
@@ -18,32 +26,50 @@ app.config.from_object(Config)
 CORS(app, origins=Config.CORS_ORIGINS)
 
 urban_analyzer = UrbanAnalysis()
-
-request_counts = {}
+heatmap_service = HeatmapService(urban_analyzer.maps_service, urban_analyzer.motor_pontuacao)
+
+limite_taxa = LimiteTaxa()
+# histórico em memória, usado só quando o Redis está fora do ar
+request_counts = limite_taxa.local
+
+controle_admissao = ControleAdmissao()
+
+# criada no primeiro uso (no worker, depois do fork) para não tocar no Redis no import
+_fila_jobs = None
+_lock_fila_jobs = threading.Lock()
+
+def fila_jobs():
+    global _fila_jobs
+    if _fila_jobs is None:
+        with _lock_fila_jobs:
+            if _fila_jobs is None:
+                _fila_jobs = criar_fila(urban_analyzer.analyze_neighborhood)
+    return _fila_jobs
+
+def recarregar_indices():
+    """Relê do disco os indices locais (no mestre, no HUP do gunicorn)
+
+    Monta um analisador novo e só então troca as referências globais; os workers novos
+    nascem com ele e os antigos terminam as requisições com o que já tinham.
+    """
+    global urban_analyzer, heatmap_service
+    analisador = UrbanAnalysis()
+    analisador.aquecer()
+    urban_analyzer = analisador
+    heatmap_service = HeatmapService(analisador.maps_service, analisador.motor_pontuacao)
 
 def rate_limit(max_requests=60, window=60):
-    """Decorator para rate limiting"""
+    """Decorator para rate limiting (compartilhado entre os workers pelo Redis)"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            client_ip = request.remote_addr
-            current_time = time.time()
-            
-            request_counts[client_ip] = [
-                timestamp for timestamp in request_counts.get(client_ip, [])
-                if current_time - timestamp < window
-            ]
-            
-            if len(request_counts.get(client_ip, [])) >= max_requests:
+            if not limite_taxa.permitir(request.remote_addr, max_requests, window):
+                REJEICOES_RATE_LIMIT.inc(endpoint=request.endpoint)
                 return jsonify({
                     'error': 'Rate limit exceeded',
                     'message': f'Máximo de {max_requests} requisições por minuto'
                 }), 429
             
-            if client_ip not in request_counts:
-                request_counts[client_ip] = []
-            request_counts[client_ip].append(current_time)
-            
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -56,8 +82,12 @@ def index():
         'version': '1.0.0',
         'endpoints': {
             'analyze': '/api/analyze',
+            'jobs': '/api/jobs',
             'summary': '/api/summary',
-            'health': '/api/health'
+            'similar': '/api/similar',
+            'heatmap': '/api/heatmap/<z>/<x>/<y>',
+            'health': '/api/health',
+            'metrics': '/metrics'
         },
         'frontend': 'Acesse ../frontend/index.html para a interface web'
     })
@@ -68,21 +98,73 @@ def index():
 @app.route('/api/health')
 def health_check():
     """Endpoint de health check"""
+    nos_cache = {}
+    for conexao in cache_module.anel_redis.conexoes:
+        nos_cache[conexao.nome] = 'offline (reconectando)'
+        cliente = conexao.cliente()
+        if cliente is not None:
+            try:
+                cliente.ping()
+                conexao.registrar_sucesso()
+                nos_cache[conexao.nome] = 'online'
+            except Exception as e:
+                conexao.registrar_falha(e)
+                nos_cache[conexao.nome] = 'offline'
+    
+    online = sum(1 for estado in nos_cache.values() if estado == 'online')
+    if online == len(nos_cache):
+        cache_status = 'online'
+    elif online:
+        cache_status = f'parcial ({online}/{len(nos_cache)} nós)'
+    else:
+        cache_status = 'offline'
+    
     return jsonify({
         'status': 'healthy',
         'timestamp': time.time(),
         'services': {
             'api': 'online',
-            'cache': 'online',
-            'external_apis': 'available'
+            'cache': cache_status,
+            'cache_nos': nos_cache,
+            'external_apis': ultimo_status_upstream
+        },
+        'admissao': {
+            'em_execucao': controle_admissao.em_execucao,
+            'na_fila': controle_admissao.na_fila,
+            'limite': controle_admissao.limite
         }
     })
 
 
 
 
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato de texto do Prometheus"""
+    return Response(REGISTRO.exportar(), mimetype='text/plain; version=0.0.4')
+
+
+
+
+def admissao_controlada(f):
+    """Decorator que responde 503 com Retry-After quando o controle de admissão recusa a análise"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            with controle_admissao.sob_demanda():
+                return f(*args, **kwargs)
+        except SobrecargaError as e:
+            resposta = jsonify({
+                'error': 'Servidor sobrecarregado',
+                'message': f'Muitas análises em andamento. Tente novamente em {e.retry_after}s'
+            })
+            resposta.headers['Retry-After'] = str(e.retry_after)
+            return resposta, 503
+    return decorated_function
+
 @app.route('/api/analyze', methods=['POST'])
 @rate_limit(max_requests=Config.RATE_LIMIT_PER_MINUTE)
+@admissao_controlada
 def analyze_neighborhood():
     """Endpoint principal para análise de bairros"""
     try:
@@ -93,24 +175,43 @@ def analyze_neighborhood():
                 'message': 'Corpo da requisição deve conter JSON válido'
             }), 400
         
+        # coordenadas dispensam a geocodificação (bairro e setor saem das malhas do IBGE)
+        coordenadas = None
+        if data.get('latitude') is not None or data.get('longitude') is not None:
+            try:
+                coordenadas = (float(data.get('latitude')), float(data.get('longitude')))
+            except (TypeError, ValueError):
+                coordenadas = None
+            if coordenadas is None or not (-90 <= coordenadas[0] <= 90 and -180 <= coordenadas[1] <= 180):
+                return jsonify({
+                    'error': 'Coordenadas inválidas',
+                    'message': 'Informe "latitude" e "longitude" numéricas em graus decimais'
+                }), 400
+        
         endereco = data.get('endereco')
-        if not endereco:
+        if coordenadas is None and not endereco:
             return jsonify({
                 'error': 'Endereço obrigatório',
-                'message': 'O campo "endereco" é obrigatório'
+                'message': 'O campo "endereco" (ou "latitude" e "longitude") é obrigatório'
             }), 400
         
-        if len(endereco.strip()) < 5:
+        if coordenadas is None and len(endereco.strip()) < 5:
             return jsonify({
                 'error': 'Endereço muito curto',
                 'message': 'Forneça um endereço mais específico'
             }), 400
         
+        endereco = f"{coordenadas[0]},{coordenadas[1]}" if coordenadas else endereco.strip()
         logger.info(f"Analisando endereço: {endereco}")
         
         #realiza análise
         start_time = time.time()
-        result = urban_analyzer.analyze_neighborhood(endereco.strip())
+        perfil = perfilar_se_solicitado(request.headers, endereco)
+        with perfil:
+            if coordenadas:
+                result = urban_analyzer.analyze_neighborhood(latitude=coordenadas[0], longitude=coordenadas[1])
+            else:
+                result = urban_analyzer.analyze_neighborhood(endereco)
         analysis_time = time.time() - start_time
         
         if 'error' not in result:
@@ -119,11 +220,15 @@ def analyze_neighborhood():
                 'api_version': '1.0.0',
                 'request_id': f"{int(time.time())}-{hash(endereco) % 10000}"
             }
+            if getattr(perfil, 'id', None):
+                result['metadata']['profile_id'] = perfil.id
         
         logger.info(f"Análise concluída em {analysis_time:.2f}s")
         
         return jsonify(result)
         
+    except SobrecargaError:
+        raise
     except Exception as e:
         logger.error(f"Erro na análise: {str(e)}")
         return jsonify({
@@ -136,8 +241,68 @@ def analyze_neighborhood():
 
 
 
+@app.route('/api/jobs', methods=['POST'])
+@rate_limit(max_requests=Config.RATE_LIMIT_PER_MINUTE)
+def create_job():
+    """Enfileira uma análise e devolve o id do job na hora (202)"""
+    try:
+        data = request.get_json()
+        endereco = (data or {}).get('endereco')
+        if not endereco or len(endereco.strip()) < 5:
+            return jsonify({
+                'error': 'Endereço obrigatório',
+                'message': 'O campo "endereco" é obrigatório e deve ser específico'
+            }), 400
+        
+        fila = fila_jobs()
+        job = fila.enfileirar(endereco.strip())
+        logger.info(f"Job {job['id']} enfileirado ({fila.backend}): {job['endereco']}")
+        
+        resposta = jsonify({
+            'job_id': job['id'],
+            'status': job['status'],
+            'url': f"/api/jobs/{job['id']}"
+        })
+        resposta.headers['Location'] = f"/api/jobs/{job['id']}"
+        return resposta, 202
+        
+    except Exception as e:
+        logger.error(f"Erro ao enfileirar job: {str(e)}")
+        return jsonify({
+            'error': 'Erro interno',
+            'message': 'Ocorreu um erro interno no servidor'
+        }), 500
+
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Estado do job; ?espera=N faz long-poll de até N segundos (limitado a JOB_MAX_WAIT)"""
+    try:
+        espera = min(max(float(request.args.get('espera', 0)), 0), Config.JOB_MAX_WAIT)
+    except ValueError:
+        espera = 0
+    
+    try:
+        job = fila_jobs().obter(job_id, espera)
+    except Exception as e:
+        logger.error(f"Erro ao consultar job: {str(e)}")
+        return jsonify({
+            'error': 'Erro interno',
+            'message': 'Ocorreu um erro interno no servidor'
+        }), 500
+    
+    if job is None:
+        return jsonify({
+            'error': 'Job não encontrado',
+            'message': 'O job não existe ou o resultado já expirou'
+        }), 404
+    
+    return jsonify(job)
+
+
 @app.route('/api/summary', methods=['POST'])
-@rate_limit(max_requests=Config.RATE_LIMIT_PER_MINUTE * 2)  
+@rate_limit(max_requests=Config.RATE_LIMIT_PER_MINUTE)
+@admissao_controlada
 def get_summary():
     """Endpoint para resumo rápido da análise"""
     try:
@@ -154,6 +319,8 @@ def get_summary():
         result = urban_analyzer.get_analysis_summary(endereco)
         return jsonify(result)
         
+    except SobrecargaError:
+        raise
     except Exception as e:
         logger.error(f"Erro no resumo: {str(e)}")
         return jsonify({
@@ -179,7 +346,7 @@ def geocode_address():
         endereco = data.get('endereco').strip()
         
         # Usa o serviço de mapas para geocodificação
-        location_data = urban_analyzer.maps_service.geocode_address(endereco)
+        location_data = urban_analyzer.maps_service.endereço_geocodigo(endereco)
         
         if not location_data:
             return jsonify({
@@ -197,13 +364,114 @@ def geocode_address():
         }), 500
 
 
+@app.route('/api/similar', methods=['POST'])
+@rate_limit(max_requests=Config.RATE_LIMIT_PER_MINUTE)
+@admissao_controlada
+def similar_neighborhoods():
+    """Endpoint para busca de bairros parecidos com o do endereço"""
+    try:
+        data = request.get_json()
+        if not data or not data.get('endereco'):
+            return jsonify({
+                'error': 'Endereço obrigatório',
+                'message': 'O campo "endereco" é obrigatório'
+            }), 400
+        
+        try:
+            k = int(data.get('k', 5))
+        except (TypeError, ValueError):
+            k = 0
+        if not 1 <= k <= 50:
+            return jsonify({
+                'error': 'Parâmetro inválido',
+                'message': 'O campo "k" deve ser um inteiro entre 1 e 50'
+            }), 400
+        
+        endereco = data.get('endereco').strip()
+        logger.info(f"Buscando bairros similares a: {endereco}")
+        
+        result = urban_analyzer.buscar_bairros_similares(endereco, k, bool(data.get('mesmo_estado', False)))
+        return jsonify(result)
+        
+    except SobrecargaError:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na busca de similares: {str(e)}")
+        return jsonify({
+            'error': 'Erro interno',
+            'message': 'Ocorreu um erro interno no servidor'
+        }), 500
+
+
+@app.route('/api/heatmap/<int:z>/<int:x>/<int:y>')
+@rate_limit(max_requests=Config.RATE_LIMIT_PER_MINUTE)
+@admissao_controlada
+def heatmap_tile(z, x, y):
+    """Endpoint de tiles do mapa de calor de acessibilidade"""
+    try:
+        if not Config.HEATMAP_MIN_ZOOM <= z <= Config.HEATMAP_MAX_ZOOM:
+            return jsonify({
+                'error': 'Zoom fora do intervalo',
+                'message': f'Use zoom entre {Config.HEATMAP_MIN_ZOOM} e {Config.HEATMAP_MAX_ZOOM}'
+            }), 400
+        
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return jsonify({
+                'error': 'Tile inválido',
+                'message': 'Coordenadas x/y fora do zoom informado'
+            }), 400
+        
+        tile = heatmap_service.gerar_tile(z, x, y, request.args.get('cidade'))
+        return jsonify(tile)
+        
+    except SobrecargaError:
+        raise
+    except Exception as e:
+        logger.error(f"Erro no mapa de calor: {str(e)}")
+        return jsonify({
+            'error': 'Erro interno',
+            'message': 'Ocorreu um erro interno no servidor'
+        }), 500
+
+
+@app.route('/api/admin/profiles')
+def list_profiles():
+    """Lista os perfis de requisição gravados (exige X-Profile-Token)"""
+    if not token_valido(request.headers.get('X-Profile-Token')):
+        return jsonify({
+            'error': 'Acesso negado',
+            'message': 'Token de administração inválido ou não configurado'
+        }), 403
+    
+    return jsonify({'profiles': listar_perfis()})
+
+
+@app.route('/api/admin/profiles/<profile_id>/<tipo>')
+def get_profile(profile_id, tipo):
+    """Retorna um perfil no formato folded (tipo cpu ou mem), pronto para flamegraph"""
+    if not token_valido(request.headers.get('X-Profile-Token')):
+        return jsonify({
+            'error': 'Acesso negado',
+            'message': 'Token de administração inválido ou não configurado'
+        }), 403
+    
+    conteudo = ler_perfil(profile_id, tipo)
+    if conteudo is None:
+        return jsonify({
+            'error': 'Perfil não encontrado',
+            'message': 'Use /api/admin/profiles para ver os perfis disponíveis (tipo cpu ou mem)'
+        }), 404
+    
+    return Response(conteudo, mimetype='text/plain')
+
+
 @app.errorhandler(404)
 def not_found(error):
     """Handler para 404"""
     return jsonify({
         'error': 'Endpoint não encontrado',
         'message': 'O endpoint solicitado não existe',
-        'available_endpoints': ['/api/analyze', '/api/summary', '/api/geocode', '/api/health']
+        'available_endpoints': ['/api/analyze', '/api/jobs', '/api/jobs/<id>', '/api/summary', '/api/geocode', '/api/similar', '/api/heatmap/<z>/<x>/<y>', '/api/health']
     }), 404
 
 
@@ -235,13 +503,20 @@ def internal_error(error):
 @app.before_request
 def log_request_info():
     """Log informações da requisição"""
-    if request.endpoint != 'health_check':  
+    g.inicio_requisicao = time.perf_counter()
+    if request.endpoint not in ('health_check', 'metrics'):
         logger.info(f"{request.method} {request.path} - IP: {request.remote_addr}")
 
 @app.after_request
 def log_response_info(response):
     """Log informações da resposta"""
-    if request.endpoint != 'health_check':
+    if 'inicio_requisicao' in g:
+        DURACAO_REQUISICAO.observar(
+            time.perf_counter() - g.inicio_requisicao,
+            endpoint=request.endpoint or 'desconhecido',
+            status=response.status_code
+        )
+    if request.endpoint not in ('health_check', 'metrics'):
         logger.info(f"Response: {response.status_code}")
     return response
 
@@ -252,6 +527,7 @@ if __name__ == '__main__':
     print(f"Rate Limit: {Config.RATE_LIMIT_PER_MINUTE} req/min")
     print("=" * 50)
     
+    urban_analyzer.maps_service.pois.iniciar_atualizacao_periodica()
 
     app.run(
         host='0.0.0.0',
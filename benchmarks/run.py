@@ -0,0 +1,387 @@
+"""Microbenchmarks dos caminhos quentes em Python puro
+
+Uso (da raiz do projeto):
+
+    python -m benchmarks.run                      # roda tudo e grava benchmarks/resultados/<commit>.json
+    python -m benchmarks.run -k cache             # só os benchmarks com "cache" no nome
+    python -m benchmarks.run --comparar main      # compara com o resultado gravado de outro commit
+
+Nenhum benchmark faz I/O de rede: os payloads do Overpass são sintéticos e o Redis é
+trocado por um dicionário em memória, para medir só o custo do nosso código.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from typing import Callable, Dict, Any, List
+
+from utils.json_stream import iterar_array_json
+
+DIRETORIO_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resultados')
+
+BENCHMARKS = {}
+
+
+
+
+def benchmark(nome: str):
+    """Registra uma função que prepara os dados e devolve o callable a ser medido"""
+    def decorator(preparar: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[nome] = preparar
+        return preparar
+    return decorator
+
+
+def _elementos_overpass(quantidade: int, semente: int = 42) -> List[Dict[str, Any]]:
+    """Payload sintético no formato do Overpass, com a mistura de tags de uma área central"""
+    gerador = random.Random(semente)
+    modelos = [
+        {'highway': 'bus_stop', 'name': 'Ponto'},
+        {'public_transport': 'stop_position', 'bus': 'yes'},
+        {'public_transport': 'platform'},
+        {'railway': 'station', 'name': 'Estação'},
+        {'railway': 'subway_entrance'},
+        {'amenity': 'school', 'name': 'EMEF Modelo'},
+        {'amenity': 'restaurant', 'name': 'Restaurante', 'cuisine': 'brazilian'},
+        {'shop': 'supermarket', 'name': 'Mercado'},
+        {'amenity': 'pharmacy', 'name': 'Farmácia'},
+    ]
+    return [
+        {
+            'type': 'node',
+            'id': indice,
+            'lat': -23.55 + gerador.uniform(-0.01, 0.01),
+            'lon': -46.63 + gerador.uniform(-0.01, 0.01),
+            'tags': dict(gerador.choice(modelos))
+        }
+        for indice in range(quantidade)
+    ]
+
+
+def _infraestrutura_sintetica() -> Dict[str, Any]:
+    from services.maps_service import MapsService
+
+    maps_service = MapsService()
+    elementos = _elementos_overpass(200)
+    return {
+        categoria: maps_service._resumir_categoria(categoria, elementos)
+        for categoria in MapsService.CATEGORIAS_INFRAESTRUTURA
+    }
+
+
+def _dossie_sintetico() -> Dict[str, Any]:
+    infraestrutura = _infraestrutura_sintetica()
+    return {
+        'bairro': 'Bela Vista', 'cidade': 'São Paulo', 'estado': 'São Paulo',
+        'coordenadas': {'latitude': -23.55, 'longitude': -46.63},
+        'seguranca': 'x' * 200, 'transporte': 'x' * 200, 'analise_final': 'x' * 300,
+        'dados_brutos': {
+            'infraestrutura': infraestrutura,
+            'transporte': {'tipos_de_transporte': ['ônibus', 'metrô'], 'estaçoes_contagem': 42},
+            'seguranca': {'crime_rate': 'moderado', 'main_crime_types': ['furto', 'roubo'], 'safety_score': 5}
+        }
+    }
+
+
+class _RedisMemoria:
+    """Substituto em memória do cliente Redis (get/setex/incr), para medir o código nosso isolado"""
+
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def setex(self, chave, timeout, valor):
+        self.dados[chave] = valor
+
+    def incr(self, chave):
+        self.dados[chave] = int(self.dados.get(chave, 0)) + 1
+        return self.dados[chave]
+
+    def decr(self, chave):
+        self.dados[chave] = int(self.dados.get(chave, 0)) - 1
+        return self.dados[chave]
+
+    def expire(self, chave, timeout):
+        return True
+
+    def pipeline(self, transaction=True):
+        return _PipelineMemoria(self)
+
+
+class _PipelineMemoria:
+    def __init__(self, redis):
+        self.redis = redis
+        self.comandos = []
+
+    def __getattr__(self, nome):
+        return lambda *args: self.comandos.append((nome, args))
+
+    def execute(self):
+        return [getattr(self.redis, nome)(*args) for nome, args in self.comandos]
+
+
+
+
+@benchmark('cache_gerar_chave')
+def _():
+    from utils.cache import _gerar_chave_cache
+    from services.maps_service import MapsService
+
+    servico = MapsService()
+    return lambda: _gerar_chave_cache('geocode', (servico, 'Avenida Paulista, 1000, São Paulo'), {})
+
+
+@benchmark('cache_json_dumps_dossie')
+def _():
+    dossie = _dossie_sintetico()
+    return lambda: json.dumps(dossie, default=str)
+
+
+@benchmark('cache_json_loads_dossie')
+def _():
+    serializado = json.dumps(_dossie_sintetico(), default=str)
+    return lambda: json.loads(serializado)
+
+
+@benchmark('cache_decorator_hit')
+def _():
+    import utils.cache as cache_module
+
+    cache_module.anel_redis = cache_module.AnelRedis(conexoes=[cache_module.ConexaoRedis(cliente=_RedisMemoria())])
+    dossie = _dossie_sintetico()
+
+    @cache_module.cache('benchmark', timeout=60)
+    def analisar(endereco):
+        return dossie
+
+    analisar('Avenida Paulista, 1000')
+    return lambda: analisar('Avenida Paulista, 1000')
+
+
+@benchmark('rate_limit_10k_ips')
+def _():
+    import app as aplicacao
+    import utils.cache as cache_module
+
+    # o Redis do limite é falso: mede o decorator e o cálculo da janela, não a rede
+    redis_memoria = _RedisMemoria()
+    cache_module.anel_redis = cache_module.AnelRedis(conexoes=[cache_module.ConexaoRedis(cliente=redis_memoria)])
+    janela = int(time.time() // 60)
+    for indice in range(10000):
+        for deslocamento in (0, -1):
+            redis_memoria.dados[f"dossie:limite:10.0.{indice // 256}.{indice % 256}:{janela + deslocamento}"] = 30
+
+    @aplicacao.rate_limit(max_requests=10 ** 6)
+    def endpoint():
+        return 'ok'
+
+    contexto = aplicacao.app.test_request_context('/', environ_base={'REMOTE_ADDR': '10.0.1.1'})
+    contexto.push()
+    return endpoint
+
+
+@benchmark('transporte_classificacao_5k')
+def _():
+    from services.maps_service import MapsService
+
+    maps_service = MapsService()
+    elementos = _elementos_overpass(5000)
+    return lambda: maps_service._resumir_transporte(elementos)
+
+
+@benchmark('infraestrutura_lugares_5k')
+def _():
+    from services.maps_service import MapsService
+
+    maps_service = MapsService()
+    elementos = _elementos_overpass(5000)
+    return lambda: maps_service._resumir_categoria('escolas', elementos, -23.55, -46.63)
+
+
+@benchmark('overpass_stream_resumo_5k')
+def _():
+    from services.maps_service import MapsService
+
+    maps_service = MapsService()
+    corpo = json.dumps({'version': 0.6, 'elements': _elementos_overpass(5000)}).encode('utf-8')
+    blocos = [corpo[inicio:inicio + MapsService.TAMANHO_BLOCO] for inicio in range(0, len(corpo), MapsService.TAMANHO_BLOCO)]
+
+    def executar():
+        elementos = iterar_array_json(iter(blocos), 'elements')
+        return maps_service._resumir_categoria('escolas', elementos, -23.55, -46.63)
+    return executar
+
+
+def _grafo_grade(tamanho: int, passo: float = 80.0):
+    """Grafo de pedestres sintético: grade de ruas a cada `passo` metros em volta de (-23.55, -46.63)"""
+    import tempfile
+    from services.walking_service import ConstrutorGrafoPedestre, _Grafo
+
+    passo_lat = passo / 111320
+    passo_lon = passo_lat / 0.9167
+    elementos = [
+        {'type': 'node', 'id': i * tamanho + j + 1, 'lat': -23.55 + (i - tamanho // 2) * passo_lat,
+         'lon': -46.63 + (j - tamanho // 2) * passo_lon}
+        for i in range(tamanho) for j in range(tamanho)
+    ]
+    for i in range(tamanho):
+        elementos.append({'type': 'way', 'nodes': [i * tamanho + j + 1 for j in range(tamanho)], 'tags': {'highway': 'residential'}})
+        elementos.append({'type': 'way', 'nodes': [j * tamanho + i + 1 for j in range(tamanho)], 'tags': {'highway': 'footway'}})
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = os.path.join(diretorio, 'extrato.json')
+        with open(caminho, 'w') as arquivo:
+            json.dump({'elements': elementos}, arquivo)
+        ConstrutorGrafoPedestre(diretorio).construir('grade', caminho)
+        return _Grafo(os.path.join(diretorio, 'grade.npz'))
+
+
+@benchmark('isocrona_dijkstra_15min')
+def _():
+    from services.walking_service import ISOCRONAS_MINUTOS
+    from config import Config
+
+    grafo = _grafo_grade(200)
+    origem, _ = grafo.no_mais_proximo(-23.55, -46.63, Config.WALKING_MAX_SNAP)
+    limite = ISOCRONAS_MINUTOS[-1] * Config.WALKING_SPEED_KMH * 1000 / 60
+    return lambda: grafo.dijkstra(origem, limite)
+
+
+@benchmark('isocrona_lugares_200')
+def _():
+    from services.walking_service import Isocrona, ISOCRONAS_MINUTOS
+    from config import Config
+
+    grafo = _grafo_grade(200)
+    origem, distancia = grafo.no_mais_proximo(-23.55, -46.63, Config.WALKING_MAX_SNAP)
+    nos, distancias = grafo.dijkstra(origem, ISOCRONAS_MINUTOS[-1] * Config.WALKING_SPEED_KMH * 1000 / 60)
+    isocrona = Isocrona(grafo, nos, distancias, distancia)
+    lugares = [(elemento['lat'], elemento['lon']) for elemento in _elementos_overpass(200)]
+    return lambda: isocrona.contar([isocrona.minutos_ate(lat, lon) for lat, lon in lugares])
+
+
+@benchmark('process_helpers')
+def _():
+    from models.analysis import UrbanAnalysis
+
+    analise = UrbanAnalysis()
+    infraestrutura = _infraestrutura_sintetica()
+
+    def executar():
+        analise._process_education_data(infraestrutura)
+        analise._process_health_data(infraestrutura)
+        analise._process_commerce_data(infraestrutura)
+    return executar
+
+
+@benchmark('narrativas')
+def _():
+    from models.analysis import UrbanAnalysis
+
+    analise = UrbanAnalysis()
+    infraestrutura = _infraestrutura_sintetica()
+    dados = {
+        'security': {'crime_rate': 'moderado', 'main_crime_types': ['furto'], 'safety_score': 5},
+        'transport': {'tipos_de_transporte': ['ônibus'], 'estaçoes_contagem': 12, 'pontuaçao_transporte': 7},
+        'infrastructure': infraestrutura,
+        'education': analise._process_education_data(infraestrutura),
+        'health': analise._process_health_data(infraestrutura),
+        'commerce': analise._process_commerce_data(infraestrutura),
+        'environmental': {'green_areas': 3, 'air_quality': 'desconhecida', 'environmental_score': 6}
+    }
+    return lambda: analise._gerar_textos(dados)
+
+
+
+
+def medir(funcao: Callable[[], Any], repeticoes: int) -> Dict[str, float]:
+    """Tempo por chamada (s) - o número de chamadas por amostra é calibrado pelo autorange"""
+    temporizador = timeit.Timer(funcao)
+    chamadas, _ = temporizador.autorange()
+    amostras = [tempo / chamadas for tempo in temporizador.repeat(repeat=repeticoes, number=chamadas)]
+    return {
+        'minimo': min(amostras),
+        'mediana': statistics.median(amostras),
+        'chamadas_por_amostra': chamadas
+    }
+
+
+def _commit_atual() -> str:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        sujo = subprocess.call(['git', 'diff', '--quiet', 'HEAD']) != 0
+        return commit + ('-sujo' if sujo else '')
+    except Exception:
+        return 'desconhecido'
+
+
+def _carregar_referencia(referencia: str) -> Dict[str, Any]:
+    caminho = referencia if os.path.exists(referencia) else None
+    if caminho is None:
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', '--short', referencia], text=True).strip()
+        except Exception:
+            commit = referencia
+        caminho = os.path.join(DIRETORIO_RESULTADOS, f"{commit}.json")
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Microbenchmarks dos caminhos quentes')
+    parser.add_argument('-k', dest='filtro', default='', help='roda só benchmarks cujo nome contém o texto')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--comparar', help='commit ou arquivo de resultado para comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.10, help='piora relativa aceita (padrão 10%%)')
+    parser.add_argument('--nao-gravar', action='store_true', help='não grava o resultado em benchmarks/resultados')
+    args = parser.parse_args()
+
+    resultados = {}
+    for nome, preparar in BENCHMARKS.items():
+        if args.filtro not in nome:
+            continue
+        resultados[nome] = medir(preparar(), args.repeticoes)
+        print(f"{nome:32s} {resultados[nome]['mediana'] * 1e6:12.2f} us/chamada")
+
+    commit = _commit_atual()
+    if not args.nao_gravar:
+        os.makedirs(DIRETORIO_RESULTADOS, exist_ok=True)
+        caminho = os.path.join(DIRETORIO_RESULTADOS, f"{commit}.json")
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            json.dump({
+                'commit': commit,
+                'timestamp': time.time(),
+                'python': sys.version.split()[0],
+                'plataforma': platform.platform(),
+                'resultados': resultados
+            }, arquivo, indent=2)
+        print(f"\nResultados gravados em {caminho}")
+
+    if not args.comparar:
+        return 0
+
+    referencia = _carregar_referencia(args.comparar)['resultados']
+    regressoes = 0
+    print(f"\nComparação com {args.comparar} (mediana):")
+    for nome, atual in resultados.items():
+        if nome not in referencia:
+            continue
+        razao = atual['mediana'] / referencia[nome]['mediana']
+        marca = ''
+        if razao > 1 + args.tolerancia:
+            marca = '  <-- REGRESSÃO'
+            regressoes += 1
+        print(f"{nome:32s} {razao:6.2f}x{marca}")
+    return 1 if regressoes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,12 +10,82 @@ class Config:
 
     # cache
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    # nós do cache separados por vírgula (hash consistente); vazio usa só o REDIS_URL
+    REDIS_NODES = [url.strip() for url in os.getenv('REDIS_NODES', '').split(',') if url.strip()]
+    REDIS_VIRTUAL_NODES = int(os.getenv('REDIS_VIRTUAL_NODES', 160))  # pontos de cada nó no anel
     CACHE_TIMEOUT = int(os.getenv('CACHE_TIMEOUT', 3600))
+    CACHE_TTL_NEGATIVO = int(os.getenv('CACHE_TTL_NEGATIVO', 900))  # endereços/municípios não encontrados
+    CACHE_TTL_JITTER = float(os.getenv('CACHE_TTL_JITTER', '0.1'))  # ±10% em cada TTL
+
+    # validade de cada seção do dossiê no cache (muda em ritmos bem diferentes)
+    CACHE_TTL_GEOCODE = int(os.getenv('CACHE_TTL_GEOCODE', 30 * 86400))
+    CACHE_TTL_IBGE = int(os.getenv('CACHE_TTL_IBGE', 30 * 86400))
+    CACHE_TTL_SEGURANCA = int(os.getenv('CACHE_TTL_SEGURANCA', 30 * 86400))
+    CACHE_TTL_TRANSPORTE = int(os.getenv('CACHE_TTL_TRANSPORTE', 7 * 86400))
+    CACHE_TTL_INFRAESTRUTURA = int(os.getenv('CACHE_TTL_INFRAESTRUTURA', 7 * 86400))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.5'))
+    REDIS_CIRCUIT_FAILURES = int(os.getenv('REDIS_CIRCUIT_FAILURES', 3))  # falhas seguidas até abrir o circuito
+    REDIS_PROBE_INTERVAL = float(os.getenv('REDIS_PROBE_INTERVAL', '5'))
+
+
+    # dados locais pré-processados
+    SECURITY_DATA_DIR = os.getenv('SECURITY_DATA_DIR', 'data/seguranca')
+    GREEN_GRID_DIR = os.getenv('GREEN_GRID_DIR', 'data/areas_verdes')
+    SCORING_DISTRIBUTIONS_PATH = os.getenv('SCORING_DISTRIBUTIONS_PATH', 'data/pontuacao/distribuicoes.npz')
+    SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH', 'data/similaridade/bairros.npz')
+    BOUNDARIES_DIR = os.getenv('BOUNDARIES_DIR', 'data/malhas')  # bairros e setores censitários do IBGE
+
+    # grafos de pedestres (isócronas de caminhada de 5/10/15 min)
+    WALKING_GRAPH_DIR = os.getenv('WALKING_GRAPH_DIR', 'data/grafo_pedestre')
+    WALKING_SPEED_KMH = float(os.getenv('WALKING_SPEED_KMH', '4.8'))
+    WALKING_MAX_SNAP = float(os.getenv('WALKING_MAX_SNAP', 300))  # metros até a rua mais próxima
+    WALKING_CACHE_SIZE = int(os.getenv('WALKING_CACHE_SIZE', 256))  # buscas de Dijkstra guardadas por processo
+
+    # POIs do OSM mantidos localmente (snapshot + diffs .osc de replicação)
+    POI_SNAPSHOT_PATH = os.getenv('POI_SNAPSHOT_PATH', 'data/poi/pois.json.gz')
+    POI_DIFF_DIR = os.getenv('POI_DIFF_DIR', 'data/poi/diffs')
+    POI_DIFF_INTERVAL = int(os.getenv('POI_DIFF_INTERVAL', 60))  # segundos entre verificações em cada worker; 0 desliga
 
 
     RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 60))
+
+    # controle de admissão das rotas que analisam (/api/analyze, /api/summary, /api/similar), por
+    # worker; requisições servidas do cache não entram. Padrão 2 de WEB_THREADS=4: metade das threads
+    # fica livre para hits de cache, health e long-poll de jobs, e com WEB_WORKERS workers são
+    # 2 x WEB_WORKERS análises pedindo Nominatim/Overpass/IBGE ao mesmo tempo, o que já encosta nos
+    # limites por IP das instâncias públicas (Overpass dá 2 slots). Subir junto com WEB_THREADS.
+    ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', 2))
+    ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 4))
+    ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))  # segundos na fila antes do 503
+
+
+    # fila de análises assíncronas (/api/jobs)
+    JOB_BACKEND = os.getenv('JOB_BACKEND', 'auto')  # redis, local ou auto
+    JOB_LOCAL_WORKERS = int(os.getenv('JOB_LOCAL_WORKERS', 4))
+    JOB_WORKER_PROCESSES = int(os.getenv('JOB_WORKER_PROCESSES', 2))
+    JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 3600))
+    JOB_MAX_WAIT = int(os.getenv('JOB_MAX_WAIT', 30))  # espera máxima do long-poll, em segundos
+    JOB_HEARTBEAT_TTL = int(os.getenv('JOB_HEARTBEAT_TTL', 30))  # segundos sem sinal até os jobs do consumidor voltarem à fila
+    JOB_REAPER_INTERVAL = int(os.getenv('JOB_REAPER_INTERVAL', 30))  # segundos entre buscas por consumidores mortos
+
+
+    # servidor de produção (gunicorn com workers pré-forkados, ver gunicorn.conf.py)
+    WEB_BIND = os.getenv('WEB_BIND', '0.0.0.0:5000')
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 4))
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 120))
+    WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+    WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 5000))  # recicla o worker para a memória não crescer
+    WEB_MAX_REQUESTS_JITTER = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 500))
+
+
+    # mapa de calor de acessibilidade
+    HEATMAP_TILE_CELLS = int(os.getenv('HEATMAP_TILE_CELLS', 32))
+    HEATMAP_MIN_ZOOM = int(os.getenv('HEATMAP_MIN_ZOOM', 12))
+    HEATMAP_MAX_ZOOM = int(os.getenv('HEATMAP_MAX_ZOOM', 17))
+    HEATMAP_CACHE_TIMEOUT = int(os.getenv('HEATMAP_CACHE_TIMEOUT', 604800))
     
-    REQUEST_TIMEOUT = 30
+    REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', 30))
     
 
     IBGE_API_BASE = os.getenv('IBGE_API_BASE', 'https://servicodados.ibge.gov.br/api/v1')
@@ -28,5 +98,18 @@ class Config:
     OSM_REQUEST_DELAY = float(os.getenv('OSM_REQUEST_DELAY', '0.1')) # delay entre requests para respeitar rate limits
 
 
+    # diretório onde cada worker grava suas métricas para o /metrics somar todos; vazio = só o processo atual
+    METRICS_DIR = os.getenv('METRICS_DIR', '')
+    METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+    # perfil sob demanda (desligado sem token e com taxa 0)
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+    PROFILE_TRACEMALLOC_FRAMES = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 10))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'data/perfis')
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 50))
+
+
     CORS_ORIGINS = ["*"]  
 
@@ -0,0 +1,88 @@
+"""Configuração do gunicorn para produção
+
+    gunicorn app:app            # lido automaticamente do diretório atual
+    python serve.py             # equivalente
+
+O app é importado uma vez no processo mestre (preload_app) e os indices locais são
+carregados antes do fork, então os workers compartilham essas páginas copy-on-write.
+O gc.freeze() antes de cada fork tira esses objetos das varreduras do coletor, que
+senão escreveriam nos cabeçalhos e forçariam a cópia das páginas.
+
+Recarga sem derrubar requisições:
+    kill -HUP <mestre>     troca os workers (mesmo código; os indices locais são relidos do disco)
+    kill -USR2 <mestre>    sobe um mestre novo com o código atualizado; depois QUIT no antigo
+
+Cada worker aplica sozinho os diffs de POIs que chegam em POI_DIFF_DIR.
+
+As métricas de cada worker vão para METRICS_DIR (um diretório temporário se não for
+configurado), para o /metrics somar todos os processos.
+"""
+import gc
+import tempfile
+from config import Config
+
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+worker_class = 'gthread'
+timeout = Config.WEB_TIMEOUT
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS_JITTER
+preload_app = True
+accesslog = '-'
+
+
+
+
+def on_starting(server):
+    from utils.metrics import REGISTRO
+
+    Config.METRICS_DIR = Config.METRICS_DIR or tempfile.mkdtemp(prefix='dossie-metricas-')
+    REGISTRO.limpar()
+
+
+def when_ready(server):
+    import app
+
+    app.urban_analyzer.aquecer()
+    server.log.info("Indices locais carregados no processo mestre")
+
+
+def on_reload(server):
+    # no HUP os workers novos vêm do mesmo mestre: monta nele indices novos a partir do disco.
+    # gc.unfreeze() devolve os antigos ao coletor (o pre_fork congela tudo de novo)
+    import app
+
+    gc.unfreeze()
+    app.recarregar_indices()
+    gc.collect()
+    server.log.info("Indices locais recarregados no processo mestre")
+
+
+def pre_fork(server, worker):
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+    from utils import cache as cache_module
+    from utils.metrics import REGISTRO
+
+    cache_module.reiniciar_conexoes()
+    REGISTRO.iniciar_gravacao_periodica()
+    app.urban_analyzer.maps_service.pois.iniciar_atualizacao_periodica()
+
+
+def worker_exit(server, worker):
+    # no próprio worker: grava o que foi contado desde a última gravação periódica
+    from utils.metrics import REGISTRO
+
+    REGISTRO.gravar_estado()
+
+
+def child_exit(server, worker):
+    from utils.metrics import REGISTRO
+
+    REGISTRO.arquivar_processo(worker.pid)
@@ -0,0 +1,226 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Tuple
+from urllib.parse import urlparse, parse_qs
+
+
+
+
+# cidades devolvidas pelo Nominatim falso (e conhecidas pelo IBGE falso)
+CIDADES = [
+    ('São Paulo', 'São Paulo', 'SP', 3550308, -23.5505, -46.6333, ['Bela Vista', 'Pinheiros', 'Moema', 'Sé']),
+    ('Rio de Janeiro', 'Rio de Janeiro', 'RJ', 3304557, -22.9068, -43.1729, ['Copacabana', 'Tijuca', 'Centro']),
+    ('Belo Horizonte', 'Minas Gerais', 'MG', 3106200, -19.9167, -43.9345, ['Savassi', 'Funcionários']),
+    ('Recife', 'Pernambuco', 'PE', 2611606, -8.0476, -34.8770, ['Boa Viagem', 'Casa Forte']),
+]
+
+# tags geradas pelo Overpass falso conforme o filtro que aparece na query
+TAGS_POR_FILTRO = [
+    ('bus_stop', {'highway': 'bus_stop'}),
+    ('public_transport', {'public_transport': 'stop_position'}),
+    ('subway_entrance', {'railway': 'subway_entrance'}),
+    ('station', {'railway': 'station'}),
+    ('school', {'amenity': 'school'}),
+    ('hospital', {'amenity': 'hospital'}),
+    ('supermarket', {'shop': 'supermarket'}),
+    ('pharmacy', {'amenity': 'pharmacy'}),
+    ('bank', {'amenity': 'bank'}),
+    ('restaurant', {'amenity': 'restaurant'}),
+]
+
+
+
+
+@dataclass
+class Comportamento:
+    """Latência e falhas de um serviço falso"""
+
+    latencia_mediana_ms: float = 50.0
+    latencia_sigma: float = 0.5        # sigma da lognormal (0 = latência fixa)
+    taxa_erro: float = 0.0             # fração de respostas 500
+    taxa_429: float = 0.0              # fração de respostas 429 com Retry-After
+    retry_after: int = 1
+
+    def sortear_latencia(self, gerador: random.Random) -> float:
+        if self.latencia_sigma <= 0:
+            return self.latencia_mediana_ms / 1000
+        return gerador.lognormvariate(math.log(max(self.latencia_mediana_ms, 0.001)), self.latencia_sigma) / 1000
+
+
+
+
+class ServidorFalso(ABC):
+    """Servidor HTTP local (uma thread por conexão) que imita uma API externa"""
+
+    def __init__(self, nome: str, comportamento: Comportamento, semente: int = 0):
+        self.nome = nome
+        self.comportamento = comportamento
+        self.gerador = random.Random(semente)
+        self._lock_gerador = threading.Lock()
+        self.contagens = {}
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', 0), self._criar_handler())
+        self._servidor.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, porta = self._servidor.server_address
+        return f"http://{host}:{porta}"
+
+    def iniciar(self) -> 'ServidorFalso':
+        self._thread = threading.Thread(target=self._servidor.serve_forever, name=f"falso-{self.nome}", daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    @abstractmethod
+    def responder(self, metodo: str, caminho: str, consulta: Dict[str, List[str]], corpo: str) -> Tuple[int, Any]:
+        """(status, corpo JSON) da requisição"""
+
+    def _sortear(self) -> Tuple[float, float]:
+        with self._lock_gerador:
+            return self.comportamento.sortear_latencia(self.gerador), self.gerador.random()
+
+    def _contar(self, status: int):
+        with self._lock_gerador:
+            self.contagens[status] = self.contagens.get(status, 0) + 1
+
+    def _criar_handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _tratar(self, metodo: str):
+                tamanho = int(self.headers.get('Content-Length') or 0)
+                corpo = self.rfile.read(tamanho).decode('utf-8', 'replace') if tamanho else ''
+                url = urlparse(self.path)
+
+                latencia, sorteio = servidor._sortear()
+                time.sleep(latencia)
+
+                comportamento = servidor.comportamento
+                cabecalhos = {}
+                if sorteio < comportamento.taxa_429:
+                    status, conteudo = 429, {'error': 'rate limited'}
+                    cabecalhos['Retry-After'] = str(comportamento.retry_after)
+                elif sorteio < comportamento.taxa_429 + comportamento.taxa_erro:
+                    status, conteudo = 500, {'error': 'erro simulado'}
+                else:
+                    status, conteudo = servidor.responder(metodo, url.path, parse_qs(url.query), corpo)
+
+                dados = json.dumps(conteudo).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dados)))
+                for chave, valor in cabecalhos.items():
+                    self.send_header(chave, valor)
+                self.end_headers()
+                self.wfile.write(dados)
+                servidor._contar(status)
+
+            def do_GET(self):
+                self._tratar('GET')
+
+            def do_POST(self):
+                self._tratar('POST')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+
+
+class NominatimFalso(ServidorFalso):
+    """/search devolvendo um resultado estável por endereço (a cidade é escolhida pelo hash)"""
+
+    def __init__(self, comportamento: Comportamento, semente: int = 0):
+        super().__init__('nominatim', comportamento, semente)
+
+    def responder(self, metodo, caminho, consulta, corpo):
+        if caminho.rstrip('/') != '/search':
+            return 404, {'error': 'not found'}
+
+        endereco = consulta.get('q', [''])[0]
+        codigo = zlib.crc32(endereco.encode('utf-8'))
+        cidade, estado, _, _, latitude, longitude, bairros = CIDADES[codigo % len(CIDADES)]
+        deslocamento = ((codigo >> 8) % 1000 - 500) / 50000
+
+        return 200, [{
+            'lat': str(latitude + deslocamento),
+            'lon': str(longitude - deslocamento),
+            'display_name': f"{endereco}, {cidade}, {estado}, Brasil",
+            'importance': 0.6,
+            'address': {
+                'suburb': bairros[(codigo >> 4) % len(bairros)],
+                'city': cidade,
+                'state': estado,
+                'postcode': '01000-000',
+                'country': 'Brasil'
+            }
+        }]
+
+
+class OverpassFalso(ServidorFalso):
+    """Interpreter devolvendo elementos sintéticos com as tags pedidas na query"""
+
+    def __init__(self, comportamento: Comportamento, elementos: int = 200, semente: int = 0):
+        super().__init__('overpass', comportamento, semente)
+        self.elementos = elementos
+
+    def responder(self, metodo, caminho, consulta, corpo):
+        query = corpo or consulta.get('data', [''])[0]
+        modelos = [tags for chave, tags in TAGS_POR_FILTRO if chave in query] or [{'amenity': 'bench'}]
+
+        centro = re.search(r'around:\d+,(-?[\d.]+),(-?[\d.]+)', query)
+        latitude, longitude = (float(centro.group(1)), float(centro.group(2))) if centro else (-23.55, -46.63)
+
+        gerador = random.Random(zlib.crc32(query.encode('utf-8')))
+        return 200, {
+            'version': 0.6,
+            'elements': [
+                {
+                    'type': 'node',
+                    'id': indice,
+                    'lat': latitude + gerador.uniform(-0.01, 0.01),
+                    'lon': longitude + gerador.uniform(-0.01, 0.01),
+                    'tags': {**modelos[indice % len(modelos)], 'name': f"Lugar {indice}"}
+                }
+                for indice in range(self.elementos)
+            ]
+        }
+
+
+class IBGEFalso(ServidorFalso):
+    """/localidades/municipios com as cidades conhecidas pelo Nominatim falso"""
+
+    def __init__(self, comportamento: Comportamento, semente: int = 0):
+        super().__init__('ibge', comportamento, semente)
+
+    def responder(self, metodo, caminho, consulta, corpo):
+        if not caminho.rstrip('/').endswith('/localidades/municipios'):
+            return 404, {'error': 'not found'}
+
+        return 200, [
+            {
+                'id': codigo,
+                'nome': cidade,
+                'microrregiao': {'mesorregiao': {'UF': {
+                    'sigla': uf, 'nome': estado, 'regiao': {'nome': 'Brasil'}
+                }}}
+            }
+            for cidade, estado, uf, codigo, _, _, _ in CIDADES
+        ]
@@ -0,0 +1,169 @@
+"""Teste de carga ponta a ponta com Nominatim, Overpass e IBGE falsos
+
+Sobe os servidores falsos em portas locais, aponta as URLs base do Config para eles
+(NOMINATIM_API_BASE, OVERPASS_API_BASE, IBGE_API_BASE), sobe a API e dispara
+/api/analyze e /api/summary na concorrência pedida. Exemplo:
+
+    python -m loadtest.run --concorrencia 32 --duracao 60 --overpass-latencia 400 --overpass-429 0.05
+
+Com --url a carga vai para uma API já rodando (que precisa ter sido iniciada com as URLs
+base dos falsos, impressas no início da execução).
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import requests
+
+from loadtest.fakes import Comportamento, NominatimFalso, OverpassFalso, IBGEFalso
+
+
+
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil por interpolação linear (valores já ordenados)"""
+    if not valores:
+        return float('nan')
+    posicao = (len(valores) - 1) * p / 100
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(valores) - 1)
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (posicao - inferior)
+
+
+def _comportamento(args, servico: str) -> Comportamento:
+    return Comportamento(
+        latencia_mediana_ms=getattr(args, f"{servico}_latencia"),
+        latencia_sigma=args.sigma,
+        taxa_erro=getattr(args, f"{servico}_erro"),
+        taxa_429=getattr(args, f"{servico}_429"),
+    )
+
+
+def _iniciar_api() -> Tuple[str, object]:
+    # importa só depois das variáveis de ambiente apontarem para os falsos
+    import logging
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name='api', daemon=True).start()
+    return f"http://127.0.0.1:{servidor.server_port}", servidor
+
+
+def disparar(url: str, args) -> List[Tuple[str, int, float]]:
+    """Executa a carga e devolve (endpoint, status, latência em s) de cada requisição"""
+    gerador = random.Random(args.semente)
+    enderecos = [f"Rua Teste {indice}, {gerador.randint(1, 2000)}" for indice in range(args.enderecos)]
+    endpoints = ['analyze'] * args.peso_analyze + ['summary'] * args.peso_summary
+
+    resultados = []
+    lock = threading.Lock()
+    sessoes = threading.local()
+    limite = time.monotonic() + args.duracao
+    restantes = [args.requisicoes] if args.requisicoes else None
+
+    def proxima() -> bool:
+        if restantes is None:
+            return time.monotonic() < limite
+        with lock:
+            if restantes[0] <= 0:
+                return False
+            restantes[0] -= 1
+            return True
+
+    def trabalhador(indice: int):
+        sorteio = random.Random(args.semente + indice)
+        sessoes.sessao = requests.Session()
+        while proxima():
+            endpoint = sorteio.choice(endpoints)
+            endereco = sorteio.choice(enderecos)
+            inicio = time.perf_counter()
+            try:
+                resposta = sessoes.sessao.post(f"{url}/api/{endpoint}", json={'endereco': endereco}, timeout=args.timeout)
+                status = resposta.status_code
+            except requests.RequestException:
+                status = 0
+            with lock:
+                resultados.append((endpoint, status, time.perf_counter() - inicio))
+
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+        list(executor.map(trabalhador, range(args.concorrencia)))
+    return resultados
+
+
+def relatorio(resultados: List[Tuple[str, int, float]], duracao: float):
+    print(f"\n{'endpoint':10s} {'req':>7s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}  status")
+    for endpoint in sorted({r[0] for r in resultados}) + ['total']:
+        selecionados = [r for r in resultados if endpoint in ('total', r[0])]
+        latencias = sorted(r[2] * 1000 for r in selecionados)
+        status = {}
+        for _, codigo, _ in selecionados:
+            status[codigo] = status.get(codigo, 0) + 1
+        print(
+            f"{endpoint:10s} {len(selecionados):7d} {len(selecionados) / duracao:8.1f} "
+            f"{percentil(latencias, 50):9.1f} {percentil(latencias, 95):9.1f} {percentil(latencias, 99):9.1f}  "
+            + ' '.join(f"{codigo}:{total}" for codigo, total in sorted(status.items()))
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Teste de carga com APIs externas falsas')
+    parser.add_argument('--url', help='API já rodando (por padrão sobe uma local apontando para os falsos)')
+    parser.add_argument('--concorrencia', type=int, default=16)
+    parser.add_argument('--duracao', type=float, default=30, help='segundos de carga')
+    parser.add_argument('--requisicoes', type=int, default=0, help='total de requisições (ignora --duracao)')
+    parser.add_argument('--enderecos', type=int, default=1000, help='tamanho do conjunto de endereços distintos')
+    parser.add_argument('--peso-analyze', type=int, default=3)
+    parser.add_argument('--peso-summary', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--semente', type=int, default=1)
+    parser.add_argument('--sigma', type=float, default=0.5, help='sigma da latência lognormal dos falsos')
+    parser.add_argument('--overpass-elementos', type=int, default=200)
+    for servico, latencia in (('nominatim', 80), ('overpass', 300), ('ibge', 100)):
+        parser.add_argument(f'--{servico}-latencia', type=float, default=latencia, help='mediana em ms')
+        parser.add_argument(f'--{servico}-erro', type=float, default=0.0, help='fração de respostas 500')
+        parser.add_argument(f'--{servico}-429', type=float, default=0.0, help='fração de respostas 429')
+    args = parser.parse_args()
+
+    falsos = {
+        'nominatim': NominatimFalso(_comportamento(args, 'nominatim'), args.semente).iniciar(),
+        'overpass': OverpassFalso(_comportamento(args, 'overpass'), args.overpass_elementos, args.semente).iniciar(),
+        'ibge': IBGEFalso(_comportamento(args, 'ibge'), args.semente).iniciar(),
+    }
+    os.environ['NOMINATIM_API_BASE'] = falsos['nominatim'].url
+    os.environ['OVERPASS_API_BASE'] = f"{falsos['overpass'].url}/api/interpreter"
+    os.environ['IBGE_API_BASE'] = f"{falsos['ibge'].url}/api/v1"
+    for chave in ('NOMINATIM_API_BASE', 'OVERPASS_API_BASE', 'IBGE_API_BASE'):
+        print(f"{chave}={os.environ[chave]}")
+
+    servidor_api = None
+    url = args.url
+    if not url:
+        url, servidor_api = _iniciar_api()
+    print(f"Carga em {url}: concorrência {args.concorrencia}, "
+          + (f"{args.requisicoes} requisições" if args.requisicoes else f"{args.duracao:.0f}s"))
+
+    inicio = time.monotonic()
+    resultados = disparar(url, args)
+    duracao = time.monotonic() - inicio
+
+    relatorio(resultados, duracao)
+    print("\nrespostas dos falsos: " + ', '.join(
+        f"{nome} {dict(sorted(falso.contagens.items()))}" for nome, falso in falsos.items()
+    ))
+
+    if servidor_api:
+        servidor_api.shutdown()
+    for falso in falsos.values():
+        falso.parar()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,14 @@ from typing import Dict, Any, Optional
 from services.ibge_service import IBGEService
 from services.maps_service import MapsService
 from services.security_service import SecurityService
+from services.environmental_service import EnvironmentalService
+from services.boundaries_service import ResolvedorMalha
 from utils.narrative_generator import NarrativeGenerator
+from utils.scoring import MotorPontuacao
+from utils.similaridade import IndiceSimilaridade
+from utils.metrics import medir_etapa
+from utils.cache import LoteCache
+from utils.admissao import SobrecargaError, exigir_admissao
 
 class UrbanAnalysis:
     """Modelo principal para análise urbana completa"""
@@ -11,12 +18,39 @@ class UrbanAnalysis:
         self.ibge_service = IBGEService()
         self.maps_service = MapsService()
         self.security_service = SecurityService()
+        self.environmental_service = EnvironmentalService()
         self.narrative_generator = NarrativeGenerator()
-    
-    def analyze_neighborhood(self, endereco: str) -> Dict[str, Any]:
-        """Realiza análise completa de um bairro/endereço"""
+        self.motor_pontuacao = MotorPontuacao()
+        self.indice_similaridade = IndiceSimilaridade()
+        self.resolvedor_malha = ResolvedorMalha()
+
+    def aquecer(self):
+        """Carrega os indices locais (segurança, áreas verdes, pontuação, similaridade, malhas, grafos de pedestres, POIs)
+
+        Chamado no processo mestre antes do fork, para os workers compartilharem
+        essas páginas de memória em vez de cada um carregar a sua cópia.
+        """
+        self.security_service.indice.aquecer()
+        self.environmental_service.aquecer()
+        self.motor_pontuacao.aquecer()
+        self.indice_similaridade.aquecer()
+        self.resolvedor_malha.aquecer()
+        self.maps_service.acessibilidade.aquecer()
+        self.maps_service.pois.aquecer()
+
+    def analyze_neighborhood(self, endereco: str = None, latitude: float = None, longitude: float = None) -> Dict[str, Any]:
+        """Realiza análise completa de um bairro/endereço (ou de coordenadas, sem geocodificação)"""
+        # cada seção do dossiê tem chave e validade próprias no cache: depois do geocode
+        # todas saem do Redis num MGET, só as vencidas são recalculadas e voltam num pipeline
+        # (gravado no finally, para valer também no endereço não encontrado e em erros)
+        lote = LoteCache(antes_de_calcular=exigir_admissao)
         try:
-            location_data = self.maps_service.geocode_address(endereco)
+            with medir_etapa('geocode'):
+                if latitude is not None and longitude is not None:
+                    location_data = self._localizar_coordenadas(latitude, longitude, lote)
+                else:
+                    lote.adicionar('geocode', self.maps_service.endereço_geocodigo, endereco)
+                    location_data = self._completar_componentes(lote.resultado('geocode'))
             if not location_data:
                 return {
                     'error': 'Endereço não encontrado',
@@ -27,42 +61,51 @@ class UrbanAnalysis:
             longitude = location_data['longitude']
             componentes = location_data['componentes']
             
-            bairro = componentes.get('bairro', 'Não identificado')
-            cidade = componentes.get('cidade', 'Não identificada')
-            estado = componentes.get('estado', 'Não identificado')
+            bairro = componentes.get('bairro') or 'Não identificado'
+            cidade = componentes.get('cidade') or 'Não identificada'
+            estado = componentes.get('estado') or 'Não identificado'
+            
+            municipio_identificado = cidade != 'Não identificada' and estado != 'Não identificado'
+            if municipio_identificado:
+                lote.adicionar('ibge', self.ibge_service.obter_info_municipio, cidade, estado)
+            lote.adicionar('seguranca', self.security_service.analisar_segurança, cidade, estado, bairro)
+            lote.adicionar('transporte', self.maps_service.analise_transporte, latitude, longitude)
+            lote.adicionar('infraestrutura', self.maps_service.analise_infraestrutura, latitude, longitude)
+            lote.buscar()
             
             demographic_data = {}
-            if cidade != 'Não identificada' and estado != 'Não identificado':
-                demographic_data = self.ibge_service.get_municipio_info(cidade, estado) or {}
+            if municipio_identificado:
+                with medir_etapa('ibge'):
+                    demographic_data = lote.resultado('ibge') or {}
             
-            security_data = self.security_service.analyze_security(cidade, estado, bairro)
+            with medir_etapa('seguranca'):
+                security_data = lote.resultado('seguranca')
             
-            transport_data = self.maps_service.analyze_transport(latitude, longitude)
+            with medir_etapa('transporte'):
+                transport_data = lote.resultado('transporte')
             
-            infrastructure_data = self.maps_service.analyze_infrastructure(latitude, longitude)
+            with medir_etapa('infraestrutura'):
+                infrastructure_data = lote.resultado('infraestrutura')
             
             education_data = self._process_education_data(infrastructure_data)
             health_data = self._process_health_data(infrastructure_data)
             commerce_data = self._process_commerce_data(infrastructure_data)
-            environmental_data = self._process_environmental_data(latitude, longitude)
-            
-            narratives = self._generate_narratives({
-                'security': security_data,
-                'transport': transport_data,
-                'education': education_data,
-                'health': health_data,
-                'commerce': commerce_data,
-                'environmental': environmental_data
-            })
+            with medir_etapa('ambiental'):
+                environmental_data = self._process_environmental_data(latitude, longitude)
             
-            final_analysis = self.narrative_generator.generate_final_analysis({
-                'security': security_data,
-                'transport': transport_data,
-                'education': education_data,
-                'health': health_data,
-                'commerce': commerce_data,
-                'environmental': environmental_data
-            })
+            with medir_etapa('pontuacao'):
+                self._aplicar_pontuacoes(cidade, transport_data, infrastructure_data, environmental_data)
+            
+            with medir_etapa('narrativa'):
+                narratives, final_analysis = self._gerar_textos({
+                    'security': security_data,
+                    'transport': transport_data,
+                    'infrastructure': infrastructure_data,
+                    'education': education_data,
+                    'health': health_data,
+                    'commerce': commerce_data,
+                    'environmental': environmental_data
+                })
             
             result = {
                 'bairro': bairro,
@@ -73,6 +116,8 @@ class UrbanAnalysis:
                     'longitude': longitude
                 },
                 'endereco_formatado': location_data['endereco_formatado'],
+                'setor_censitario': componentes.get('setor_censitario'),
+                'secoes': dict(lote.origens),  # de onde veio cada seção: cache ou calculado agora
                 
                 #narrativas por categoria
                 'seguranca': narratives['security'],
@@ -88,7 +133,8 @@ class UrbanAnalysis:
                     'demografia': demographic_data,
                     'seguranca': security_data,
                     'transporte': transport_data,
-                    'infraestrutura': infrastructure_data
+                    'infraestrutura': infrastructure_data,
+                    'ambiental': environmental_data
                 },
                 
                 # Metadados
@@ -98,19 +144,56 @@ class UrbanAnalysis:
             
             return result
             
+        except SobrecargaError:
+            raise
         except Exception as e:
             return {
                 'error': 'Erro na análise',
                 'message': f'Ocorreu um erro durante a análise: {str(e)}',
                 'details': 'Tente novamente ou verifique se o endereço está correto.'
             }
+        finally:
+            lote.gravar()
+    
+    def _localizar_coordenadas(self, latitude: float, longitude: float, lote: LoteCache) -> Optional[Dict[str, Any]]:
+        """Componentes pelas malhas do IBGE; fora delas, geocodificação reversa no Nominatim"""
+        componentes = self.resolvedor_malha.resolver(latitude, longitude)
+        if componentes is None:
+            lote.adicionar('reverse_geocode', self.maps_service.coordenadas_endereco, latitude, longitude)
+            location_data = lote.resultado('reverse_geocode')
+            if location_data:
+                location_data.update({'latitude': latitude, 'longitude': longitude})
+            return location_data
+        
+        partes = [componentes.get('bairro'), componentes.get('cidade'), componentes.get('estado')]
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            'endereco_formatado': ', '.join(parte for parte in partes if parte),
+            'componentes': componentes,
+            'confianca': 1.0
+        }
+    
+    def _completar_componentes(self, location_data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Preenche bairro/cidade ausentes no Nominatim e acrescenta o setor censitário"""
+        if not location_data:
+            return location_data
+        
+        malha = self.resolvedor_malha.resolver(location_data['latitude'], location_data['longitude'])
+        if malha:
+            componentes = dict(location_data['componentes'])
+            for campo, valor in malha.items():
+                if valor and not componentes.get(campo):
+                    componentes[campo] = valor
+            location_data = {**location_data, 'componentes': componentes}
+        return location_data
     
     def _process_education_data(self, infrastructure_data: Dict[str, Any]) -> Dict[str, Any]:
         """Processa dados educacionais da infraestrutura"""
         escolas_data = infrastructure_data.get('escolas', {})
         
-        school_count = escolas_data.get('count', 0)
-        schools = escolas_data.get('places', [])
+        school_count = escolas_data.get('contagem', 0)
+        schools = escolas_data.get('lugares', [])
         
         school_types = []
         for school in schools:
@@ -128,13 +211,13 @@ class UrbanAnalysis:
             'school_count': school_count,
             'school_types': list(set(school_types)) or ['escolas públicas'],
             'schools_nearby': schools[:3],  # top 3 mais proximas
-            'score': escolas_data.get('score', 0)
+            'score': escolas_data.get('pontuacao', 0)
         }
     
     def _process_health_data(self, infrastructure_data: Dict[str, Any]) -> Dict[str, Any]:
         """Processa dados de saúde da infraestrutura"""
-        hospitais = infrastructure_data.get('hospitais', {}).get('places', [])
-        farmacias = infrastructure_data.get('farmacias', {}).get('places', [])
+        hospitais = infrastructure_data.get('hospitais', {}).get('lugares', [])
+        farmacias = infrastructure_data.get('farmacias', {}).get('lugares', [])
         
         health_facilities = []
         
@@ -154,8 +237,8 @@ class UrbanAnalysis:
         
         return {
             'health_facilities': health_facilities,
-            'hospital_count': len(hospitais),
-            'pharmacy_count': len(farmacias),
+            'hospital_count': infrastructure_data.get('hospitais', {}).get('contagem', len(hospitais)),
+            'pharmacy_count': infrastructure_data.get('farmacias', {}).get('contagem', len(farmacias)),
             'total_facilities': len(health_facilities)
         }
     
@@ -172,42 +255,65 @@ class UrbanAnalysis:
         }
         
         for category, commerce_type in category_mapping.items():
-            if infrastructure_data.get(category, {}).get('count', 0) > 0:
+            if infrastructure_data.get(category, {}).get('contagem', 0) > 0:
                 commerce_types.append(commerce_type)
         
         return {
             'commerce_types': commerce_types,
             'total_establishments': sum(
-                infrastructure_data.get(cat, {}).get('count', 0) 
+                infrastructure_data.get(cat, {}).get('contagem', 0) 
                 for cat in category_mapping.keys()
             )
         }
     
     def _process_environmental_data(self, latitude: float, longitude: float) -> Dict[str, Any]:
-        """Processa dados ambientais (simulado - em produção integraria com APIs específicas)"""
+        """Processa dados ambientais a partir da grade de cobertura verde pré-calculada"""
+        dados_ambientais = self.environmental_service.analisar_ambiente(latitude, longitude)
+        if dados_ambientais:
+            return dados_ambientais
 
-        import random
-        
-        green_areas = random.randint(0, 5)
-        
-        air_quality_options = ['boa', 'moderada', 'ruim', 'desconhecida']
-        air_quality = random.choice(air_quality_options)
-        
+        # cidade sem grade calculada
         return {
-            'green_areas': green_areas,
-            'air_quality': air_quality,
-            'environmental_score': random.randint(3, 8)
+            'green_areas': None,
+            'green_coverage': None,
+            'air_quality': 'desconhecida',
+            'environmental_score': 5,
+            'data_source': 'Sem dados ambientais para a região'
         }
     
+    def _aplicar_pontuacoes(self, cidade: str, transport_data: Dict[str, Any],
+                            infrastructure_data: Dict[str, Any], environmental_data: Dict[str, Any]):
+        """Substitui as notas com teto fixo por percentis da distribuição da cidade"""
+        indicadores = {
+            categoria: dados.get('contagem')
+            for categoria, dados in infrastructure_data.items()
+        }
+        indicadores['transporte'] = transport_data.get('estaçoes_contagem')
+        indicadores['cobertura_verde'] = environmental_data.get('green_coverage')
+
+        notas = self.motor_pontuacao.pontuar(cidade, indicadores)
+
+        for categoria, dados in infrastructure_data.items():
+            if categoria in notas:
+                dados['pontuacao'] = notas[categoria]
+        if 'transporte' in notas:
+            transport_data['pontuaçao_transporte'] = notas['transporte']
+        if 'cobertura_verde' in notas:
+            environmental_data['environmental_score'] = notas['cobertura_verde']
+    
+    def _gerar_textos(self, data: Dict[str, Any]):
+        """Gera as narrativas por categoria e a análise final"""
+        return self._generate_narratives(data), self.narrative_generator.gerar_analise_final(data)
+    
     def _generate_narratives(self, data: Dict[str, Any]) -> Dict[str, str]:
         """Gera narrativas para cada categoria"""
         return {
-            'security': self.narrative_generator.generate_security_narrative(data['security']),
-            'transport': self.narrative_generator.generate_transport_narrative(data['transport']),
-            'education': self.narrative_generator.generate_education_narrative(data['education']),
-            'health': self.narrative_generator.generate_health_narrative(data['health']),
-            'commerce': self.narrative_generator.generate_commerce_narrative(data['commerce']),
-            'environmental': self.narrative_generator.generate_environmental_narrative(data['environmental'])
+            'security': self.narrative_generator.gerar_narrativa_seguranca(data['security']),
+            'transport': self.narrative_generator.gerar_narrativa_transporte(data['transport']),
+            'education': self.narrative_generator.gerar_narrativa_educacao(data['education']),
+            'health': self.narrative_generator.gerar_narrativa_saude(data['health']),
+            'commerce': self.narrative_generator.gerar_narrativa_comercio(data['commerce']),
+            'environmental': self.narrative_generator.gerar_narrativa_ambiental(data['environmental'])
         }
     
     def _get_timestamp(self) -> str:
@@ -229,13 +335,39 @@ class UrbanAnalysis:
                 'resumo': {
                     'seguranca': full_analysis['seguranca'][:100] + '...',
                     'transporte': full_analysis['transporte'][:100] + '...',
-                    'infraestrutura': f"Região com {full_analysis['dados_brutos']['infraestrutura'].get('escolas', {}).get('count', 0)} escolas próximas"
+                    'infraestrutura': f"Região com {full_analysis['dados_brutos']['infraestrutura'].get('escolas', {}).get('contagem', 0)} escolas próximas"
                 },
                 'coordenadas': full_analysis['coordenadas']
             }
             
+        except SobrecargaError:
+            raise
         except Exception as e:
             return {
                 'error': 'Erro no resumo',
                 'message': str(e)
-            }
\ No newline at end of file
+            }
+    
+    def buscar_bairros_similares(self, endereco: str, k: int = 5, mesmo_estado: bool = False) -> Dict[str, Any]:
+        """Retorna os k bairros do indice (montado offline) mais parecidos com o do endereço"""
+        try:
+            full_analysis = self.analyze_neighborhood(endereco)
+            
+            if 'error' in full_analysis:
+                return full_analysis
+            
+            return {
+                'bairro': full_analysis['bairro'],
+                'cidade': full_analysis['cidade'],
+                'estado': full_analysis['estado'],
+                'similares': self.indice_similaridade.buscar_similares(full_analysis, k, mesmo_estado),
+                'bairros_indexados': len(self.indice_similaridade)
+            }
+            
+        except SobrecargaError:
+            raise
+        except Exception as e:
+            return {
+                'error': 'Erro na busca de similares',
+                'message': str(e)
+            }
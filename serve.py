@@ -0,0 +1,19 @@
+"""Ponto de entrada de produção: gunicorn com a configuração de gunicorn.conf.py
+
+Argumentos extras são repassados ao gunicorn (ex.: python serve.py --workers 8).
+Para desenvolvimento continue usando python app.py.
+"""
+import os
+import sys
+
+from gunicorn.app.wsgiapp import run
+
+
+CONFIGURACAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py')
+
+
+
+
+if __name__ == '__main__':
+    sys.argv = [sys.argv[0], '--config', CONFIGURACAO, *sys.argv[1:], 'app:app']
+    sys.exit(run())
@@ -0,0 +1,268 @@
+import argparse
+import json
+import math
+import os
+import threading
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
+from config import Config
+from utils.geometria import aneis_do_poligono
+
+
+
+
+# camadas da malha, na ordem de prioridade do bairro: a de bairros do IBGE é mais
+# completa, mas a de setores também traz NM_BAIRRO e cobre o que ela não tiver
+CAMADAS = ('bairros', 'setores')
+
+# nomes de propriedade aceitos (malhas do IBGE de 2010 e de 2022)
+PROPRIEDADES = {
+    'setor': ('CD_SETOR', 'CD_GEOCODI'),
+    'bairro': ('NM_BAIRRO', 'NM_BAIRROS'),
+    'codigo_municipio': ('CD_MUN', 'CD_GEOCODM', 'CD_MUNICIP'),
+    'cidade': ('NM_MUN', 'NM_MUNICIP'),
+    'estado': ('NM_UF',),
+    'uf': ('SIGLA_UF', 'SIGLA')
+}
+
+# número médio de bounding boxes por célula da grade do indice
+FEICOES_POR_CELULA = 4
+
+
+
+
+def _primeira_propriedade(propriedades: Dict[str, Any], chaves: Tuple[str, ...]) -> Optional[str]:
+    for chave in chaves:
+        valor = propriedades.get(chave)
+        if valor not in (None, ''):
+            return str(valor).strip()
+    return None
+
+
+
+
+class ConstrutorMalha:
+    """Converte um GeoJSON de bairros ou setores censitários do IBGE no formato do resolvedor
+
+    Cada camada vira um .npz com os vértices de todos os anéis em sequência, os
+    offsets de anel e de feição, as bounding boxes e uma grade uniforme sobre elas
+    (em CSR: célula -> feições cuja bbox a toca).
+    """
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or Config.BOUNDARIES_DIR
+
+    def construir(self, camada: str, caminho_geojson: str) -> Dict[str, Any]:
+        if camada not in CAMADAS:
+            raise ValueError(f"Camada deve ser uma de {CAMADAS}")
+        with open(caminho_geojson, encoding='utf-8') as arquivo:
+            features = json.load(arquivo).get('features', [])
+
+        vertices, inicio_aneis, inicio_feicoes, bboxes, atributos = [], [0], [0], [], []
+        for feature in features:
+            if not feature.get('geometry'):
+                continue
+            # todos os anéis de todos os polígonos: o teste par-ímpar trata buracos e multipolígonos
+            aneis = [anel for poligono in aneis_do_poligono(feature['geometry']) for anel in poligono]
+            if not aneis:
+                continue
+
+            for anel in aneis:
+                if not np.array_equal(anel[0], anel[-1]):
+                    anel = np.vstack([anel, anel[:1]])
+                vertices.append(anel)
+                inicio_aneis.append(inicio_aneis[-1] + len(anel))
+            inicio_feicoes.append(len(inicio_aneis) - 1)
+
+            todos = np.concatenate(aneis)
+            bboxes.append((*todos.min(axis=0), *todos.max(axis=0)))
+
+            propriedades = feature.get('properties') or {}
+            atributos.append({
+                campo: _primeira_propriedade(propriedades, chaves) for campo, chaves in PROPRIEDADES.items()
+            })
+
+        if not atributos:
+            raise ValueError(f"Nenhum polígono em {caminho_geojson}")
+
+        bboxes = np.asarray(bboxes, dtype=np.float64)
+        grade, inicio_celulas, feicoes_celulas = self._indexar(bboxes)
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        caminho = os.path.join(self.diretorio, f"{camada}.npz")
+        # troca atômica: um worker que (re)carregue agora nunca lê o arquivo pela metade
+        with open(caminho + '.tmp', 'wb') as arquivo:
+            np.savez(
+                arquivo,
+                vertices=np.concatenate(vertices),
+                inicio_aneis=np.asarray(inicio_aneis, dtype=np.int64),
+                inicio_feicoes=np.asarray(inicio_feicoes, dtype=np.int64),
+                bboxes=bboxes,
+                grade=grade,
+                inicio_celulas=inicio_celulas,
+                feicoes_celulas=feicoes_celulas,
+                atributos=np.array(json.dumps(atributos, ensure_ascii=False))
+            )
+        os.replace(caminho + '.tmp', caminho)
+        return {'camada': camada, 'feicoes': len(atributos), 'celulas': int(grade[4] * grade[5])}
+
+    def _indexar(self, bboxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Grade uniforme sobre as bboxes: (lon0, lat0, passo_lon, passo_lat, linhas, colunas) e o CSR"""
+        lon0, lat0 = bboxes[:, 0].min(), bboxes[:, 1].min()
+        largura = max(bboxes[:, 2].max() - lon0, 1e-9)
+        altura = max(bboxes[:, 3].max() - lat0, 1e-9)
+
+        celulas = max(len(bboxes) / FEICOES_POR_CELULA, 1)
+        passo = math.sqrt(largura * altura / celulas)
+        colunas = max(int(math.ceil(largura / passo)), 1)
+        linhas = max(int(math.ceil(altura / passo)), 1)
+        passo_lon, passo_lat = largura / colunas, altura / linhas
+
+        j0 = np.clip(((bboxes[:, 0] - lon0) / passo_lon).astype(np.int64), 0, colunas - 1)
+        j1 = np.clip(((bboxes[:, 2] - lon0) / passo_lon).astype(np.int64), 0, colunas - 1)
+        i0 = np.clip(((bboxes[:, 1] - lat0) / passo_lat).astype(np.int64), 0, linhas - 1)
+        i1 = np.clip(((bboxes[:, 3] - lat0) / passo_lat).astype(np.int64), 0, linhas - 1)
+
+        # enumera as células de cada bbox sem laço em Python
+        largura_bbox = j1 - j0 + 1
+        quantidade = (i1 - i0 + 1) * largura_bbox
+        feicao = np.repeat(np.arange(len(bboxes)), quantidade)
+        deslocamento = np.arange(quantidade.sum()) - np.repeat(np.cumsum(quantidade) - quantidade, quantidade)
+        celula = (i0[feicao] + deslocamento // largura_bbox[feicao]) * colunas + j0[feicao] + deslocamento % largura_bbox[feicao]
+
+        ordem = np.argsort(celula, kind='stable')
+        inicio_celulas = np.zeros(linhas * colunas + 1, dtype=np.int64)
+        np.cumsum(np.bincount(celula, minlength=linhas * colunas), out=inicio_celulas[1:])
+
+        grade = np.array([lon0, lat0, passo_lon, passo_lat, linhas, colunas], dtype=np.float64)
+        return grade, inicio_celulas, feicao[ordem].astype(np.int32)
+
+
+
+
+class _Camada:
+    """Uma camada carregada: arrays do .npz e a consulta ponto-em-polígono"""
+
+    def __init__(self, caminho: str):
+        with np.load(caminho) as dados:
+            self.vertices = dados['vertices']
+            self.inicio_aneis = dados['inicio_aneis']
+            self.inicio_feicoes = dados['inicio_feicoes']
+            self.bboxes = dados['bboxes']
+            self.inicio_celulas = dados['inicio_celulas']
+            self.feicoes_celulas = dados['feicoes_celulas']
+            self.lon0, self.lat0, self.passo_lon, self.passo_lat, linhas, colunas = dados['grade'].tolist()
+            self.atributos = json.loads(str(dados['atributos']))
+        self.linhas, self.colunas = int(linhas), int(colunas)
+
+    def localizar(self, latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+        i = int((latitude - self.lat0) // self.passo_lat)
+        j = int((longitude - self.lon0) // self.passo_lon)
+        # a borda máxima da grade cai uma célula além da última: vale a última
+        # (pontos que passam do máximo são descartados pelas bboxes logo abaixo)
+        if i == self.linhas:
+            i -= 1
+        if j == self.colunas:
+            j -= 1
+        if not (0 <= i < self.linhas and 0 <= j < self.colunas):
+            return None
+
+        celula = i * self.colunas + j
+        for feicao in self.feicoes_celulas[self.inicio_celulas[celula]:self.inicio_celulas[celula + 1]].tolist():
+            lon_min, lat_min, lon_max, lat_max = self.bboxes[feicao].tolist()
+            if lon_min <= longitude <= lon_max and lat_min <= latitude <= lat_max and self._contem(feicao, longitude, latitude):
+                return self.atributos[feicao]
+        return None
+
+    def _contem(self, feicao: int, x: float, y: float) -> bool:
+        """Teste par-ímpar (raio para +x) sobre todos os anéis da feição; a borda conta como dentro"""
+        dentro = False
+        for anel in range(self.inicio_feicoes[feicao], self.inicio_feicoes[feicao + 1]):
+            pontos = self.vertices[self.inicio_aneis[anel]:self.inicio_aneis[anel + 1]]
+            x0, y0 = pontos[:-1, 0], pontos[:-1, 1]
+            x1, y1 = pontos[1:, 0], pontos[1:, 1]
+            cruza = (y0 > y) != (y1 > y)
+            if not cruza.any():
+                continue
+            x0, y0, x1, y1 = x0[cruza], y0[cruza], x1[cruza], y1[cruza]
+            intersecoes = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+            if np.count_nonzero(intersecoes > x) % 2:
+                dentro = not dentro
+        return dentro or self._na_borda(feicao, x, y)
+
+    def _na_borda(self, feicao: int, x: float, y: float) -> bool:
+        """Se o ponto está sobre algum lado da feição (o par-ímpar deixa de fora as bordas de cima e da direita)"""
+        inicio, fim = self.inicio_aneis[self.inicio_feicoes[feicao]], self.inicio_aneis[self.inicio_feicoes[feicao + 1]]
+        pontos = self.vertices[inicio:fim]
+        x0, y0 = pontos[:-1, 0], pontos[:-1, 1]
+        x1, y1 = pontos[1:, 0], pontos[1:, 1]
+        # o último vértice de um anel e o primeiro do seguinte não formam lado
+        lados = np.ones(len(x0), dtype=bool)
+        lados[self.inicio_aneis[self.inicio_feicoes[feicao] + 1:self.inicio_feicoes[feicao + 1]] - inicio - 1] = False
+        colineares = np.abs((x1 - x0) * (y - y0) - (y1 - y0) * (x - x0)) <= 1e-12
+        dentro_x = (np.minimum(x0, x1) <= x) & (x <= np.maximum(x0, x1))
+        dentro_y = (np.minimum(y0, y1) <= y) & (y <= np.maximum(y0, y1))
+        return bool((lados & colineares & dentro_x & dentro_y).any())
+
+
+
+
+class ResolvedorMalha:
+    """Bairro, município e setor censitário de uma coordenada, pelas malhas do IBGE"""
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or Config.BOUNDARIES_DIR
+        self._camadas = None
+        self._lock = threading.Lock()
+
+    def _carregar(self) -> Dict[str, _Camada]:
+        if self._camadas is not None:
+            return self._camadas
+
+        with self._lock:
+            if self._camadas is None:
+                camadas = {}
+                for camada in CAMADAS:
+                    caminho = os.path.join(self.diretorio, f"{camada}.npz")
+                    if os.path.exists(caminho):
+                        camadas[camada] = _Camada(caminho)
+                self._camadas = camadas
+        return self._camadas
+
+    def aquecer(self):
+        """Carrega as malhas agora, em vez de na primeira consulta"""
+        self._carregar()
+
+    def resolver(self, latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+        """Componentes do endereço no formato do geocode, ou None fora das malhas carregadas"""
+        encontrados = {}
+        for nome, camada in self._carregar().items():
+            atributos = camada.localizar(latitude, longitude)
+            if atributos:
+                encontrados[nome] = atributos
+        if not encontrados:
+            return None
+
+        setor = encontrados.get('setores', {})
+        bairro = next((a['bairro'] for a in encontrados.values() if a.get('bairro')), None)
+        qualquer = next(iter(encontrados.values()))
+        return {
+            'bairro': bairro,
+            'cidade': qualquer.get('cidade'),
+            'estado': qualquer.get('estado') or qualquer.get('uf'),
+            'codigo_municipio': qualquer.get('codigo_municipio'),
+            'setor_censitario': setor.get('setor'),
+            'pais': 'Brasil'
+        }
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prepara as malhas de bairros/setores do IBGE para o resolvedor')
+    parser.add_argument('camada', choices=CAMADAS)
+    parser.add_argument('geojson', help='malha do IBGE convertida para GeoJSON (EPSG:4326)')
+    args = parser.parse_args()
+
+    resumo = ConstrutorMalha().construir(args.camada, args.geojson)
+    print(f"{resumo['camada']}: {resumo['feicoes']} feições em {resumo['celulas']} células")
@@ -0,0 +1,234 @@
+import json
+import math
+import os
+import argparse
+import threading
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
+from config import Config
+from utils.normalizacao import normalizar_texto
+from utils.geometria import METROS_POR_GRAU, aneis_do_poligono
+
+
+
+
+# tags OSM consideradas area verde quando o GeoJSON traz as propriedades
+TAGS_VERDES = {
+    'leisure': {'park', 'garden', 'nature_reserve'},
+    'landuse': {'forest', 'grass', 'meadow', 'recreation_ground', 'village_green'},
+    'natural': {'wood', 'scrub', 'grassland', 'heath', 'wetland'}
+}
+
+
+
+
+def _eh_area_verde(propriedades: Dict[str, Any]) -> bool:
+    tags = propriedades.get('tags', propriedades)
+    if not tags:
+        # GeoJSON sem tags: assume que ja foi filtrado na exportação
+        return True
+    return any(tags.get(chave) in valores for chave, valores in TAGS_VERDES.items())
+
+
+def _centroide(anel: np.ndarray) -> Tuple[float, float]:
+    """Centroide de area (fórmula do shoelace) do anel externo"""
+    x, y = anel[:, 0], anel[:, 1]
+    cruzado = x * np.roll(y, -1) - np.roll(x, -1) * y
+    area = cruzado.sum() / 2
+    if abs(area) < 1e-15:
+        return float(x.mean()), float(y.mean())
+    cx = ((x + np.roll(x, -1)) * cruzado).sum() / (6 * area)
+    cy = ((y + np.roll(y, -1)) * cruzado).sum() / (6 * area)
+    return float(cx), float(cy)
+
+
+
+
+class ConstrutorGradeVerde:
+    """Rasteriza poligonos verdes do OSM em uma grade de cobertura por cidade
+
+    A grade é gravada como tabela de somas acumuladas (summed-area table) em um .npy
+    que o EnvironmentalService abre via memmap, então cada consulta é O(1).
+    """
+
+    def __init__(self, diretorio: str = None, resolucao: float = 20.0):
+        self.diretorio = diretorio or Config.GREEN_GRID_DIR
+        self.resolucao = resolucao
+
+    def construir(self, cidade: str, caminho_geojson: str) -> Dict[str, Any]:
+        """Gera a grade da cidade a partir de um GeoJSON de poligonos verdes"""
+        with open(caminho_geojson, encoding='utf-8') as arquivo:
+            features = json.load(arquivo).get('features', [])
+
+        poligonos = []
+        for feature in features:
+            if not feature.get('geometry') or not _eh_area_verde(feature.get('properties') or {}):
+                continue
+            poligonos.extend(p for p in aneis_do_poligono(feature['geometry']) if p)
+
+        if not poligonos:
+            raise ValueError(f"Nenhum poligono verde em {caminho_geojson}")
+
+        todos = np.concatenate([anel for poligono in poligonos for anel in poligono])
+        lon_min, lat_min = todos.min(axis=0)
+        lon_max, lat_max = todos.max(axis=0)
+
+        # margem de 2km para consultas na borda da cidade
+        margem_lat = 2000 / METROS_POR_GRAU
+        margem_lon = 2000 / (METROS_POR_GRAU * math.cos(math.radians((lat_min + lat_max) / 2)))
+        lat_min, lat_max = lat_min - margem_lat, lat_max + margem_lat
+        lon_min, lon_max = lon_min - margem_lon, lon_max + margem_lon
+
+        passo_lat = self.resolucao / METROS_POR_GRAU
+        passo_lon = self.resolucao / (METROS_POR_GRAU * math.cos(math.radians((lat_min + lat_max) / 2)))
+        linhas = int(math.ceil((lat_max - lat_min) / passo_lat))
+        colunas = int(math.ceil((lon_max - lon_min) / passo_lon))
+
+        cobertura = np.zeros((linhas, colunas), dtype=np.uint8)
+        centroides = np.zeros((linhas, colunas), dtype=np.int32)
+
+        for poligono in poligonos:
+            # coordenadas em unidades de celula
+            aneis = [np.column_stack(((anel[:, 0] - lon_min) / passo_lon, (anel[:, 1] - lat_min) / passo_lat))
+                     for anel in poligono]
+            self._rasterizar(aneis, cobertura)
+
+            cx, cy = _centroide(aneis[0])
+            i, j = int(cy), int(cx)
+            if 0 <= i < linhas and 0 <= j < colunas:
+                centroides[i, j] += 1
+
+        slug = normalizar_texto(cidade).replace(' ', '-')
+        os.makedirs(self.diretorio, exist_ok=True)
+        caminho_grade = os.path.join(self.diretorio, f"{slug}.npy")
+        caminho_meta = os.path.join(self.diretorio, f"{slug}.json")
+
+        # grava tudo em temporários e só então troca: os workers têm o .npy atual em memmap,
+        # e reescrevê-lo no lugar derrubaria quem estivesse lendo (SIGBUS)
+        somas = np.lib.format.open_memmap(
+            caminho_grade + '.tmp', mode='w+',
+            dtype=np.int32, shape=(2, linhas + 1, colunas + 1)
+        )
+        somas[:, 0, :] = 0
+        somas[:, :, 0] = 0
+        somas[0, 1:, 1:] = cobertura.cumsum(axis=0, dtype=np.int32).cumsum(axis=1, dtype=np.int32)
+        somas[1, 1:, 1:] = centroides.cumsum(axis=0).cumsum(axis=1)
+        somas.flush()
+        del somas
+
+        meta = {
+            'cidade': cidade,
+            'lat_min': lat_min, 'lon_min': lon_min,
+            'lat_max': lat_max, 'lon_max': lon_max,
+            'passo_lat': passo_lat, 'passo_lon': passo_lon,
+            'resolucao': self.resolucao,
+            'linhas': linhas, 'colunas': colunas,
+            'poligonos': len(poligonos)
+        }
+        with open(caminho_meta + '.tmp', 'w', encoding='utf-8') as arquivo:
+            json.dump(meta, arquivo, indent=2)
+
+        os.replace(caminho_grade + '.tmp', caminho_grade)
+        os.replace(caminho_meta + '.tmp', caminho_meta)
+        return meta
+
+    def _rasterizar(self, aneis: List[np.ndarray], grade: np.ndarray):
+        """Preenche por varredura de linhas (regra par-ímpar, entao buracos ficam vazios)"""
+        inicio = np.concatenate([anel for anel in aneis])
+        fim = np.concatenate([np.roll(anel, -1, axis=0) for anel in aneis])
+        x0, y0, x1, y1 = inicio[:, 0], inicio[:, 1], fim[:, 0], fim[:, 1]
+
+        linha_min = max(int(math.floor(min(y0.min(), y1.min()))), 0)
+        linha_max = min(int(math.ceil(max(y0.max(), y1.max()))), grade.shape[0])
+
+        for linha in range(linha_min, linha_max):
+            y = linha + 0.5  # centro da celula
+            cruza = (y0 <= y) != (y1 <= y)
+            if not cruza.any():
+                continue
+            xs = x0[cruza] + (y - y0[cruza]) * (x1[cruza] - x0[cruza]) / (y1[cruza] - y0[cruza])
+            xs.sort()
+            for xa, xb in zip(xs[0::2], xs[1::2]):
+                coluna_a = max(int(math.ceil(xa - 0.5)), 0)
+                coluna_b = min(int(math.floor(xb - 0.5)) + 1, grade.shape[1])
+                if coluna_b > coluna_a:
+                    grade[linha, coluna_a:coluna_b] = 1
+
+
+
+
+class EnvironmentalService:
+    """Consulta de cobertura verde sobre as grades pré-calculadas (memmap + somas acumuladas)"""
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or Config.GREEN_GRID_DIR
+        self._grades = None
+        self._lock = threading.Lock()
+
+    def _carregar_grades(self) -> List[Tuple[Dict[str, Any], np.ndarray]]:
+        if self._grades is not None:
+            return self._grades
+
+        with self._lock:
+            if self._grades is None:
+                grades = []
+                if os.path.isdir(self.diretorio):
+                    for nome in sorted(os.listdir(self.diretorio)):
+                        if not nome.endswith('.json'):
+                            continue
+                        with open(os.path.join(self.diretorio, nome), encoding='utf-8') as arquivo:
+                            meta = json.load(arquivo)
+                        somas = np.load(os.path.join(self.diretorio, nome[:-5] + '.npy'), mmap_mode='r')
+                        if somas.shape != (2, meta['linhas'] + 1, meta['colunas'] + 1):
+                            # lido entre as duas trocas de uma reconstrução: fica para a próxima carga
+                            print(f"Grade verde {nome[:-5]} não confere com os metadados, ignorada")
+                            continue
+                        grades.append((meta, somas))
+                self._grades = grades
+        return self._grades
+
+    def aquecer(self):
+        """Abre as grades agora, em vez de na primeira consulta"""
+        self._carregar_grades()
+
+    def analisar_ambiente(self, latitude: float, longitude: float, raio: float = 1000) -> Optional[Dict[str, Any]]:
+        """Conta areas verdes e a fração coberta por vegetação em volta do ponto"""
+        for meta, somas in self._carregar_grades():
+            if not (meta['lat_min'] <= latitude < meta['lat_max'] and meta['lon_min'] <= longitude < meta['lon_max']):
+                continue
+
+            i = int((latitude - meta['lat_min']) / meta['passo_lat'])
+            j = int((longitude - meta['lon_min']) / meta['passo_lon'])
+
+            # quadrado de mesma area do circulo de raio informado
+            meio_lado = max(int(round(raio * math.sqrt(math.pi) / 2 / meta['resolucao'])), 1)
+            i0, i1 = max(i - meio_lado, 0), min(i + meio_lado + 1, meta['linhas'])
+            j0, j1 = max(j - meio_lado, 0), min(j + meio_lado + 1, meta['colunas'])
+
+            janela = somas[:, i1, j1] - somas[:, i0, j1] - somas[:, i1, j0] + somas[:, i0, j0]
+            celulas = (i1 - i0) * (j1 - j0)
+            cobertura = float(janela[0]) / celulas
+
+            return {
+                'green_areas': int(janela[1]),
+                'green_coverage': round(cobertura, 4),
+                'air_quality': 'desconhecida',
+                # 30% de cobertura verde ja conta como nota máxima
+                'environmental_score': round(10 * min(cobertura / 0.3, 1.0)),
+                'data_source': f"OpenStreetMap (grade de {meta['resolucao']:.0f}m)"
+            }
+
+        return None
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pré-calcula a grade de cobertura verde de uma cidade')
+    parser.add_argument('cidade')
+    parser.add_argument('geojson', help='poligonos verdes exportados do OSM (parques, bosques, praças)')
+    parser.add_argument('--resolucao', type=float, default=20.0, help='tamanho da celula em metros')
+    args = parser.parse_args()
+
+    meta = ConstrutorGradeVerde(resolucao=args.resolucao).construir(args.cidade, args.geojson)
+    print(f"{meta['cidade']}: grade {meta['linhas']}x{meta['colunas']} com {meta['poligonos']} poligonos")
@@ -0,0 +1,154 @@
+import math
+import numpy as np
+from typing import Dict, Any, List, Tuple
+from config import Config
+from services.maps_service import MapsService
+from utils.admissao import exigir_admissao
+from utils.cache import cache
+from utils.scoring import MotorPontuacao
+
+
+
+
+RAIO_TERRA = 6378137.0
+
+# mesmos raios usados em analise_transporte e analise_infraestrutura
+RAIO_TRANSPORTE = 1000
+RAIO_INFRAESTRUTURA = 1500
+
+
+
+
+def _para_mercator(latitude: np.ndarray, longitude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    x = RAIO_TERRA * np.radians(longitude)
+    y = RAIO_TERRA * np.log(np.tan(np.pi / 4 + np.radians(latitude) / 2))
+    return x, y
+
+
+def _para_latlon(x: float, y: float) -> Tuple[float, float]:
+    longitude = math.degrees(x / RAIO_TERRA)
+    latitude = math.degrees(2 * math.atan(math.exp(y / RAIO_TERRA)) - math.pi / 2)
+    return latitude, longitude
+
+
+def _kernel_disco(raio_celulas: float) -> np.ndarray:
+    alcance = int(math.ceil(raio_celulas))
+    di, dj = np.mgrid[-alcance:alcance + 1, -alcance:alcance + 1]
+    return (di ** 2 + dj ** 2 <= raio_celulas ** 2).astype(np.float64)
+
+
+def _convolver(grade: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """Convolução via FFT com saída do mesmo tamanho da grade (kernel centrado)"""
+    forma = (grade.shape[0] + kernel.shape[0] - 1, grade.shape[1] + kernel.shape[1] - 1)
+    completa = np.fft.irfft2(np.fft.rfft2(grade, forma) * np.fft.rfft2(kernel, forma), forma)
+    alcance = kernel.shape[0] // 2
+    return np.rint(completa[alcance:alcance + grade.shape[0], alcance:alcance + grade.shape[1]])
+
+
+
+
+class HeatmapService:
+    """Tiles XYZ de acessibilidade calculados para todas as celulas de uma vez
+
+    Em vez de uma consulta por celula, busca os POIs da area do tile (com margem do raio)
+    uma vez, conta por celula com histograma 2D e soma a vizinhança com um kernel em disco,
+    o que equivale a contar POIs no raio de cada celula como fazem as analises do dossiê.
+    """
+
+    def __init__(self, maps_service: MapsService = None, motor_pontuacao: MotorPontuacao = None):
+        self.maps_service = maps_service or MapsService()
+        self.motor_pontuacao = motor_pontuacao or MotorPontuacao()
+        self.celulas = Config.HEATMAP_TILE_CELLS
+
+    @cache('heatmap_tile', timeout=Config.HEATMAP_CACHE_TIMEOUT)
+    def gerar_tile(self, z: int, x: int, y: int, cidade: str = None) -> Dict[str, Any]:
+        """Notas de transporte e infraestrutura para a grade de celulas do tile z/x/y"""
+        # só roda no miss do cache: tiles já calculados não ocupam vaga na admissão
+        exigir_admissao()
+
+        tamanho_tile = 2 * math.pi * RAIO_TERRA / (2 ** z)
+        x_min = -math.pi * RAIO_TERRA + x * tamanho_tile
+        y_max = math.pi * RAIO_TERRA - y * tamanho_tile
+        tamanho_celula = tamanho_tile / self.celulas
+
+        # metros no chão viram metros "mercator" divididos pelo cosseno da latitude
+        latitude_centro, _ = _para_latlon(x_min + tamanho_tile / 2, y_max - tamanho_tile / 2)
+        escala = 1 / math.cos(math.radians(latitude_centro))
+        margem = int(math.ceil(RAIO_INFRAESTRUTURA * escala / tamanho_celula))
+
+        limites = (
+            x_min - margem * tamanho_celula, y_max - tamanho_tile - margem * tamanho_celula,
+            x_min + tamanho_tile + margem * tamanho_celula, y_max + margem * tamanho_celula
+        )
+        sul, oeste = _para_latlon(limites[0], limites[1])
+        norte, leste = _para_latlon(limites[2], limites[3])
+        bbox = f"{sul},{oeste},{norte},{leste}"
+
+        elementos = self.maps_service.buscar_elementos(self._query_bbox(bbox))
+
+        por_categoria = {categoria: [] for categoria in MapsService.CATEGORIAS_INFRAESTRUTURA}
+        por_categoria['transporte'] = []
+        for elemento in elementos:
+            tags = elemento['tags']
+            if MapsService.classificar_transporte(tags):
+                por_categoria['transporte'].append((elemento['lat'], elemento['lon']))
+            categoria = MapsService.classificar_infraestrutura(tags)
+            if categoria:
+                por_categoria[categoria].append((elemento['lat'], elemento['lon']))
+
+        lado = self.celulas + 2 * margem
+        contagens = {}
+        for categoria, pontos in por_categoria.items():
+            raio = RAIO_TRANSPORTE if categoria == 'transporte' else RAIO_INFRAESTRUTURA
+            contagens[categoria] = self._contar_no_raio(pontos, limites, lado, raio * escala / tamanho_celula, margem)
+
+        notas = self.motor_pontuacao.pontuar_lote(cidade, {
+            categoria: grade.ravel() for categoria, grade in contagens.items()
+        })
+        for categoria, nota in notas.items():
+            # sem distribuição para a cidade, cai no teto antigo de 0 a 10
+            sem_nota = np.isnan(nota)
+            nota[sem_nota] = np.minimum(contagens[categoria].ravel()[sem_nota], 10)
+
+        forma = (self.celulas, self.celulas)
+        infraestrutura = np.mean([notas[c].reshape(forma) for c in MapsService.CATEGORIAS_INFRAESTRUTURA], axis=0)
+
+        tile_sul, tile_oeste = _para_latlon(x_min, y_max - tamanho_tile)
+        tile_norte, tile_leste = _para_latlon(x_min + tamanho_tile, y_max)
+
+        return {
+            'z': z, 'x': x, 'y': y,
+            'bbox': [tile_sul, tile_oeste, tile_norte, tile_leste],
+            'celulas': self.celulas,
+            # linhas de norte para sul, colunas de oeste para leste
+            'camadas': {
+                'transporte': np.round(notas['transporte'].reshape(forma), 1).tolist(),
+                'infraestrutura': np.round(infraestrutura, 1).tolist()
+            },
+            'total_pois': sum(len(pontos) for pontos in por_categoria.values())
+        }
+
+    def _query_bbox(self, bbox: str) -> str:
+        filtros = [f"node{filtro}({bbox});" for filtro in MapsService.FILTROS_TRANSPORTE]
+        for categoria in MapsService.CATEGORIAS_INFRAESTRUTURA:
+            filtro = MapsService.filtro_categoria(categoria)
+            filtros.append(f"node[{filtro}]({bbox});")
+            filtros.append(f"way[{filtro}]({bbox});")
+        return '\n'.join(filtros)
+
+    def _contar_no_raio(self, pontos: List[Tuple[float, float]], limites: Tuple[float, float, float, float],
+                        lado: int, raio_celulas: float, margem: int) -> np.ndarray:
+        """Quantidade de pontos no raio do centro de cada celula do tile"""
+        if not pontos:
+            return np.zeros((self.celulas, self.celulas))
+
+        coordenadas = np.asarray(pontos)
+        px, py = _para_mercator(coordenadas[:, 0], coordenadas[:, 1])
+
+        # linha 0 é o norte, por isso y vem primeiro e invertido
+        histograma, _, _ = np.histogram2d(
+            -py, px, bins=lado,
+            range=[[-limites[3], -limites[1]], [limites[0], limites[2]]]
+        )
+        vizinhanca = _convolver(histograma, _kernel_disco(raio_celulas))
+        return vizinhanca[margem:margem + self.celulas, margem:margem + self.celulas]
@@ -2,6 +2,7 @@ import requests
 from typing import Dict, Any, Optional
 from config import Config
 from utils.cache import cache
+from utils.metrics import medir_etapa, hooks_upstream, registrar_falha_upstream
 
 
 
@@ -16,16 +17,17 @@ class IBGEService:
         self.base_url = Config.IBGE_API_BASE
         self.timeout = Config.REQUEST_TIMEOUT
     
-    @cache('ibge_municipio', timeout=86400)  #cache por 24 horas
+    @cache('ibge_municipio', timeout=Config.CACHE_TTL_IBGE, versao=1, timeout_negativo=Config.CACHE_TTL_NEGATIVO)
 
     def obter_info_municipio(self, municipio: str, uf: str) -> Optional[Dict[str, Any]]:
         """Busca informações do municipio no IBGE"""
         try:
             url = f"{self.base_url}/localidades/municipios"
-            response = requests.get(url, timeout=self.timeout)
-            response.raise_for_status()
-            
-            municipios = response.json()
+            with medir_etapa('ibge_municipios'):
+                response = requests.get(url, timeout=self.timeout, hooks=hooks_upstream('ibge'))
+                response.raise_for_status()
+                
+                municipios = response.json()
             dados_municipio = None
             
             for mun in municipios:
@@ -37,7 +39,8 @@ class IBGEService:
                 return None
             
             codigo_municipio = dados_municipio['id']
-            dados_demograficos = self._obter_dados_demograficos(codigo_municipio)
+            with medir_etapa('ibge_demografia'):
+                dados_demograficos = self._obter_dados_demograficos(codigo_municipio)
             
             return {
                 'codigo': codigo_municipio,
@@ -51,6 +54,7 @@ class IBGEService:
             }
             
         except Exception as e:
+            registrar_falha_upstream('ibge', e)
             print(f"Erro ao buscar dados do IBGE: {e}")
             return None
         
@@ -1,27 +1,63 @@
+import heapq
+import math
+import re
 import requests
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterable
 from config import Config
 import time
 from utils.cache import cache
+from utils.json_stream import iterar_array_json
+from utils.metrics import medir_etapa, hooks_upstream, registrar_falha_upstream
+from services.walking_service import AcessibilidadePedestre, Isocrona
+from services.poi_store import ArmazemPOI
 
 
 
 
 class MapsService:
     """Serviço para integração com APIs gratuitas de mapas (OpenStreetMap)"""
+
+    # categorias de infraestrutura: tag OSM e valores aceitos (mesma semântica de regex do Overpass)
+    CATEGORIAS_INFRAESTRUTURA = {
+        'escolas': ('amenity', 'school|university|college'),
+        'hospitais': ('amenity', 'hospital|clinic|doctors'),
+        'supermercados': ('shop', 'supermarket|convenience'),
+        'farmacias': ('amenity', 'pharmacy'),
+        'bancos': ('amenity', 'bank'),
+        'restaurantes': ('amenity', 'restaurant|fast_food|cafe')
+    }
+
+    FILTROS_TRANSPORTE = [
+        '["public_transport"]',
+        '["highway"="bus_stop"]',
+        '["railway"="station"]',
+        '["railway"="subway_entrance"]'
+    ]
     
     def __init__(self):
         self.timeout = Config.REQUEST_TIMEOUT
         self.nominatim_base = Config.NOMINATIM_API_BASE
-        self.overpass_base = "https://overpass-api.de/api/interpreter"
+        self.overpass_base = Config.OVERPASS_API_BASE
         
         self.headers = {
-            'User-Agent': 'DossieUrbano/1.0 (contato@dossieurbano.com)'
+            'User-Agent': Config.OSM_USER_AGENT
         }
+        self.acessibilidade = AcessibilidadePedestre()
+        self.pois = ArmazemPOI(self.categorias_poi)
+
+    # tamanho dos pedaços lidos da resposta do Overpass
+    TAMANHO_BLOCO = 64 * 1024
+    LUGARES_POR_CATEGORIA = 5
 
+    def _variante_pois(self, latitude: float, longitude: float, raio: float) -> Optional[str]:
+        """Sequência do armazém local na chave do cache quando é ele que responde (None = Overpass)"""
+        if self.pois.cobre(latitude, longitude, raio):
+            return f"pois{self.pois.sequencia}"
+        return None
 
 
-    @cache('geocode', timeout=86400)
+
+    @cache('geocode', timeout=Config.CACHE_TTL_GEOCODE, versao=1, timeout_negativo=Config.CACHE_TTL_NEGATIVO)
     def endereço_geocodigo (self, endereco: str) -> Optional[Dict[str, Any]]:
         """Converte endereço em coordenadas geográficas usando Nominatim (OpenStreetMap)"""
         try:
@@ -53,7 +89,8 @@ class MapsService:
                 'namedetails': 1
             }
             
-            response = requests.get(url, params=parametross, headers=self.headers, timeout=self.timeout)
+            response = requests.get(url, params=parametross, headers=self.headers, timeout=self.timeout,
+                                    hooks=hooks_upstream('nominatim'))
             response.raise_for_status()
             
             results = response.json()
@@ -63,80 +100,78 @@ class MapsService:
             # pega o primeiro resultado(mais relevante)
             resultado = results[0]
             
-            endereco = resultado.get('address', {})
-            componentes = {
-                'bairro': endereco.get('suburb') or endereco.get('neighbourhood') or endereco.get('quarter'),
-                'cidade': endereco.get('city') or endereco.get('town') or endereco.get('municipality'),
-                'estado': endereco.get('state'),
-                'cep': endereco.get('postcode'),
-                'pais': endereco.get('country', 'Brasil')
-            }
-            
-
-            return {
-                'latitude': float(resultado['lat']),
-                'longitude': float(resultado['lon']),
-                'endereco_formatado': resultado.get('display_name'),
-                'componentes': componentes,
-                'confianca': float(resultado.get('importance', 0.5))
-            }
+            return self._formatar_resultado_nominatim(resultado)
         
 
             
         except Exception as e:
+            registrar_falha_upstream('nominatim', e)
             print(f"Erro no Nominatim: {e}")
             return None
-    def analise_transporte(self, latitude: float, longitude: float) -> Dict[str, Any]:
-        """Analisa opções de transporte próximas usando Overpass API"""
+
+    @cache('reverse_geocode', timeout=Config.CACHE_TTL_GEOCODE, versao=1, timeout_negativo=Config.CACHE_TTL_NEGATIVO)
+    def coordenadas_endereco(self, latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+        """Geocodificação reversa (coordenadas -> endereço) usando Nominatim"""
         try:
-            # query Overpass para buscar transporte publico
-            overpass_query = f"""
-            [out:json][timeout:25];
-            (
-            node["public_transport"](around:1000,{latitude},{longitude});
-            node["highway"="bus_stop"](around:1000,{latitude},{longitude});
-            node["railway"="station"](around:1000,{latitude},{longitude});
-            node["railway"="subway_entrance"](around:1000,{latitude},{longitude});
-            );
-            out geom;
-            """
-            
-            resposta = requests.post(
-                self.overpass_base,
-                data=overpass_query,
+            response = requests.get(
+                f"{self.nominatim_base}/reverse",
+                params={'lat': latitude, 'lon': longitude, 'format': 'json', 'addressdetails': 1},
                 headers=self.headers,
-                timeout=self.timeout
+                timeout=self.timeout,
+                hooks=hooks_upstream('nominatim')
             )
-            resposta.raise_for_status()
+            response.raise_for_status()
             
-            data = resposta.json()
-            elementos = data.get('elements', [])
-            
-            tipos_de_transporte = set()
-            estaçoes_contagem = 0
-            
-            for element in elementos:
-                tags = element.get('tags', {})
-                if tags.get('public_transport') == 'stop_position':
-                    tipos_de_transporte.add('ônibus')
-                    estaçoes_contagem += 1
-                elif tags.get('highway') == 'bus_stop':
-                    tipos_de_transporte.add('ônibus')
-                    estaçoes_contagem += 1
-                elif tags.get('railway') == 'station':
-                    tipos_de_transporte.add('trem')
-                    estaçoes_contagem += 1
-                elif tags.get('railway') == 'subway_entrance':
-                    tipos_de_transporte.add('metrô')
-                    estaçoes_contagem += 1
+            resultado = response.json()
+            if not resultado or 'error' in resultado:
+                return None
+            return self._formatar_resultado_nominatim(resultado)
             
-            return {
-                'tipos_de_transporte': list(tipos_de_transporte) or ['transporte limitado'],
-                'estaçoes_contagem': estaçoes_contagem,
-                'pontuaçao_transporte': min(estaçoes_contagem, 10)  # Score de 0-10
-            }
+        except Exception as e:
+            registrar_falha_upstream('nominatim', e)
+            print(f"Erro no Nominatim reverso: {e}")
+            return None
+
+    def _formatar_resultado_nominatim(self, resultado: Dict[str, Any]) -> Dict[str, Any]:
+        endereco = resultado.get('address', {})
+        componentes = {
+            'bairro': endereco.get('suburb') or endereco.get('neighbourhood') or endereco.get('quarter'),
+            'cidade': endereco.get('city') or endereco.get('town') or endereco.get('municipality'),
+            'estado': endereco.get('state'),
+            'cep': endereco.get('postcode'),
+            'pais': endereco.get('country', 'Brasil')
+        }
+        
+        return {
+            'latitude': float(resultado['lat']),
+            'longitude': float(resultado['lon']),
+            'endereco_formatado': resultado.get('display_name'),
+            'componentes': componentes,
+            'confianca': float(resultado.get('importance', 0.5))
+        }
+    @cache('transporte', timeout=Config.CACHE_TTL_TRANSPORTE, versao=2,
+           variante=lambda self, latitude, longitude: self._variante_pois(latitude, longitude, 1000))
+    def analise_transporte(self, latitude: float, longitude: float) -> Dict[str, Any]:
+        """Analisa opções de transporte próximas usando Overpass API"""
+        try:
+            if self.pois.cobre(latitude, longitude, 1000):
+                with medir_etapa('pois_locais_transporte'):
+                    return self._resumir_transporte(
+                        self.pois.elementos(latitude, longitude, 1000, 'transporte'),
+                        self.acessibilidade.isocrona(latitude, longitude)
+                    )
+            
+            # query Overpass para buscar transporte publico
+            overpass_query = self._query_transporte(f"around:1000,{latitude},{longitude}")
+            
+            with medir_etapa('overpass_transporte'):
+                with self._post_overpass(overpass_query) as resposta:
+                    return self._resumir_transporte(
+                        self._iterar_elementos(resposta), self.acessibilidade.isocrona(latitude, longitude)
+                    )
             
         except Exception as e:
+            registrar_falha_upstream('overpass', e)
             print(f"Erro na análise de transporte: {e}")
             return {
                 'tipos_de_transporte': ['dados indisponíveis'],
@@ -144,64 +179,47 @@ class MapsService:
                 'pontuaçao_transporte': 5
             }
 
+    @cache('infraestrutura', timeout=Config.CACHE_TTL_INFRAESTRUTURA, versao=2,
+           degradado=lambda resultado: not resultado,
+           variante=lambda self, latitude, longitude: self._variante_pois(latitude, longitude, 1500))
     def analise_infraestrutura(self, latitude: float, longitude: float) -> Dict[str, Any]:
         """Analisa infraestrutura próxima (escolas, hospitais, comércio)"""
         try:
-            #query para diferentes tipos de infraestrutura
-            categorias = {
-                'escolas': 'amenity~"school|university|college"',
-                'hospitais': 'amenity~"hospital|clinic|doctors"',
-                'supermercados': 'shop~"supermarket|convenience"',
-                'farmacias': 'amenity="pharmacy"',
-                'bancos': 'amenity="bank"',
-                'restaurantes': 'amenity~"restaurant|fast_food|cafe"'
-            }
-            
             dados_infraestrutura = {}
+            isocrona = self.acessibilidade.isocrona(latitude, longitude)
             
-            for categoria, query in categorias.items():
+            # área coberta pelo armazém local de POIs: nada de Overpass
+            if self.pois.cobre(latitude, longitude, 1500):
+                with medir_etapa('pois_locais_infraestrutura'):
+                    for categoria in self.CATEGORIAS_INFRAESTRUTURA:
+                        dados_infraestrutura[categoria] = self._resumir_categoria(
+                            categoria, self.pois.elementos(latitude, longitude, 1500, categoria), latitude, longitude, isocrona
+                        )
+                return dados_infraestrutura
+            
+            for categoria in self.CATEGORIAS_INFRAESTRUTURA:
+                query = self.filtro_categoria(categoria)
+                # vias só com tags e centro (sem a lista de nós); nós já vêm enxutos no padrão
                 overpass_query = f"""
                 [out:json][timeout:25];
-                (
                 node[{query}](around:1500,{latitude},{longitude});
+                out;
                 way[{query}](around:1500,{latitude},{longitude});
-                );
-                out geom;
+                out tags center;
                 """
                 
                 try:
-                    resposta = requests.post(
-                        self.overpass_base,
-                        data=overpass_query,
-                        headers=self.headers,
-                        timeout=self.timeout
-                    )
-                    resposta.raise_for_status()
-                    
-                    dados = resposta.json()
-                    elements = dados.get('elements', [])
-                    
-                    lugares = []
-                    for elemento in elements:
-                        tags = elemento.get('tags', {})
-                        nome = tags.get('nome', 'Sem nome')
-                        lugares.append({
-                            'nome': nome,
-                            'tipo': categoria[:-1],  # remove 's' do plural
-                            'lat': elemento.get('lat'),
-                            'lon': elemento.get('lon')
-                        })
-                    
-                    dados_infraestrutura[categoria] = {
-                        'contagem': len(lugares),
-                        'lugares': lugares[:5],  # limita a 5 mais proximos
-                        'pontuacao': min(len(lugares), 10)
-                    }
+                    with medir_etapa(f'overpass_{categoria}'):
+                        with self._post_overpass(overpass_query) as resposta:
+                            dados_infraestrutura[categoria] = self._resumir_categoria(
+                                categoria, self._iterar_elementos(resposta), latitude, longitude, isocrona
+                            )
                     
                     #delay para respeitar rate limits
                     time.sleep(Config.OSM_REQUEST_DELAY)
                     
                 except Exception as e:
+                    registrar_falha_upstream('overpass', e)
                     print(f"Erro ao buscar {categoria}: {e}")
                     dados_infraestrutura[categoria] = {
                         'contagem': 0,
@@ -213,4 +231,185 @@ class MapsService:
             
         except Exception as e:
             print(f"Erro na análise de infraestrutura: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+    def _post_overpass(self, overpass_query: str) -> requests.Response:
+        """POST no Overpass com a resposta em streaming (use com `with` para liberar a conexão)"""
+        resposta = requests.post(
+            self.overpass_base,
+            data=overpass_query,
+            headers=self.headers,
+            timeout=self.timeout,
+            hooks=hooks_upstream('overpass'),
+            stream=True
+        )
+        try:
+            resposta.raise_for_status()
+        except Exception:
+            resposta.close()
+            raise
+        return resposta
+
+    def _iterar_elementos(self, resposta: requests.Response) -> Iterable[Dict[str, Any]]:
+        """Elementos da resposta do Overpass, decodificados um a um enquanto chegam"""
+        return iterar_array_json(resposta.iter_content(self.TAMANHO_BLOCO), 'elements')
+
+    def _resumir_transporte(self, elementos: Iterable[Dict[str, Any]], isocrona: Isocrona = None) -> Dict[str, Any]:
+        """Conta os pontos de embarque e os tipos de transporte dos elementos do Overpass"""
+        tipos_de_transporte = set()
+        estaçoes_contagem = 0
+        minutos_a_pe = []
+        
+        for element in elementos:
+            tipo = self.classificar_transporte(element.get('tags', {}))
+            if tipo:
+                tipos_de_transporte.add(tipo)
+                estaçoes_contagem += 1
+                if isocrona is not None and element.get('lat') is not None:
+                    minutos_a_pe.append(isocrona.minutos_ate(element['lat'], element['lon']))
+        
+        resumo = {
+            'tipos_de_transporte': list(tipos_de_transporte) or ['transporte limitado'],
+            'estaçoes_contagem': estaçoes_contagem,
+            'pontuaçao_transporte': min(estaçoes_contagem, 10)  # Score de 0-10
+        }
+        if isocrona is not None:
+            resumo['a_pe'] = isocrona.contar(minutos_a_pe)
+        return resumo
+
+    def _resumir_categoria(self, categoria: str, elementos: Iterable[Dict[str, Any]],
+                           latitude: float = None, longitude: float = None, isocrona: Isocrona = None) -> Dict[str, Any]:
+        """Monta a contagem e os lugares mais próximos de uma categoria, numa passada só
+
+        Só os LUGARES_POR_CATEGORIA mais próximos ficam em memória (heap pela distância);
+        sem o ponto de referência ficam os primeiros da resposta. Com a isócrona, conta
+        também os lugares a 5/10/15 minutos a pé pela rede de ruas.
+        """
+        escala_lon = math.cos(math.radians(latitude)) if latitude is not None else 1.0
+        mais_proximos = []  # heap de (-distância², ordem, lugar): a raiz é o mais distante
+        contagem = 0
+        minutos_a_pe = []
+        
+        for elemento in elementos:
+            contagem += 1
+            centro = elemento.get('center', elemento)
+            lat, lon = centro.get('lat'), centro.get('lon')
+            minutos = None
+            if isocrona is not None and lat is not None and lon is not None:
+                minutos = isocrona.minutos_ate(lat, lon)
+                minutos_a_pe.append(minutos)
+            
+            if latitude is None or lat is None or lon is None:
+                distancia = float('inf') if lat is None or lon is None else 0.0
+            else:
+                distancia = (lat - latitude) ** 2 + ((lon - longitude) * escala_lon) ** 2
+            
+            item = (-distancia, -contagem)
+            if len(mais_proximos) == self.LUGARES_POR_CATEGORIA:
+                if item <= mais_proximos[0][:2]:
+                    continue
+                heapq.heappop(mais_proximos)
+            lugar = {
+                'nome': elemento.get('tags', {}).get('name', 'Sem nome'),
+                'tipo': categoria[:-1],  # remove 's' do plural
+                'lat': lat,
+                'lon': lon
+            }
+            if isocrona is not None:
+                lugar['minutos_a_pe'] = round(minutos, 1) if minutos is not None else None
+            heapq.heappush(mais_proximos, item + (lugar,))
+        
+        resumo = {
+            'contagem': contagem,
+            'lugares': [lugar for _, _, lugar in sorted(mais_proximos, reverse=True)],
+            'pontuacao': min(contagem, 10)
+        }
+        if isocrona is not None:
+            resumo['a_pe'] = isocrona.contar(minutos_a_pe)
+        return resumo
+
+    @classmethod
+    def filtro_categoria(cls, categoria: str) -> str:
+        """Filtro Overpass de uma categoria de infraestrutura"""
+        chave, valores = cls.CATEGORIAS_INFRAESTRUTURA[categoria]
+        if '|' in valores:
+            return f'{chave}~"{valores}"'
+        return f'{chave}="{valores}"'
+
+    @classmethod
+    def classificar_infraestrutura(cls, tags: Dict[str, str]) -> Optional[str]:
+        """Categoria de infraestrutura de um elemento OSM, pelas tags"""
+        for categoria, (chave, valores) in cls.CATEGORIAS_INFRAESTRUTURA.items():
+            valor = tags.get(chave)
+            if valor is not None and (re.search(valores, valor) if '|' in valores else valor == valores):
+                return categoria
+        return None
+
+    @classmethod
+    def categorias_poi(cls, tipo: str, tags: Dict[str, str]) -> tuple:
+        """Categorias de um elemento OSM no armazém local (as mesmas das queries do Overpass)"""
+        categorias = []
+        categoria = cls.classificar_infraestrutura(tags)
+        if categoria:
+            categorias.append(categoria)
+        # a query de transporte só traz nós
+        if tipo == 'node' and cls.classificar_transporte(tags):
+            categorias.append('transporte')
+        return tuple(categorias)
+
+    @staticmethod
+    def classificar_transporte(tags: Dict[str, str]) -> Optional[str]:
+        """Tipo de transporte de um elemento OSM (None se não for ponto de embarque)"""
+        if tags.get('public_transport') == 'stop_position':
+            return 'ônibus'
+        elif tags.get('highway') == 'bus_stop':
+            return 'ônibus'
+        elif tags.get('railway') == 'station':
+            return 'trem'
+        elif tags.get('railway') == 'subway_entrance':
+            return 'metrô'
+        return None
+
+    def _query_transporte(self, area: str) -> str:
+        """Query Overpass dos pontos de transporte (area = 'around:r,lat,lon' ou bbox 's,w,n,e')"""
+        filtros = '\n'.join(f"node{filtro}({area});" for filtro in self.FILTROS_TRANSPORTE)
+        return f"""
+            [out:json][timeout:25];
+            (
+            {filtros}
+            );
+            out;
+            """
+
+    def buscar_elementos(self, query_corpo: str) -> List[Dict[str, Any]]:
+        """Executa uma query Overpass e devolve os elementos com lat/lon (centro para ways)"""
+        # vias só com tags e centro (sem a lista de nós); nós com o padrão, que já é
+        # id, lat, lon e tags (o `out tags` tiraria deles as coordenadas)
+        overpass_query = f"""
+            [out:json][timeout:60];
+            (
+            {query_corpo}
+            )->.todos;
+            node.todos;
+            out;
+            way.todos;
+            out tags center;
+            """
+        try:
+            resposta = self._post_overpass(overpass_query)
+        except Exception as e:
+            registrar_falha_upstream('overpass', e)
+            raise
+
+        elementos = []
+        with resposta:
+            for elemento in self._iterar_elementos(resposta):
+                centro = elemento.get('center', elemento)
+                if centro.get('lat') is None or centro.get('lon') is None:
+                    continue
+                elementos.append({
+                    'lat': centro['lat'],
+                    'lon': centro['lon'],
+                    'tags': elemento.get('tags', {})
+                })
+        return elementos
@@ -0,0 +1,422 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, Any, Optional, List, Tuple, Callable, Iterable
+from config import Config
+from utils.geometria import METROS_POR_GRAU
+from utils.json_stream import iterar_array_json
+
+
+
+
+# tags guardadas de cada POI: as que os classificadores do MapsService olham, mais o nome
+CHAVES_MANTIDAS = ('name', 'amenity', 'shop', 'public_transport', 'highway', 'railway')
+
+# lado da célula do índice espacial, em graus (~550 m de latitude)
+TAMANHO_CELULA = 0.005
+
+# arquivos de diff aceitos em POI_DIFF_DIR: <sequência>.osc ou <sequência>.osc.gz
+PADRAO_DIFF = re.compile(r'^(\d+)\.osc(\.gz)?$')
+
+
+
+
+def _abrir(caminho: str, modo: str = 'rb'):
+    return gzip.open(caminho, modo) if caminho.endswith('.gz') else open(caminho, modo)
+
+
+def _celula(latitude: float, longitude: float) -> Tuple[int, int]:
+    return int(math.floor(latitude / TAMANHO_CELULA)), int(math.floor(longitude / TAMANHO_CELULA))
+
+
+
+
+class ArmazemPOI:
+    """POIs do OSM mantidos localmente, com índice em grade e atualização por diffs (.osc)
+
+    Guarda os nós e vias classificados por `classificar(tipo, tags)` (tupla de categorias)
+    e as coordenadas dos nós das vias, para recalcular o centro quando um nó se move.
+    As leituras não pegam lock: cada POI é uma tupla imutável trocada inteira na escrita,
+    e a consulta copia o conjunto de cada célula com tuple() (atômico sob o GIL), então
+    nunca vê um estado pela metade enquanto um diff é aplicado. As escritas são
+    serializadas entre si.
+
+    Cada worker aplica os diffs novos de POI_DIFF_DIR no próprio armazém, numa thread
+    (`iniciar_atualizacao_periodica`, chamada depois do fork), enquanto segue atendendo.
+    Um diff só escreve nas poucas páginas que toca, então o resto do armazém continua
+    compartilhado com o mestre. Entre uma verificação e outra os workers podem estar em
+    sequências diferentes; a sequência entra na chave do cache, então cada resposta
+    guardada corresponde aos dados que a geraram. `atualizar` pela linha de comando
+    regrava o snapshot, para workers novos partirem de uma sequência recente.
+    """
+
+    def __init__(self, classificar: Callable[[str, Dict[str, str]], Tuple[str, ...]], caminho: str = None):
+        self.classificar = classificar
+        self.caminho = caminho or Config.POI_SNAPSHOT_PATH
+        self.sequencia = 0
+        self.bbox = None  # (lat_min, lon_min, lat_max, lon_max) da área coberta
+        self._pois = {}  # ('n'|'w', id) -> (lat, lon, tags, categorias); vias sem coordenada têm lat None
+        self._celulas = {}  # (i, j) -> conjunto de chaves
+        self._refs_vias = {}  # id da via -> tupla de ids de nós
+        self._vias_do_no = {}  # id do nó -> tupla de ids de vias
+        self._coordenadas = {}  # id do nó -> (lat, lon), só dos nós de vias
+        self._lock = threading.Lock()
+        self._carregado = False
+        self._atualizacao = None
+
+    # ---- leitura -------------------------------------------------------------
+
+    def cobre(self, latitude: float, longitude: float, raio: float) -> bool:
+        """Se o círculo inteiro está dentro da área carregada"""
+        self._carregar()
+        if self.bbox is None:
+            return False
+        margem_lat = raio / METROS_POR_GRAU
+        margem_lon = margem_lat / max(math.cos(math.radians(latitude)), 1e-6)
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        return (lat_min <= latitude - margem_lat and latitude + margem_lat <= lat_max and
+                lon_min <= longitude - margem_lon and longitude + margem_lon <= lon_max)
+
+    def _dentro(self, latitude: float, longitude: float) -> bool:
+        if self.bbox is None:
+            return True
+        lat_min, lon_min, lat_max, lon_max = self.bbox
+        return lat_min <= latitude <= lat_max and lon_min <= longitude <= lon_max
+
+    def elementos(self, latitude: float, longitude: float, raio: float, categoria: str) -> Iterable[Dict[str, Any]]:
+        """POIs da categoria a até `raio` metros, no formato dos elementos do Overpass (out center)"""
+        self._carregar()
+        escala_lon = math.cos(math.radians(latitude))
+        margem_lat = raio / METROS_POR_GRAU
+        margem_lon = margem_lat / max(escala_lon, 1e-6)
+        i0, j0 = _celula(latitude - margem_lat, longitude - margem_lon)
+        i1, j1 = _celula(latitude + margem_lat, longitude + margem_lon)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for chave in tuple(self._celulas.get((i, j), ())):
+                    poi = self._pois.get(chave)
+                    if poi is None or poi[0] is None or categoria not in poi[3]:
+                        continue
+                    lat, lon, tags, _ = poi
+                    if METROS_POR_GRAU * math.hypot(lat - latitude, (lon - longitude) * escala_lon) > raio:
+                        continue
+                    if chave[0] == 'n':
+                        yield {'type': 'node', 'id': chave[1], 'lat': lat, 'lon': lon, 'tags': dict(tags)}
+                    else:
+                        yield {'type': 'way', 'id': chave[1], 'center': {'lat': lat, 'lon': lon}, 'tags': dict(tags)}
+
+    # ---- escrita (sempre com self._lock) -------------------------------------
+
+    def _indexar(self, chave: Tuple[str, int], antigo: Optional[tuple], novo: Optional[tuple]):
+        celula_antiga = _celula(antigo[0], antigo[1]) if antigo and antigo[0] is not None else None
+        celula_nova = _celula(novo[0], novo[1]) if novo and novo[0] is not None else None
+        if celula_antiga == celula_nova:
+            return
+        if celula_antiga is not None:
+            chaves = self._celulas.get(celula_antiga)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._celulas[celula_antiga]
+        if celula_nova is not None:
+            self._celulas.setdefault(celula_nova, set()).add(chave)
+
+    def _gravar_poi(self, chave: Tuple[str, int], poi: Optional[tuple]):
+        antigo = self._pois.get(chave)
+        self._indexar(chave, antigo, poi)
+        if poi is None:
+            self._pois.pop(chave, None)
+        else:
+            self._pois[chave] = poi
+
+    def _gravar_no(self, id_no: int, latitude: float, longitude: float, tags: Dict[str, str]):
+        categorias = self.classificar('node', tags)
+        if categorias:
+            self._gravar_poi(('n', id_no), (latitude, longitude, self._filtrar_tags(tags), categorias))
+        else:
+            self._gravar_poi(('n', id_no), None)
+        if id_no in self._vias_do_no:
+            self._coordenadas[id_no] = (latitude, longitude)
+
+    def _gravar_via(self, id_via: int, refs: Tuple[int, ...], tags: Dict[str, str]) -> bool:
+        """Grava a via (ou a remove, se não for mais POI); devolve se ela ficou com centro"""
+        categorias = self.classificar('way', tags)
+        self._trocar_refs(id_via, refs if categorias else ())
+        if not categorias:
+            self._gravar_poi(('w', id_via), None)
+            return True
+        latitude, longitude = self._centro(id_via)
+        self._gravar_poi(('w', id_via), (latitude, longitude, self._filtrar_tags(tags), categorias))
+        return latitude is not None
+
+    def _trocar_refs(self, id_via: int, refs: Tuple[int, ...]):
+        antigas = self._refs_vias.pop(id_via, ())
+        for id_no in set(antigas) - set(refs):
+            vias = tuple(via for via in self._vias_do_no.get(id_no, ()) if via != id_via)
+            if vias:
+                self._vias_do_no[id_no] = vias
+            else:
+                self._vias_do_no.pop(id_no, None)
+                self._coordenadas.pop(id_no, None)
+        for id_no in set(refs) - set(antigas):
+            self._vias_do_no[id_no] = self._vias_do_no.get(id_no, ()) + (id_via,)
+        if refs:
+            self._refs_vias[id_via] = tuple(refs)
+
+    def _centro(self, id_via: int) -> Tuple[Optional[float], Optional[float]]:
+        """Centro da bbox dos nós conhecidos da via (como o `out center` do Overpass)"""
+        pontos = [self._coordenadas[id_no] for id_no in self._refs_vias.get(id_via, ()) if id_no in self._coordenadas]
+        if not pontos:
+            return None, None
+        lats, lons = [ponto[0] for ponto in pontos], [ponto[1] for ponto in pontos]
+        return (min(lats) + max(lats)) / 2, (min(lons) + max(lons)) / 2
+
+    def _recentralizar(self, id_via: int) -> bool:
+        poi = self._pois.get(('w', id_via))
+        if poi is None:
+            return True
+        latitude, longitude = self._centro(id_via)
+        self._gravar_poi(('w', id_via), (latitude, longitude, poi[2], poi[3]))
+        return latitude is not None
+
+    def _remover_no(self, id_no: int):
+        self._gravar_poi(('n', id_no), None)
+        self._coordenadas.pop(id_no, None)
+
+    def _remover_via(self, id_via: int):
+        self._trocar_refs(id_via, ())
+        self._gravar_poi(('w', id_via), None)
+
+    @staticmethod
+    def _filtrar_tags(tags: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple((chave, tags[chave]) for chave in CHAVES_MANTIDAS if chave in tags)
+
+    # ---- diffs ---------------------------------------------------------------
+
+    def aplicar_diff(self, caminho: str, sequencia: int = None) -> Dict[str, int]:
+        """Aplica um osmChange (.osc ou .osc.gz) no armazém e no índice, sem bloquear leituras
+
+        Só entra o que fica dentro da bbox do armazém (os diffs de replicação são do
+        planeta inteiro): nós de fora são ignorados, ou removidos se saíram da área, e
+        vias cujo centro fica fora (ou sem nenhum nó conhecido) são descartadas.
+        """
+        self.aquecer()
+        resumo = {'nos': 0, 'vias': 0, 'removidos': 0, 'vias_sem_coordenadas': 0, 'fora_da_area': 0}
+        vias_afetadas = set()
+        coordenadas_do_diff = {}
+
+        with self._lock, _abrir(caminho) as arquivo:
+            acao = None
+            for evento, elemento in ET.iterparse(arquivo, events=('start', 'end')):
+                if evento == 'start':
+                    if elemento.tag in ('create', 'modify', 'delete'):
+                        acao = elemento.tag
+                    continue
+                if elemento.tag not in ('node', 'way', 'relation'):
+                    continue
+
+                identificador = int(elemento.get('id'))
+                if elemento.tag == 'node':
+                    if acao == 'delete':
+                        vias_afetadas.update(self._vias_do_no.get(identificador, ()))
+                        self._remover_no(identificador)
+                        resumo['removidos'] += 1
+                    else:
+                        latitude, longitude = float(elemento.get('lat')), float(elemento.get('lon'))
+                        coordenadas_do_diff[identificador] = (latitude, longitude)
+                        if self._dentro(latitude, longitude):
+                            self._gravar_no(identificador, latitude, longitude, self._tags(elemento))
+                            resumo['nos'] += 1
+                        else:
+                            # fora da área: deixa de ser POI, mas segue como vértice das vias que o usam
+                            if ('n', identificador) in self._pois:
+                                resumo['removidos'] += 1
+                            self._gravar_poi(('n', identificador), None)
+                            if identificador in self._vias_do_no:
+                                self._coordenadas[identificador] = (latitude, longitude)
+                            resumo['fora_da_area'] += 1
+                        vias_afetadas.update(self._vias_do_no.get(identificador, ()))
+                elif elemento.tag == 'way':
+                    if acao == 'delete':
+                        self._remover_via(identificador)
+                        vias_afetadas.discard(identificador)
+                        resumo['removidos'] += 1
+                    else:
+                        refs = tuple(int(nd.get('ref')) for nd in elemento.iter('nd'))
+                        self._gravar_via(identificador, refs, self._tags(elemento))
+                        vias_afetadas.add(identificador)
+                        resumo['vias'] += 1
+                elemento.clear()
+
+            # nós novos da via que vieram no diff (antes ou depois dela) passam a ser
+            # acompanhados; os centros só são calculados no fim
+            for id_via in vias_afetadas:
+                for id_no in self._refs_vias.get(id_via, ()):
+                    if id_no not in self._coordenadas and id_no in coordenadas_do_diff:
+                        self._coordenadas[id_no] = coordenadas_do_diff[id_no]
+                if not self._recentralizar(id_via):
+                    resumo['vias_sem_coordenadas'] += 1
+                poi = self._pois.get(('w', id_via))
+                if poi is not None and (poi[0] is None or not self._dentro(poi[0], poi[1])):
+                    self._remover_via(id_via)
+                    resumo['fora_da_area'] += 1
+
+            if sequencia is not None:
+                self.sequencia = sequencia
+        return resumo
+
+    @staticmethod
+    def _tags(elemento: ET.Element) -> Dict[str, str]:
+        return {tag.get('k'): tag.get('v') for tag in elemento.iter('tag')}
+
+    def diffs_pendentes(self, diretorio: str = None) -> List[Tuple[int, str]]:
+        """(sequência, caminho) dos diffs de POI_DIFF_DIR ainda não aplicados, em ordem"""
+        diretorio = diretorio or Config.POI_DIFF_DIR
+        if not os.path.isdir(diretorio):
+            return []
+        pendentes = []
+        for nome in os.listdir(diretorio):
+            encontrado = PADRAO_DIFF.match(nome)
+            if encontrado and int(encontrado.group(1)) > self.sequencia:
+                pendentes.append((int(encontrado.group(1)), os.path.join(diretorio, nome)))
+        return sorted(pendentes)
+
+    def atualizar(self, diretorio: str = None) -> int:
+        """Aplica os diffs pendentes em ordem; devolve quantos foram aplicados"""
+        aplicados = 0
+        for sequencia, caminho in self.diffs_pendentes(diretorio):
+            try:
+                self.aplicar_diff(caminho, sequencia)
+                aplicados += 1
+            except (ET.ParseError, OSError, ValueError) as e:
+                # para no primeiro diff ruim: aplicar os seguintes pularia mudanças
+                print(f"Erro ao aplicar diff {caminho}: {e}")
+                break
+        return aplicados
+
+    def iniciar_atualizacao_periodica(self, intervalo: int = None):
+        """Thread que aplica os diffs pendentes a cada POI_DIFF_INTERVAL (no worker, depois do fork)"""
+        intervalo = Config.POI_DIFF_INTERVAL if intervalo is None else intervalo
+        if intervalo <= 0:
+            return
+
+        def atualizar_periodicamente():
+            while True:
+                try:
+                    self.atualizar()
+                except Exception as e:
+                    print(f"Erro ao atualizar POIs: {e}")
+                time.sleep(intervalo)
+
+        self._atualizacao = threading.Thread(target=atualizar_periodicamente, name='poi-diffs', daemon=True)
+        self._atualizacao.start()
+
+    # ---- carga e snapshot ------------------------------------------------------
+
+    def _carregar(self):
+        """Lê o snapshot na primeira consulta"""
+        self.aquecer()
+
+    def aquecer(self):
+        """Lê o snapshot agora, em vez de na primeira consulta"""
+        if not self._carregado:
+            with self._lock:
+                if not self._carregado:
+                    if os.path.exists(self.caminho):
+                        self._ler_snapshot()
+                    self._carregado = True
+
+    def _ler_snapshot(self):
+        with _abrir(self.caminho, 'rt') as arquivo:
+            dados = json.load(arquivo)
+        self.sequencia = dados['sequencia']
+        self.bbox = tuple(dados['bbox']) if dados.get('bbox') else None
+        self._coordenadas = {int(id_no): tuple(coordenada) for id_no, coordenada in dados['coordenadas'].items()}
+        for id_no, latitude, longitude, tags in dados['nos']:
+            self._gravar_no(id_no, latitude, longitude, dict(tags))
+        for id_via, refs, tags in dados['vias']:
+            self._gravar_via(id_via, tuple(refs), dict(tags))
+
+    def salvar(self):
+        """Grava o snapshot (troca atômica do arquivo)"""
+        with self._lock:
+            dados = {
+                'sequencia': self.sequencia,
+                'bbox': self.bbox,
+                'nos': [[chave[1], poi[0], poi[1], poi[2]] for chave, poi in self._pois.items() if chave[0] == 'n'],
+                'vias': [[chave[1], self._refs_vias.get(chave[1], ()), poi[2]]
+                         for chave, poi in self._pois.items() if chave[0] == 'w'],
+                'coordenadas': self._coordenadas
+            }
+            os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+            diretorio, nome = os.path.split(self.caminho)
+            temporario = os.path.join(diretorio, f".{nome}")  # mesma extensão: _abrir decide o gzip por ela
+            with _abrir(temporario, 'wt') as arquivo:
+                json.dump(dados, arquivo)
+            os.replace(temporario, self.caminho)
+
+    def importar_overpass(self, caminho_json: str, sequencia: int = 0) -> Dict[str, int]:
+        """Carga inicial de um extrato do Overpass (substitui o conteúdo do armazém)
+
+        O extrato sai de uma query como
+        `(nwr[amenity](area); nwr[shop](area); node[public_transport](area); ...); out; >; out skel qt;`
+        com `sequencia` igual ao número do diff de replicação da data do extrato.
+        """
+        nos, vias = {}, []
+        with _abrir(caminho_json) as arquivo:
+            for elemento in iterar_array_json(iter(lambda: arquivo.read(1 << 20), b''), 'elements'):
+                if elemento.get('type') == 'node':
+                    antigo = nos.get(elemento['id'])
+                    tags = elemento.get('tags') or (antigo[2] if antigo else {})
+                    nos[elemento['id']] = (elemento['lat'], elemento['lon'], tags)
+                elif elemento.get('type') == 'way':
+                    vias.append((elemento['id'], tuple(elemento.get('nodes') or ()), elemento.get('tags') or {}))
+
+        if not nos:
+            raise ValueError(f"Nenhum nó em {caminho_json}")
+
+        with self._lock:
+            self._pois, self._celulas, self._refs_vias, self._vias_do_no, self._coordenadas = {}, {}, {}, {}, {}
+            for id_via, refs, tags in vias:
+                self._trocar_refs(id_via, refs if self.classificar('way', tags) else ())
+            for id_no, (latitude, longitude, tags) in nos.items():
+                self._gravar_no(id_no, latitude, longitude, tags)
+            for id_via, refs, tags in vias:
+                self._gravar_via(id_via, refs, tags)
+            lats = [coordenada[0] for coordenada in nos.values()]
+            lons = [coordenada[1] for coordenada in nos.values()]
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+            self.sequencia = sequencia
+            self._carregado = True
+        return {'pois': len(self._pois), 'coordenadas': len(self._coordenadas)}
+
+
+
+
+if __name__ == '__main__':
+    from services.maps_service import MapsService
+
+    parser = argparse.ArgumentParser(description='Mantém o armazém local de POIs do OSM')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+    importar = comandos.add_parser('importar', help='carga inicial de um extrato do Overpass (JSON)')
+    importar.add_argument('extrato')
+    importar.add_argument('--sequencia', type=int, default=0, help='diff de replicação correspondente ao extrato')
+    comandos.add_parser('atualizar', help='aplica os diffs pendentes de POI_DIFF_DIR e grava o snapshot '
+                                          '(os workers já em pé aplicam os mesmos diffs sozinhos)')
+    args = parser.parse_args()
+
+    armazem = ArmazemPOI(MapsService.categorias_poi)
+    if args.comando == 'importar':
+        resumo = armazem.importar_overpass(args.extrato, args.sequencia)
+        print(f"{resumo['pois']} POIs, {resumo['coordenadas']} nós de vias")
+    else:
+        armazem.aquecer()
+        aplicados = armazem.atualizar()
+        print(f"{aplicados} diffs aplicados, sequência {armazem.sequencia}")
+    armazem.salvar()
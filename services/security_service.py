@@ -1,6 +1,9 @@
 import requests
+import hashlib
 from typing import Dict, Any, Optional
+from config import Config
 from utils.cache import cache
+from services.ssp_ingestion import IndiceSeguranca
 import random
 
 
@@ -14,15 +17,20 @@ class SecurityService:
     
     def __init__(self):
         self.timeout = 30
+        self.indice = IndiceSeguranca()
 
     
-    @cache('security_analysis', timeout=3600)
+    @cache('security_analysis', timeout=Config.CACHE_TTL_SEGURANCA, versao=1,
+           degradado=lambda resultado: 'error' in resultado)
     def analisar_segurança(self, cidade: str, estado: str, bairro: str = None) -> Dict[str, Any]:
         """Analisa dados de segurança para uma localização"""
         try:
-            #Em uma implementação real, integraria com secrétarias de segurança públicas estaduais, portal da transparencia, dados abertos municipais, etc
-            
-            # Por enquanto, simula dados baseados na localização
+            # dados abertos das SSPs estaduais, pré-agregados pelo IngestorSSP
+            dados_oficiais = self.indice.consultar(cidade, estado, bairro)
+            if dados_oficiais:
+                return self._formatar_dados_oficiais(dados_oficiais)
+
+            # sem cobertura para a localização, simula dados baseados na localização
             dados_de_segurança = self._simular_dados_de_segurança(cidade, estado, bairro)
             
             return {
@@ -52,26 +60,50 @@ class SecurityService:
 
 
     
+    def _formatar_dados_oficiais(self, dados: Dict[str, Any]) -> Dict[str, Any]:
+        """Converte o percentil da taxa por habitante em nivel e pontuação de segurança"""
+        percentil = dados['percentil']
+        if percentil < 1 / 3:
+            taxa_crime = 'baixo'
+        elif percentil < 2 / 3:
+            taxa_crime = 'moderado'
+        else:
+            taxa_crime = 'alto'
+
+        return {
+            'crime_rate': taxa_crime,
+            'main_crime_types': dados['principais_tipos'],
+            'safety_score': round(10 - 9 * percentil),
+            'police_stations_nearby': None,
+            'recent_incidents': round(dados['taxa_mensal']),
+            'crime_rate_per_100k': round(dados['taxa_100mil_habitantes'], 1),
+            'data_source': f"Dados abertos SSP (agregado por {dados['nivel']})"
+        }
+
     def _simular_dados_de_segurança(self, cidade: str, estado: str, bairro: str) -> Dict[str, Any]:
         """Simula dados de segurança baseados na localização"""
         taxas_crime = ['baixo', 'moderado', 'alto']
         tipos_de_crime = ['furto', 'roubo', 'vandalismo', 'tráfico', 'violência doméstica']
-        localização_hash = hash(f"{cidade}{estado}{bairro}") % 100
+
+        # semente estável (hash() do python muda a cada processo) para todos os workers concordarem
+        semente = int(hashlib.md5(f"{cidade}{estado}{bairro}".encode()).hexdigest(), 16)
+        gerador = random.Random(semente)
+        localização_hash = semente % 100
         
         if localização_hash< 30:
             taxas_crime = 'baixo'
-            pontuaçao_de_seguranca = random.randint(7, 9)
+            pontuaçao_de_seguranca = gerador.randint(7, 9)
         elif localização_hash < 70:
             taxas_crime= 'moderado'
-            pontuaçao_de_seguranca = random.randint(4, 7)
+            pontuaçao_de_seguranca = gerador.randint(4, 7)
         else:
             taxas_crime = 'alto'
-            pontuaçao_de_seguranca = random.randint(1, 4)
+            pontuaçao_de_seguranca = gerador.randint(1, 4)
         
         return {
             'crime_rate': taxas_crime,
-            'crime_types': random.sample(tipos_de_crime , random.randint(2, 4)),
+            'crime_types': gerador.sample(tipos_de_crime , gerador.randint(2, 4)),
             'safety_score': pontuaçao_de_seguranca,
-            'police_stations': random.randint(1, 5),
-            'incidents': random.randint(0, 20)
+            'police_stations': gerador.randint(1, 5),
+            'incidents': gerador.randint(0, 20)
         }
\ No newline at end of file
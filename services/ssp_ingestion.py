@@ -0,0 +1,384 @@
+import json
+import os
+import re
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Optional, List
+from config import Config
+from utils.normalizacao import normalizar_texto, sigla_uf
+
+
+
+
+# categorias normalizadas - a ordem importa, a primeira palavra-chave encontrada vence
+# (ex.: "roubo seguido de morte (latrocinio)" deve contar como homicídio e nao roubo)
+CATEGORIAS_CRIME = [
+    ('homicídio', ('homicidio', 'latrocinio', 'feminicidio', 'morte')),
+    ('tráfico', ('trafico', 'entorpecente')),
+    ('violência doméstica', ('violencia domestica', 'maria da penha')),
+    ('roubo', ('roubo',)),
+    ('furto', ('furto',)),
+    ('vandalismo', ('dano', 'vandal', 'pichacao')),
+    ('lesão corporal', ('lesao corporal',)),
+]
+CATEGORIAS = [nome for nome, _ in CATEGORIAS_CRIME] + ['outros']
+
+COLUNAS_PADRAO = {
+    'municipio': 'municipio',
+    'bairro': 'bairro',
+    'natureza': 'natureza',
+    'ano': 'ano',
+    'mes': 'mes',
+    'ocorrencias': 'ocorrencias'
+}
+
+COLUNAS_POPULACAO = {
+    'municipio': 'municipio',
+    'bairro': 'bairro',
+    'populacao': 'populacao'
+}
+
+# taxas por 100 mil habitantes, a escala usual das estatísticas de segurança
+HABITANTES_TAXA = 100_000
+
+
+
+
+def classificar_natureza(natureza: str) -> int:
+    """Retorna o indice da categoria normalizada para a natureza da ocorrencia"""
+    texto = normalizar_texto(natureza)
+    for indice, (_, palavras) in enumerate(CATEGORIAS_CRIME):
+        if any(palavra in texto for palavra in palavras):
+            return indice
+    return len(CATEGORIAS) - 1
+
+
+
+
+class IngestorSSP:
+    """Carrega CSVs de dados abertos das SSPs estaduais em um armazenamento colunar
+
+    Cada arquivo vira, para cada mes de cada UF, uma particao (.npz) ja agregada por
+    municipio/bairro/categoria; arquivos diferentes do mesmo mes se somam, e reingerir o
+    mesmo arquivo substitui só a contribuição dele. Os agregados finais são atualizados
+    apenas com a diferença entre a particao nova e a antiga, entao carregar um mes novo
+    (ou corrigir um arquivo antigo) não reprocessa o historico.
+
+    As taxas e percentis são por habitante (ver ingerir_populacao): sem a população de um
+    municipio ou bairro, ele fica sem percentil e não entra na comparação.
+    """
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or Config.SECURITY_DATA_DIR
+        self.caminho_agregados = os.path.join(self.diretorio, 'agregados.npz')
+        self.caminho_manifesto = os.path.join(self.diretorio, 'manifesto.json')
+        self.caminho_populacao = os.path.join(self.diretorio, 'populacao.npz')
+
+    def ingerir_csv(self, caminho: str, estado: str, colunas: Dict[str, str] = None,
+                    sep: str = ';', encoding: str = 'latin-1', origem: str = None) -> Dict[str, int]:
+        """Ingere um CSV de ocorrencias e retorna quantos registros entraram por mes
+
+        `origem` identifica o arquivo entre os do mesmo mes (padrão: o nome do arquivo).
+        """
+        origem = re.sub(r'[^0-9A-Za-z_.-]+', '_', origem or os.path.basename(caminho))
+        uf = sigla_uf(estado)
+        if not uf:
+            raise ValueError(f"UF inválida: {estado}")
+
+        mapa = {**COLUNAS_PADRAO, **(colunas or {})}
+        df = pd.read_csv(caminho, sep=sep, encoding=encoding, dtype=str)
+        df = df.rename(columns={origem: destino for destino, origem in mapa.items()})
+
+        faltando = {'municipio', 'natureza', 'ano', 'mes'} - set(df.columns)
+        if faltando:
+            raise ValueError(f"Colunas ausentes no CSV: {', '.join(sorted(faltando))}")
+
+        normalizado = self._normalizar(df)
+        manifesto = self._carregar_manifesto()
+        delta = []
+        resumo = {}
+
+        for (ano, mes), parte in normalizado.groupby(['ano', 'mes']):
+            periodo = f"{int(ano):04d}-{int(mes):02d}"
+            nova = parte.groupby(['municipio', 'bairro', 'categoria'], as_index=False)['ocorrencias'].sum()
+            antiga = self._ler_particao(uf, periodo, origem)
+
+            if antiga is not None:
+                antiga = antiga.assign(ocorrencias=-antiga['ocorrencias'])
+                delta.append(antiga)
+            delta.append(nova)
+
+            self._gravar_particao(uf, periodo, origem, nova)
+            manifesto.setdefault(uf, [])
+            if periodo not in manifesto[uf]:
+                manifesto[uf].append(periodo)
+                manifesto[uf].sort()
+            resumo[periodo] = int(nova['ocorrencias'].sum())
+
+        if delta:
+            self._atualizar_agregados(uf, pd.concat(delta, ignore_index=True), manifesto)
+            self._gravar_manifesto(manifesto)
+
+        return resumo
+
+    def ingerir_populacao(self, caminho: str, estado: str, colunas: Dict[str, str] = None,
+                          sep: str = ';', encoding: str = 'latin-1') -> int:
+        """Ingere a população por municipio (e, se houver a coluna, por bairro) e recalcula os percentis
+
+        Linhas sem bairro são a população do municipio. Retorna quantas localidades entraram.
+        """
+        uf = sigla_uf(estado)
+        if not uf:
+            raise ValueError(f"UF inválida: {estado}")
+
+        mapa = {**COLUNAS_POPULACAO, **(colunas or {})}
+        df = pd.read_csv(caminho, sep=sep, encoding=encoding, dtype=str)
+        df = df.rename(columns={origem: destino for destino, origem in mapa.items()})
+
+        faltando = {'municipio', 'populacao'} - set(df.columns)
+        if faltando:
+            raise ValueError(f"Colunas ausentes no CSV: {', '.join(sorted(faltando))}")
+
+        bairros = df['bairro'] if 'bairro' in df.columns else pd.Series('', index=df.index)
+        nova = pd.DataFrame({
+            'uf': uf,
+            'municipio': df['municipio'].fillna('').map(normalizar_texto),
+            'bairro': bairros.fillna('').map(normalizar_texto),
+            'populacao': pd.to_numeric(df['populacao'].str.replace('.', '', regex=False), errors='coerce')
+        })
+        nova = nova[(nova['municipio'] != '') & (nova['populacao'] > 0)]
+        nova = nova.groupby(['uf', 'municipio', 'bairro'], as_index=False)['populacao'].sum()
+
+        # substitui as localidades que vieram no arquivo, mantém as demais
+        populacao = pd.concat([self._carregar_populacao(), nova], ignore_index=True)
+        populacao = populacao.drop_duplicates(['uf', 'municipio', 'bairro'], keep='last')
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = self.caminho_populacao + '.tmp.npz'
+        np.savez_compressed(
+            temporario,
+            uf=populacao['uf'].to_numpy(dtype=str),
+            municipio=populacao['municipio'].to_numpy(dtype=str),
+            bairro=populacao['bairro'].to_numpy(dtype=str),
+            populacao=populacao['populacao'].to_numpy(dtype=np.float64)
+        )
+        os.replace(temporario, self.caminho_populacao)
+
+        if os.path.exists(self.caminho_agregados):
+            self._gravar_agregados(self._carregar_agregados(), self._carregar_manifesto())
+        return len(nova)
+
+    def _carregar_populacao(self) -> pd.DataFrame:
+        if not os.path.exists(self.caminho_populacao):
+            return pd.DataFrame(columns=['uf', 'municipio', 'bairro', 'populacao'])
+        with np.load(self.caminho_populacao) as dados:
+            return pd.DataFrame({coluna: dados[coluna] for coluna in dados.files})
+
+    def _normalizar(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Normaliza nomes e categorias - a classificação roda só sobre valores únicos"""
+        naturezas = df['natureza'].fillna('')
+        categorias = {valor: classificar_natureza(valor) for valor in naturezas.unique()}
+
+        if 'ocorrencias' in df.columns:
+            ocorrencias = pd.to_numeric(df['ocorrencias'], errors='coerce').fillna(0).astype(np.int64)
+        else:
+            ocorrencias = pd.Series(1, index=df.index, dtype=np.int64)
+
+        bairros = df['bairro'] if 'bairro' in df.columns else pd.Series('', index=df.index)
+
+        resultado = pd.DataFrame({
+            'municipio': df['municipio'].fillna('').map(normalizar_texto),
+            'bairro': bairros.fillna('').map(normalizar_texto),
+            'categoria': naturezas.map(categorias).astype(np.int8),
+            'ano': pd.to_numeric(df['ano'], errors='coerce'),
+            'mes': pd.to_numeric(df['mes'], errors='coerce'),
+            'ocorrencias': ocorrencias
+        })
+        validos = resultado['ano'].notna() & resultado['mes'].notna() & (resultado['municipio'] != '')
+        return resultado[validos]
+
+    def _caminho_particao(self, uf: str, periodo: str, origem: str) -> str:
+        return os.path.join(self.diretorio, 'particoes', uf, periodo, f"{origem}.npz")
+
+    def _ler_particao(self, uf: str, periodo: str, origem: str) -> Optional[pd.DataFrame]:
+        caminho = self._caminho_particao(uf, periodo, origem)
+        if not os.path.exists(caminho):
+            return None
+        with np.load(caminho) as dados:
+            return pd.DataFrame({coluna: dados[coluna] for coluna in dados.files})
+
+    def _gravar_particao(self, uf: str, periodo: str, origem: str, df: pd.DataFrame):
+        caminho = self._caminho_particao(uf, periodo, origem)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        np.savez_compressed(
+            caminho,
+            municipio=df['municipio'].to_numpy(dtype=str),
+            bairro=df['bairro'].to_numpy(dtype=str),
+            categoria=df['categoria'].to_numpy(dtype=np.int8),
+            ocorrencias=df['ocorrencias'].to_numpy(dtype=np.int64)
+        )
+
+    def _carregar_manifesto(self) -> Dict[str, List[str]]:
+        if not os.path.exists(self.caminho_manifesto):
+            return {}
+        with open(self.caminho_manifesto, encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+
+    def _gravar_manifesto(self, manifesto: Dict[str, List[str]]):
+        with open(self.caminho_manifesto, 'w', encoding='utf-8') as arquivo:
+            json.dump(manifesto, arquivo, indent=2)
+
+    def _carregar_agregados(self) -> pd.DataFrame:
+        colunas = ['uf', 'municipio', 'bairro'] + CATEGORIAS
+        if not os.path.exists(self.caminho_agregados):
+            return pd.DataFrame(columns=colunas)
+        with np.load(self.caminho_agregados) as dados:
+            df = pd.DataFrame({coluna: dados[coluna] for coluna in ('uf', 'municipio', 'bairro')})
+            df[CATEGORIAS] = dados['contagens']
+        return df
+
+    def _atualizar_agregados(self, uf: str, delta: pd.DataFrame, manifesto: Dict[str, List[str]]):
+        """Soma a diferença nas contagens por bairro e por municipio"""
+        largura = delta.pivot_table(index=['municipio', 'bairro'], columns='categoria',
+                                    values='ocorrencias', aggfunc='sum', fill_value=0)
+        largura = largura.reindex(columns=range(len(CATEGORIAS)), fill_value=0)
+        largura.columns = CATEGORIAS
+        largura = largura.reset_index()
+
+        por_bairro = largura[largura['bairro'] != '']
+        por_municipio = largura.groupby('municipio', as_index=False)[CATEGORIAS].sum().assign(bairro='')
+
+        atualizacao = pd.concat([por_bairro, por_municipio], ignore_index=True).assign(uf=uf)
+        agregados = pd.concat([self._carregar_agregados(), atualizacao], ignore_index=True)
+        agregados = agregados.groupby(['uf', 'municipio', 'bairro'], as_index=False)[CATEGORIAS].sum()
+        self._gravar_agregados(agregados, manifesto)
+
+    def _gravar_agregados(self, agregados: pd.DataFrame, manifesto: Dict[str, List[str]]):
+        """Recalcula taxas por habitante e percentis e grava os agregados"""
+        contagens = agregados[CATEGORIAS].to_numpy(dtype=np.int64)
+        meses = agregados['uf'].map(lambda sigla: max(len(manifesto.get(sigla, [])), 1)).to_numpy()
+        taxa_mensal = contagens.sum(axis=1) / meses
+
+        chaves = ['uf', 'municipio', 'bairro']
+        populacao = agregados[chaves].merge(self._carregar_populacao(), on=chaves, how='left')['populacao']
+        populacao = populacao.to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            taxa_habitantes = taxa_mensal / populacao * HABITANTES_TAXA
+
+        # percentil do bairro dentro do municipio e do municipio dentro da UF (sem população fica NaN)
+        eh_municipio = agregados['bairro'] == ''
+        grupo = agregados['uf'].where(eh_municipio, agregados['uf'] + '|' + agregados['municipio'] + '#b')
+        percentil = pd.Series(taxa_habitantes).groupby(grupo.to_numpy()).rank(pct=True).to_numpy()
+
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = self.caminho_agregados + '.tmp.npz'
+        np.savez_compressed(
+            temporario,
+            uf=agregados['uf'].to_numpy(dtype=str),
+            municipio=agregados['municipio'].to_numpy(dtype=str),
+            bairro=agregados['bairro'].to_numpy(dtype=str),
+            contagens=contagens,
+            taxa_mensal=taxa_mensal,
+            populacao=populacao,
+            taxa_habitantes=taxa_habitantes,
+            percentil=percentil,
+            categorias=np.array(CATEGORIAS)
+        )
+        os.replace(temporario, self.caminho_agregados)
+
+
+
+
+class IndiceSeguranca:
+    """Indice em memória sobre os agregados pré-calculados pelo IngestorSSP"""
+
+    def __init__(self, diretorio: str = None):
+        self.caminho = os.path.join(diretorio or Config.SECURITY_DATA_DIR, 'agregados.npz')
+        self._lock = threading.Lock()
+        self._mtime = None
+        # (linhas, dados) trocados de uma vez: uma consulta nunca mistura recargas
+        self._estado = None
+
+    def _recarregar_se_alterado(self):
+        try:
+            mtime = os.stat(self.caminho).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            with np.load(self.caminho) as arquivo:
+                dados = {coluna: arquivo[coluna] for coluna in arquivo.files}
+            linhas = {
+                (uf, municipio, bairro): linha
+                for linha, (uf, municipio, bairro) in enumerate(zip(dados['uf'], dados['municipio'], dados['bairro']))
+            }
+            self._estado = (linhas, dados)
+            self._mtime = mtime
+
+    def aquecer(self):
+        """Carrega os agregados agora, em vez de na primeira consulta"""
+        self._recarregar_se_alterado()
+
+    def consultar(self, cidade: str, estado: str, bairro: str = None) -> Optional[Dict[str, Any]]:
+        """Busca os indicadores do bairro (ou do municipio, se o bairro não tiver dados ou população)"""
+        self._recarregar_se_alterado()
+        estado_atual = self._estado
+        if estado_atual is None:
+            return None
+        linhas, dados = estado_atual
+        if 'taxa_habitantes' not in dados:
+            return None  # agregados de antes da normalização por população
+
+        uf = sigla_uf(estado)
+        municipio = normalizar_texto(cidade)
+        candidatas = [('bairro', (uf, municipio, normalizar_texto(bairro)))] if bairro else []
+        candidatas.append(('municipio', (uf, municipio, '')))
+        for nivel, chave in candidatas:
+            linha = linhas.get(chave)
+            if linha is not None and not np.isnan(dados['percentil'][linha]):
+                break
+        else:
+            return None
+
+        contagens = dados['contagens'][linha]
+        categorias = dados['categorias']
+        ordem = np.argsort(contagens)[::-1]
+
+        return {
+            'nivel': nivel,
+            'taxa_mensal': float(dados['taxa_mensal'][linha]),
+            'taxa_100mil_habitantes': float(dados['taxa_habitantes'][linha]),
+            'percentil': float(dados['percentil'][linha]),
+            'principais_tipos': [str(categorias[i]) for i in ordem[:3] if contagens[i] > 0],
+            'total_ocorrencias': int(contagens.sum())
+        }
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingere CSVs de ocorrencias das SSPs estaduais')
+    parser.add_argument('arquivos', nargs='*', help='CSVs mensais de ocorrencias')
+    parser.add_argument('--populacao', help='CSV de população por municipio/bairro (municipio;bairro;populacao)')
+    parser.add_argument('--uf', required=True, help='UF dos arquivos (sigla ou nome)')
+    parser.add_argument('--sep', default=';')
+    parser.add_argument('--encoding', default='latin-1')
+    parser.add_argument('--coluna', action='append', default=[],
+                        help='mapeamento de coluna no formato destino=origem (ex.: natureza=RUBRICA)')
+    args = parser.parse_args()
+
+    colunas = dict(item.split('=', 1) for item in args.coluna)
+    ingestor = IngestorSSP()
+    if args.populacao:
+        total = ingestor.ingerir_populacao(args.populacao, args.uf, sep=args.sep, encoding=args.encoding)
+        print(f"{args.populacao}: população de {total} localidades")
+    for arquivo in args.arquivos:
+        resumo = ingestor.ingerir_csv(arquivo, args.uf, colunas=colunas, sep=args.sep, encoding=args.encoding)
+        for periodo, total in resumo.items():
+            print(f"{arquivo}: {periodo} -> {total} ocorrencias")
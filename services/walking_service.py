@@ -0,0 +1,314 @@
+import argparse
+import heapq
+import math
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
+from config import Config
+from utils.geometria import METROS_POR_GRAU
+from utils.json_stream import iterar_array_json
+from utils.normalizacao import normalizar_texto
+
+
+
+
+# vias do OSM em que se anda a pé (foot=no/private exclui; foot=yes inclui qualquer highway)
+VIAS_PEDESTRES = {
+    'footway', 'path', 'pedestrian', 'steps', 'living_street', 'residential', 'service',
+    'unclassified', 'tertiary', 'tertiary_link', 'secondary', 'secondary_link',
+    'primary', 'primary_link', 'track', 'corridor', 'crossing', 'road'
+}
+SEM_PEDESTRE = {'no', 'private'}
+
+# faixas das isócronas, em minutos de caminhada
+ISOCRONAS_MINUTOS = (5, 10, 15)
+
+# lado da célula da grade de vizinhança dos nós, em metros
+TAMANHO_CELULA = 100
+
+
+
+
+def _eh_via_pedestre(tags: Dict[str, str]) -> bool:
+    if tags.get('foot') in SEM_PEDESTRE or (tags.get('access') in SEM_PEDESTRE and tags.get('foot') != 'yes'):
+        return False
+    return tags.get('highway') in VIAS_PEDESTRES or (tags.get('highway') is not None and tags.get('foot') == 'yes')
+
+
+def _metros(lat0: np.ndarray, lon0: np.ndarray, lat1: np.ndarray, lon1: np.ndarray) -> np.ndarray:
+    """Distância equiretangular (suficiente para trechos de rua)"""
+    escala = np.cos(np.radians((lat0 + lat1) / 2))
+    return METROS_POR_GRAU * np.hypot(lat1 - lat0, (lon1 - lon0) * escala)
+
+
+
+
+class ConstrutorGrafoPedestre:
+    """Converte um extrato do OSM (JSON do Overpass) no grafo de pedestres de uma cidade
+
+    O extrato sai de uma query como `way["highway"](area); (._;>;); out;`. O grafo é
+    gravado num .npz em CSR (nó -> arestas de saída, comprimentos em metros, nos dois
+    sentidos) com as coordenadas dos nós e uma grade uniforme (CSR de célula -> nós)
+    para achar o nó mais próximo de um ponto.
+    """
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or Config.WALKING_GRAPH_DIR
+
+    def construir(self, cidade: str, caminho_osm: str) -> Dict[str, Any]:
+        ids, lats, lons = [], [], []
+        origens, destinos = [], []
+        with open(caminho_osm, 'rb') as arquivo:
+            for elemento in iterar_array_json(iter(lambda: arquivo.read(1 << 20), b''), 'elements'):
+                if elemento.get('type') == 'node':
+                    ids.append(elemento['id'])
+                    lats.append(elemento['lat'])
+                    lons.append(elemento['lon'])
+                elif elemento.get('type') == 'way' and _eh_via_pedestre(elemento.get('tags') or {}):
+                    nos = elemento.get('nodes') or []
+                    origens.extend(nos[:-1])
+                    destinos.extend(nos[1:])
+
+        if not origens:
+            raise ValueError(f"Nenhuma via de pedestre em {caminho_osm}")
+
+        # ids do OSM -> posições no vetor de nós ordenado
+        ids = np.asarray(ids, dtype=np.int64)
+        ordem = np.argsort(ids)
+        ids, lats, lons = ids[ordem], np.asarray(lats)[ordem], np.asarray(lons)[ordem]
+        origens, destinos = np.asarray(origens, dtype=np.int64), np.asarray(destinos, dtype=np.int64)
+        posicao_origem = np.clip(np.searchsorted(ids, origens), 0, len(ids) - 1)
+        posicao_destino = np.clip(np.searchsorted(ids, destinos), 0, len(ids) - 1)
+        validas = (ids[posicao_origem] == origens) & (ids[posicao_destino] == destinos) & (origens != destinos)
+        posicao_origem, posicao_destino = posicao_origem[validas], posicao_destino[validas]
+
+        # só os nós que pertencem a alguma via, renumerados
+        usados, inversa = np.unique(np.concatenate([posicao_origem, posicao_destino]), return_inverse=True)
+        lats, lons = lats[usados], lons[usados]
+        a, b = np.split(inversa, 2)
+        comprimentos = _metros(lats[a], lons[a], lats[b], lons[b]).astype(np.float32)
+
+        # arestas nos dois sentidos, ordenadas pela origem
+        de = np.concatenate([a, b])
+        para = np.concatenate([b, a]).astype(np.int32)
+        pesos = np.concatenate([comprimentos, comprimentos])
+        ordem = np.argsort(de, kind='stable')
+        inicio = np.zeros(len(usados) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(de, minlength=len(usados)), out=inicio[1:])
+
+        grade, inicio_celulas, nos_celulas = self._indexar(lats, lons)
+
+        slug = normalizar_texto(cidade).replace(' ', '-')
+        os.makedirs(self.diretorio, exist_ok=True)
+        caminho = os.path.join(self.diretorio, f"{slug}.npz")
+        # troca atômica: um worker que (re)carregue agora nunca lê o arquivo pela metade
+        with open(caminho + '.tmp', 'wb') as arquivo:
+            np.savez(
+                arquivo,
+                lats=lats, lons=lons,
+                inicio=inicio, destinos=para[ordem], pesos=pesos[ordem],
+                grade=grade, inicio_celulas=inicio_celulas, nos_celulas=nos_celulas
+            )
+        os.replace(caminho + '.tmp', caminho)
+        return {'cidade': cidade, 'nos': len(usados), 'arestas': int(len(para))}
+
+    def _indexar(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Grade de TAMANHO_CELULA metros: (lat0, lon0, passo_lat, passo_lon, linhas, colunas) e o CSR"""
+        lat0, lon0 = lats.min(), lons.min()
+        passo_lat = TAMANHO_CELULA / METROS_POR_GRAU
+        passo_lon = passo_lat / math.cos(math.radians((lats.min() + lats.max()) / 2))
+        linhas = int((lats.max() - lat0) // passo_lat) + 1
+        colunas = int((lons.max() - lon0) // passo_lon) + 1
+
+        celula = ((lats - lat0) // passo_lat).astype(np.int64) * colunas + ((lons - lon0) // passo_lon).astype(np.int64)
+        inicio_celulas = np.zeros(linhas * colunas + 1, dtype=np.int64)
+        np.cumsum(np.bincount(celula, minlength=linhas * colunas), out=inicio_celulas[1:])
+
+        grade = np.array([lat0, lon0, passo_lat, passo_lon, linhas, colunas], dtype=np.float64)
+        return grade, inicio_celulas, np.argsort(celula, kind='stable').astype(np.int32)
+
+
+
+
+class _Grafo:
+    """Grafo de uma cidade carregado: CSR, coordenadas e a busca do nó mais próximo"""
+
+    def __init__(self, caminho: str):
+        with np.load(caminho) as dados:
+            self.lats = dados['lats']
+            self.lons = dados['lons']
+            self.inicio = dados['inicio']
+            self.destinos = dados['destinos']
+            self.pesos = dados['pesos']
+            self.inicio_celulas = dados['inicio_celulas']
+            self.nos_celulas = dados['nos_celulas']
+            self.lat0, self.lon0, self.passo_lat, self.passo_lon, linhas, colunas = dados['grade'].tolist()
+        self.linhas, self.colunas = int(linhas), int(colunas)
+        self.escala_lon = self.passo_lat / self.passo_lon
+
+    def contem(self, latitude: float, longitude: float) -> bool:
+        i = (latitude - self.lat0) // self.passo_lat
+        j = (longitude - self.lon0) // self.passo_lon
+        return 0 <= i < self.linhas and 0 <= j < self.colunas
+
+    def no_mais_proximo(self, latitude: float, longitude: float, distancia_maxima: float) -> Optional[Tuple[int, float]]:
+        """(nó, metros até ele), procurando em anéis de células até `distancia_maxima`"""
+        i = int((latitude - self.lat0) // self.passo_lat)
+        j = int((longitude - self.lon0) // self.passo_lon)
+        melhor, melhor_distancia = None, float('inf')
+        for raio in range(int(math.ceil(distancia_maxima / TAMANHO_CELULA)) + 1):
+            # um nó no anel `raio` está a pelo menos (raio - 1) células do ponto
+            if melhor is not None and melhor_distancia <= (raio - 1) * TAMANHO_CELULA:
+                break
+            fatias = []
+            for linha in range(max(i - raio, 0), min(i + raio, self.linhas - 1) + 1):
+                if linha in (i - raio, i + raio):
+                    # linha da borda do anel: faixa contínua de células
+                    c0, c1 = max(j - raio, 0), min(j + raio, self.colunas - 1)
+                    if c0 <= c1:
+                        fatias.append((linha * self.colunas + c0, linha * self.colunas + c1 + 1))
+                else:
+                    fatias.extend((linha * self.colunas + coluna, linha * self.colunas + coluna + 1)
+                                  for coluna in (j - raio, j + raio) if 0 <= coluna < self.colunas)
+            nos = [self.nos_celulas[self.inicio_celulas[c0]:self.inicio_celulas[c1]] for c0, c1 in fatias]
+            nos = np.concatenate(nos) if nos else ()
+            if not len(nos):
+                continue
+            distancias = np.hypot(self.lats[nos] - latitude, (self.lons[nos] - longitude) * self.escala_lon)
+            indice = int(distancias.argmin())
+            if distancias[indice] * METROS_POR_GRAU < melhor_distancia:
+                melhor, melhor_distancia = int(nos[indice]), float(distancias[indice] * METROS_POR_GRAU)
+        if melhor is None or melhor_distancia > distancia_maxima:
+            return None
+        return melhor, melhor_distancia
+
+    def dijkstra(self, origem: int, limite: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Distâncias (m) de `origem` a todos os nós até `limite`, como (nós ordenados, distâncias)"""
+        distancias = {origem: 0.0}
+        fila = [(0.0, origem)]
+        inicio, destinos, pesos = self.inicio, self.destinos, self.pesos
+        while fila:
+            distancia, no = heapq.heappop(fila)
+            if distancia > distancias[no]:
+                continue
+            a, b = inicio[no], inicio[no + 1]
+            for vizinho, peso in zip(destinos[a:b].tolist(), pesos[a:b].tolist()):
+                nova = distancia + peso
+                if nova <= limite and nova < distancias.get(vizinho, math.inf):
+                    distancias[vizinho] = nova
+                    heapq.heappush(fila, (nova, vizinho))
+
+        nos = np.fromiter(distancias.keys(), dtype=np.int64, count=len(distancias))
+        valores = np.fromiter(distancias.values(), dtype=np.float32, count=len(distancias))
+        ordem = np.argsort(nos)
+        return nos[ordem], valores[ordem]
+
+
+
+
+class Isocrona:
+    """Tempos de caminhada a partir de um ponto, até o maior limite de ISOCRONAS_MINUTOS"""
+
+    def __init__(self, grafo: _Grafo, nos: np.ndarray, distancias: np.ndarray, distancia_inicial: float):
+        self.grafo = grafo
+        self.nos = nos
+        self.distancias = distancias
+        self.distancia_inicial = distancia_inicial
+        self.metros_por_minuto = Config.WALKING_SPEED_KMH * 1000 / 60
+
+    def minutos_ate(self, latitude: float, longitude: float) -> Optional[float]:
+        """Minutos a pé até o ponto pela rede de ruas, ou None se passar do limite"""
+        proximo = self.grafo.no_mais_proximo(latitude, longitude, Config.WALKING_MAX_SNAP)
+        if proximo is None:
+            return None
+        no, distancia_final = proximo
+        posicao = np.searchsorted(self.nos, no)
+        if posicao >= len(self.nos) or self.nos[posicao] != no:
+            return None
+        metros = self.distancia_inicial + float(self.distancias[posicao]) + distancia_final
+        minutos = metros / self.metros_por_minuto
+        return minutos if minutos <= ISOCRONAS_MINUTOS[-1] else None
+
+    def contar(self, minutos: List[Optional[float]]) -> Dict[str, int]:
+        """Quantos dos tempos cabem em cada faixa ({'5_min': n, '10_min': n, '15_min': n})"""
+        return {
+            f"{limite}_min": sum(1 for valor in minutos if valor is not None and valor <= limite)
+            for limite in ISOCRONAS_MINUTOS
+        }
+
+
+
+
+class AcessibilidadePedestre:
+    """Isócronas de caminhada sobre os grafos de pedestres pré-calculados
+
+    A busca de Dijkstra de cada nó de origem fica num LRU em memória, então pontos
+    vizinhos que caem no mesmo nó (e o heatmap) não refazem a busca.
+    """
+
+    def __init__(self, diretorio: str = None):
+        self.diretorio = diretorio or Config.WALKING_GRAPH_DIR
+        self._grafos = None
+        self._lock = threading.Lock()
+        self._buscas = OrderedDict()
+        self._lock_buscas = threading.Lock()
+
+    def _carregar(self) -> List[_Grafo]:
+        if self._grafos is not None:
+            return self._grafos
+
+        with self._lock:
+            if self._grafos is None:
+                grafos = []
+                if os.path.isdir(self.diretorio):
+                    for nome in sorted(os.listdir(self.diretorio)):
+                        if nome.endswith('.npz'):
+                            grafos.append(_Grafo(os.path.join(self.diretorio, nome)))
+                self._grafos = grafos
+        return self._grafos
+
+    def aquecer(self):
+        """Carrega os grafos agora, em vez de na primeira consulta"""
+        self._carregar()
+
+    def isocrona(self, latitude: float, longitude: float) -> Optional[Isocrona]:
+        """Isócrona do ponto, ou None fora dos grafos carregados (ou longe de qualquer rua)"""
+        for indice, grafo in enumerate(self._carregar()):
+            if not grafo.contem(latitude, longitude):
+                continue
+            proximo = grafo.no_mais_proximo(latitude, longitude, Config.WALKING_MAX_SNAP)
+            if proximo is None:
+                continue
+            origem, distancia_inicial = proximo
+            nos, distancias = self._buscar(indice, grafo, origem)
+            return Isocrona(grafo, nos, distancias, distancia_inicial)
+        return None
+
+    def _buscar(self, indice: int, grafo: _Grafo, origem: int) -> Tuple[np.ndarray, np.ndarray]:
+        chave = (indice, origem)
+        with self._lock_buscas:
+            if chave in self._buscas:
+                self._buscas.move_to_end(chave)
+                return self._buscas[chave]
+
+        limite = ISOCRONAS_MINUTOS[-1] * Config.WALKING_SPEED_KMH * 1000 / 60
+        resultado = grafo.dijkstra(origem, limite)
+        with self._lock_buscas:
+            self._buscas[chave] = resultado
+            while len(self._buscas) > Config.WALKING_CACHE_SIZE:
+                self._buscas.popitem(last=False)
+        return resultado
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prepara o grafo de pedestres de uma cidade a partir de um extrato do OSM')
+    parser.add_argument('cidade')
+    parser.add_argument('osm_json', help="resposta do Overpass para 'way[\"highway\"](area); (._;>;); out;'")
+    args = parser.parse_args()
+
+    resumo = ConstrutorGrafoPedestre().construir(args.cidade, args.osm_json)
+    print(f"{resumo['cidade']}: {resumo['nos']} nós, {resumo['arestas']} arestas")
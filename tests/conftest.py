@@ -0,0 +1,70 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import cache as cache_module  # noqa: E402
+
+
+
+
+class RedisMemoria:
+    """Cliente Redis em memória (get/mget/setex/incr/pipeline), guardando o TTL de cada chave"""
+
+    def __init__(self):
+        self.dados = {}
+        self.ttls = {}
+
+    def get(self, chave):
+        return self.dados.get(chave)
+
+    def mget(self, chaves):
+        return [self.dados.get(chave) for chave in chaves]
+
+    def setex(self, chave, timeout, valor):
+        self.dados[chave] = valor
+        self.ttls[chave] = timeout
+
+    def incr(self, chave):
+        self.dados[chave] = int(self.dados.get(chave, 0)) + 1
+        return self.dados[chave]
+
+    def decr(self, chave):
+        self.dados[chave] = int(self.dados.get(chave, 0)) - 1
+        return self.dados[chave]
+
+    def expire(self, chave, timeout):
+        self.ttls[chave] = timeout
+        return True
+
+    def ping(self):
+        return True
+
+    def pipeline(self, transaction=False):
+        return _PipelineMemoria(self)
+
+
+class _PipelineMemoria:
+    def __init__(self, redis):
+        self.redis = redis
+        self.comandos = []
+
+    def __getattr__(self, nome):
+        return lambda *args: self.comandos.append((nome, args))
+
+    def execute(self):
+        return [getattr(self.redis, nome)(*args) for nome, args in self.comandos]
+
+
+
+
+@pytest.fixture
+def redis_memoria():
+    """Troca o anel de cache por um nó em memória durante o teste"""
+    anterior = cache_module.anel_redis
+    cliente = RedisMemoria()
+    cache_module.anel_redis = cache_module.AnelRedis(conexoes=[cache_module.ConexaoRedis(cliente=cliente)])
+    yield cliente
+    cache_module.anel_redis = anterior
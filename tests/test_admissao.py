@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import app as aplicacao
+from utils.admissao import ControleAdmissao
+
+
+@pytest.fixture
+def cliente(redis_memoria, monkeypatch):
+    # sem vaga livre nem lugar na fila: toda análise que precisar calcular é recusada
+    controle = ControleAdmissao(limite=1, tamanho_fila=0, espera_maxima=0)
+    controle.entrar()
+    monkeypatch.setattr(aplicacao, 'controle_admissao', controle)
+    aplicacao.request_counts.clear()
+    return aplicacao.app.test_client()
+
+
+@pytest.mark.parametrize('rota, corpo', [
+    ('/api/analyze', {'endereco': 'Avenida Paulista, 1000'}),
+    ('/api/summary', {'endereco': 'Avenida Paulista, 1000'}),
+    ('/api/similar', {'endereco': 'Avenida Paulista, 1000'}),
+])
+def test_rotas_que_analisam_respondem_503(cliente, rota, corpo):
+    resposta = cliente.post(rota, json=corpo)
+    assert resposta.status_code == 503
+    assert int(resposta.headers['Retry-After']) >= 1
+
+
+def test_heatmap_responde_503_so_no_miss(cliente, redis_memoria, monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(aplicacao.heatmap_service.maps_service, 'buscar_elementos',
+                        lambda query: chamadas.append(query) or [])
+
+    resposta = cliente.get('/api/heatmap/14/6070/9290')
+    assert resposta.status_code == 503
+    assert not chamadas
+
+    # tile já no cache: servido sem pedir vaga
+    gerar_tile = type(aplicacao.heatmap_service).gerar_tile
+    redis_memoria.setex(gerar_tile.chave_cache((aplicacao.heatmap_service, 14, 6070, 9290, None), {}), 60,
+                        json.dumps({'z': 14}))
+    assert cliente.get('/api/heatmap/14/6070/9290').status_code == 200
+
+
+def test_lote_chama_o_gancho_so_no_miss(redis_memoria):
+    from utils.cache import LoteCache, cache
+
+    @cache('teste_gancho', timeout=60)
+    def dobrar(valor):
+        return valor * 2
+
+    chamadas = []
+    lote = LoteCache(antes_de_calcular=lambda: chamadas.append(1))
+    lote.adicionar('dobro', dobrar, 21)
+    assert lote.resultado('dobro') == 42
+    lote.gravar()
+
+    lote = LoteCache(antes_de_calcular=lambda: chamadas.append(1))
+    lote.adicionar('dobro', dobrar, 21)
+    assert lote.resultado('dobro') == 42
+    assert len(chamadas) == 1
@@ -0,0 +1,37 @@
+from utils.cache import AnelRedis, ConexaoRedis
+
+
+CHAVES = [f"chave:{indice}" for indice in range(20000)]
+
+
+def _anel(*urls):
+    return AnelRedis(conexoes=[ConexaoRedis(url) for url in urls], virtuais=160)
+
+
+def _donos(anel):
+    return {chave: anel.no(chave).nome for chave in CHAVES}
+
+
+def test_senha_e_db_padrao_nao_mudam_o_lugar_das_chaves():
+    simples = _donos(_anel('redis://a:6379', 'redis://b:6379'))
+    escrito_diferente = _donos(_anel('redis://:segredo@a:6379/0', 'redis://usuario:outra@b/'))
+    assert simples == escrito_diferente
+    assert set(simples.values()) == {'a:6379/0', 'b:6379/0'}
+
+
+def test_novo_no_so_recebe_chaves():
+    antes = _donos(_anel('redis://a', 'redis://b', 'redis://c'))
+    depois = _donos(_anel('redis://a', 'redis://b', 'redis://c', 'redis://d'))
+
+    movidas = [chave for chave in CHAVES if antes[chave] != depois[chave]]
+    assert {depois[chave] for chave in movidas} == {'d:6379/0'}
+    assert 0.18 < len(movidas) / len(CHAVES) < 0.32
+
+
+def test_remover_no_so_move_as_chaves_dele():
+    antes = _donos(_anel('redis://a', 'redis://b', 'redis://c'))
+    depois = _donos(_anel('redis://a', 'redis://c'))
+
+    assert all(antes[chave] == 'b:6379/0' for chave in CHAVES if antes[chave] != depois[chave])
+    # a ordem dos nós na configuração não importa
+    assert depois == _donos(_anel('redis://c', 'redis://a'))
@@ -0,0 +1,77 @@
+import json
+import os
+
+import pytest
+
+from services.boundaries_service import ConstrutorMalha, ResolvedorMalha
+
+
+def _quadrado(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+def _feicao(geometria, **propriedades):
+    return {'type': 'Feature', 'properties': propriedades, 'geometry': geometria}
+
+
+def _gravar(tmp_path, diretorio, camada, features):
+    caminho = tmp_path / f'{camada}.geojson'
+    caminho.write_text(json.dumps({'type': 'FeatureCollection', 'features': features}))
+    return ConstrutorMalha(diretorio).construir(camada, str(caminho))
+
+
+@pytest.fixture
+def resolvedor(tmp_path):
+    diretorio = str(tmp_path / 'malhas')
+    comum = {'NM_MUN': 'Cidade', 'CD_MUN': '3500000', 'SIGLA_UF': 'SP'}
+    _gravar(tmp_path, diretorio, 'bairros', [
+        # quadrado 0..1 com um buraco 0.4..0.6 (um parque de outro bairro, por exemplo)
+        _feicao({'type': 'Polygon', 'coordinates': [_quadrado(0, 0, 1, 1), _quadrado(0.4, 0.4, 0.6, 0.6)]},
+                NM_BAIRRO='Centro', **comum),
+        # bairro em duas partes separadas
+        _feicao({'type': 'MultiPolygon', 'coordinates': [[_quadrado(1, 0, 2, 1)], [_quadrado(3, 0, 4, 1)]]},
+                NM_BAIRRO='Ilhas', **comum),
+    ])
+    _gravar(tmp_path, diretorio, 'setores', [
+        # setores cobrem tudo, inclusive o buraco, com outro nome de bairro
+        _feicao({'type': 'Polygon', 'coordinates': [_quadrado(0, 0, 2, 1)]},
+                CD_SETOR='350000000000001', NM_BAIRRO='Centro Antigo', **comum),
+        _feicao({'type': 'Polygon', 'coordinates': [_quadrado(3, 0, 4, 1)]},
+                CD_SETOR='350000000000002', **comum),
+    ])
+    return ResolvedorMalha(diretorio)
+
+
+def test_bairros_tem_prioridade_sobre_setores(resolvedor):
+    resultado = resolvedor.resolver(0.2, 0.2)
+    assert resultado['bairro'] == 'Centro'
+    assert resultado['setor_censitario'] == '350000000000001'
+    assert resultado['cidade'] == 'Cidade' and resultado['estado'] == 'SP'
+
+
+def test_buraco_cai_para_a_camada_de_setores(resolvedor):
+    resultado = resolvedor.resolver(0.5, 0.5)
+    assert resultado['bairro'] == 'Centro Antigo'
+
+
+def test_multipoligono(resolvedor):
+    assert resolvedor.resolver(0.5, 1.5)['bairro'] == 'Ilhas'
+    assert resolvedor.resolver(0.5, 3.5)['bairro'] == 'Ilhas'
+    # entre as duas partes não há nenhuma feição
+    assert resolvedor.resolver(0.5, 2.5) is None
+
+
+def test_ponto_na_borda_maxima_da_grade(resolvedor):
+    # lat 1.0 é o topo da grade: a célula calculada passa da última
+    assert resolvedor.resolver(1.0, 1.5)['bairro'] == 'Ilhas'
+    assert resolvedor.resolver(0.5, 4.0)['bairro'] == 'Ilhas'
+    assert resolvedor.resolver(1.0, 4.0)['bairro'] == 'Ilhas'
+    assert resolvedor.resolver(1.0 + 1e-9, 1.5) is None
+
+
+def test_construir_troca_o_arquivo_inteiro(tmp_path):
+    diretorio = str(tmp_path / 'malhas')
+    _gravar(tmp_path, diretorio, 'bairros', [_feicao({'type': 'Polygon', 'coordinates': [_quadrado(0, 0, 1, 1)]}, NM_BAIRRO='A')])
+    _gravar(tmp_path, diretorio, 'bairros', [_feicao({'type': 'Polygon', 'coordinates': [_quadrado(0, 0, 1, 1)]}, NM_BAIRRO='B')])
+    assert os.listdir(diretorio) == ['bairros.npz']
+    assert ResolvedorMalha(diretorio).resolver(0.5, 0.5)['bairro'] == 'B'
@@ -0,0 +1,60 @@
+from config import Config
+from models.analysis import UrbanAnalysis
+from services.maps_service import MapsService
+from utils.metrics import CONSULTAS_CACHE
+
+
+def _consultas(resultado):
+    return CONSULTAS_CACHE.valores().get(('geocode', resultado), 0)
+
+
+def test_endereco_nao_encontrado_fica_em_cache_negativo(redis_memoria, monkeypatch):
+    chamadas = []
+
+    def nominatim(self, endereco):
+        chamadas.append(endereco)
+        return None
+
+    monkeypatch.setattr(MapsService, '_nominatim_geocodigo', nominatim)
+    analise = UrbanAnalysis()
+
+    hits_antes = _consultas('hit_negativo')
+    primeiro = analise.analyze_neighborhood('Rua Que Não Existe, 999')
+    segundo = analise.analyze_neighborhood('Rua Que Não Existe, 999')
+
+    assert primeiro['error'] == segundo['error'] == 'Endereço não encontrado'
+    assert len(chamadas) == 1
+    assert _consultas('hit_negativo') == hits_antes + 1
+
+    assert list(redis_memoria.dados.values()) == ['null']
+    ttl, = redis_memoria.ttls.values()
+    variacao = Config.CACHE_TTL_NEGATIVO * Config.CACHE_TTL_JITTER
+    assert Config.CACHE_TTL_NEGATIVO - variacao - 1 <= ttl <= Config.CACHE_TTL_NEGATIVO + variacao + 1
+
+
+def test_falha_do_nominatim_nao_e_guardada(redis_memoria, monkeypatch):
+    from utils.metrics import registrar_falha_upstream
+
+    def nominatim(self, endereco):
+        registrar_falha_upstream('nominatim', RuntimeError('timeout'))
+        return None
+
+    monkeypatch.setattr(MapsService, '_nominatim_geocodigo', nominatim)
+    UrbanAnalysis().analyze_neighborhood('Rua Qualquer, 10')
+
+    assert redis_memoria.dados == {}
+
+
+def test_entrada_degradada_conta_como_stale(redis_memoria):
+    from utils.cache import cache
+
+    @cache('teste_stale', timeout=3600, degradado=lambda resultado: resultado.get('fallback'),
+           timeout_degradado=60)
+    def consultar(valor):
+        return {'valor': valor, 'fallback': True}
+
+    antes = CONSULTAS_CACHE.valores().get(('teste_stale', 'stale'), 0)
+    assert consultar(1) == {'valor': 1, 'fallback': True}
+    assert consultar(1) == {'valor': 1, 'fallback': True}
+    assert CONSULTAS_CACHE.valores().get(('teste_stale', 'stale'), 0) == antes + 1
+    assert CONSULTAS_CACHE.valores().get(('teste_stale', 'hit'), 0) == 0
@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from services.environmental_service import ConstrutorGradeVerde, EnvironmentalService
+from utils.geometria import METROS_POR_GRAU
+
+
+def _quadrado(x0, y0, x1, y1):
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=float)
+
+
+def test_rasterizar_deixa_buraco_vazio():
+    grade = np.zeros((10, 10), dtype=np.uint8)
+    ConstrutorGradeVerde()._rasterizar([_quadrado(1, 1, 9, 9), _quadrado(3, 3, 7, 7)], grade)
+
+    assert grade.sum() == 64 - 16
+    assert grade[1:9, 1:9].sum() == 48
+    assert not grade[3:7, 3:7].any()
+    assert grade[0].sum() == 0 and grade[:, 9].sum() == 0
+
+
+def test_rasterizar_regra_par_impar_em_aneis_sobrepostos():
+    # dois anéis que se sobrepõem no mesmo polígono: a interseção fica de fora
+    grade = np.zeros((6, 10), dtype=np.uint8)
+    ConstrutorGradeVerde()._rasterizar([_quadrado(0, 0, 6, 6), _quadrado(4, 0, 10, 6)], grade)
+
+    assert grade[:, :4].all() and grade[:, 6:].all()
+    assert not grade[:, 4:6].any()
+
+
+@pytest.fixture
+def grade(tmp_path):
+    # parque de ~200 m x 200 m com um lago de ~100 m x 100 m no meio
+    lat, lon, lado = -23.55, -46.63, 200 / METROS_POR_GRAU
+    externo = _quadrado(lon, lat, lon + lado, lat + lado)
+    lago = _quadrado(lon + lado / 4, lat + lado / 4, lon + 3 * lado / 4, lat + 3 * lado / 4)
+    geojson = {'type': 'FeatureCollection', 'features': [{
+        'type': 'Feature',
+        'properties': {'leisure': 'park'},
+        'geometry': {'type': 'Polygon', 'coordinates': [externo.tolist() + [externo[0].tolist()], lago.tolist()]}
+    }]}
+    caminho = tmp_path / 'verde.geojson'
+    caminho.write_text(json.dumps(geojson))
+
+    diretorio = str(tmp_path / 'grades')
+    ConstrutorGradeVerde(diretorio, resolucao=10).construir('Cidade Teste', str(caminho))
+    return diretorio, lat, lon, lado
+
+
+def test_janela_das_somas_acumuladas(grade):
+    diretorio, lat, lon, lado = grade
+    servico = EnvironmentalService(diretorio)
+
+    # um quarto de lado para dentro da borda: só parque, sem o lago
+    parque = servico.analisar_ambiente(lat + lado / 8, lon + lado / 8, raio=10)
+    assert parque['green_coverage'] == 1.0
+
+    lago = servico.analisar_ambiente(lat + lado / 2, lon + lado / 2, raio=20)
+    assert lago['green_coverage'] == 0.0
+    assert lago['green_areas'] == 1  # o centroide cai no meio do lago
+
+    # janela cobrindo o parque inteiro: 3/4 da área com vegetação dentro de um quadrado maior
+    tudo = servico.analisar_ambiente(lat + lado / 2, lon + lado / 2, raio=1000)
+    soma = np.load(os.path.join(diretorio, 'cidade-teste.npy'))[0, -1, -1]
+    assert soma == pytest.approx(0.75 * 20 * 20, rel=0.1)
+    assert 0 < tudo['green_coverage'] < 0.75
+
+
+def test_reconstrucao_nao_mexe_na_grade_aberta(grade, tmp_path):
+    diretorio, lat, lon, lado = grade
+    servico = EnvironmentalService(diretorio)
+    antes = servico.analisar_ambiente(lat + lado / 8, lon + lado / 8, raio=10)
+    (_, somas), = servico._carregar_grades()
+    total = int(somas[0, -1, -1])
+
+    vazio = tmp_path / 'vazio.geojson'
+    quadrado = _quadrado(lon - lado, lat - lado, lon - lado / 2, lat - lado / 2)
+    vazio.write_text(json.dumps({'features': [{'properties': {}, 'geometry': {
+        'type': 'Polygon', 'coordinates': [quadrado.tolist()]}}]}))
+    ConstrutorGradeVerde(diretorio, resolucao=10).construir('Cidade Teste', str(vazio))
+
+    # o memmap antigo segue no arquivo antigo; só uma carga nova vê a grade nova
+    assert int(somas[0, -1, -1]) == total
+    assert servico.analisar_ambiente(lat + lado / 8, lon + lado / 8, raio=10) == antes
+    assert EnvironmentalService(diretorio).analisar_ambiente(lat + lado / 8, lon + lado / 8, raio=10)['green_coverage'] == 0.0
+    assert sorted(os.listdir(diretorio)) == ['cidade-teste.json', 'cidade-teste.npy']
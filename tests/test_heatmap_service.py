@@ -0,0 +1,93 @@
+import math
+
+import numpy as np
+import pytest
+
+from services.heatmap_service import (
+    HeatmapService, RAIO_TERRA, _convolver, _kernel_disco, _para_latlon
+)
+from utils.scoring import MotorPontuacao
+
+
+class MapsFalso:
+    def __init__(self, elementos):
+        self.elementos = elementos
+        self.consultas = []
+
+    def buscar_elementos(self, query):
+        self.consultas.append(query)
+        return self.elementos
+
+
+def _servico(tmp_path, elementos, celulas=16):
+    servico = HeatmapService(MapsFalso(elementos), MotorPontuacao(str(tmp_path / 'sem_distribuicoes.npz')))
+    servico.celulas = celulas
+    return servico
+
+
+def _centro_da_celula(z, x, y, celulas, linha, coluna):
+    tamanho = 2 * math.pi * RAIO_TERRA / 2 ** z
+    return _para_latlon(-math.pi * RAIO_TERRA + x * tamanho + (coluna + 0.5) * tamanho / celulas,
+                        math.pi * RAIO_TERRA - y * tamanho - (linha + 0.5) * tamanho / celulas)
+
+
+def test_convolucao_de_um_ponto_e_o_disco():
+    grade = np.zeros((21, 21))
+    grade[10, 10] = 3
+    kernel = _kernel_disco(4.5)
+    resultado = _convolver(grade, kernel)
+
+    assert resultado.sum() == 3 * kernel.sum()
+    assert resultado[10, 10] == 3 and resultado[10, 14] == 3 and resultado[10, 15] == 0
+    np.testing.assert_array_equal(resultado[5:16, 5:16], 3 * kernel)
+
+
+def test_contar_no_raio_corta_a_margem(tmp_path):
+    servico = _servico(tmp_path, [], celulas=4)
+    # grade de 8 x 8 células de 1 m com margem de 2 de cada lado; ponto no centro da célula (2, 2)
+    limites = (0.0, 0.0, 8.0, 8.0)
+    lat, lon = _para_latlon(2.5, 8 - 2.5)
+    contagem = servico._contar_no_raio([(lat, lon)], limites, 8, 1.0, 2)
+
+    esperado = np.zeros((4, 4))
+    esperado[0, 0] = esperado[0, 1] = esperado[1, 0] = 1
+    np.testing.assert_array_equal(contagem, esperado)
+
+
+@pytest.mark.parametrize('z, x, y', [(1, 0, 0), (1, 1, 1), (3, 7, 0), (3, 0, 7)])
+def test_bbox_do_tile_nas_bordas(tmp_path, z, x, y):
+    tile = HeatmapService.gerar_tile.__wrapped__(_servico(tmp_path, []), z, x, y)
+    sul, oeste, norte, leste = tile['bbox']
+    limite = math.degrees(math.atan(math.sinh(math.pi)))  # ~85.0511, topo do Web Mercator
+
+    assert oeste == pytest.approx(-180 + 360 * x / 2 ** z)
+    assert leste == pytest.approx(-180 + 360 * (x + 1) / 2 ** z)
+    assert norte == pytest.approx(math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2 ** z)))))
+    assert sul == pytest.approx(math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / 2 ** z)))))
+    if y == 0:
+        assert norte == pytest.approx(limite)
+    if y == 2 ** z - 1:
+        assert sul == pytest.approx(-limite)
+
+
+def test_tile_com_um_ponto_de_onibus(tmp_path):
+    z, x, y, celulas = 14, 6070, 9290, 16
+    lat, lon = _centro_da_celula(z, x, y, celulas, 8, 8)
+    servico = _servico(tmp_path, [{'lat': lat, 'lon': lon, 'tags': {'highway': 'bus_stop'}}], celulas)
+
+    tile = HeatmapService.gerar_tile.__wrapped__(servico, z, x, y)
+    transporte = np.array(tile['camadas']['transporte'])
+
+    assert tile['total_pois'] == 1
+    assert len(servico.maps_service.consultas) == 1
+    # sem distribuição da cidade a nota é a própria contagem: 1 dentro de 1 km, 0 fora
+    assert set(np.unique(transporte)) == {0.0, 1.0}
+
+    # distância no chão do centro de cada célula até o ponto
+    centros = np.array([[_centro_da_celula(z, x, y, celulas, i, j) for j in range(celulas)] for i in range(celulas)])
+    escala = math.cos(math.radians(lat))
+    distancias = 111320 * np.hypot(centros[..., 0] - lat, (centros[..., 1] - lon) * escala)
+    assert (transporte[distancias <= 950] == 1).all()
+    assert (transporte[distancias >= 1050] == 0).all()
+    lado_no_chao = 2 * math.pi * RAIO_TERRA / 2 ** z / celulas * escala
+    assert transporte.sum() == pytest.approx(math.pi * 1000 ** 2 / lado_no_chao ** 2, rel=0.1)
@@ -0,0 +1,130 @@
+import threading
+
+import redis
+
+from utils import jobs
+from utils.jobs import FilaRedis, FilaAutomatica
+
+
+class RedisListas:
+    """O pouco de Redis que a fila usa: strings, listas e conjuntos, sem expiração"""
+
+    def __init__(self):
+        self.valores, self.listas, self.conjuntos = {}, {}, {}
+
+    def setex(self, chave, ttl, valor):
+        self.valores[chave] = valor
+
+    def get(self, chave):
+        return self.valores.get(chave)
+
+    def exists(self, chave):
+        return int(chave in self.valores)
+
+    def delete(self, chave):
+        self.valores.pop(chave, None)
+
+    def lpush(self, chave, valor):
+        self.listas.setdefault(chave, []).insert(0, valor)
+
+    def rpush(self, chave, valor):
+        self.listas.setdefault(chave, []).append(valor)
+
+    def expire(self, chave, ttl):
+        pass
+
+    def rpoplpush(self, origem, destino):
+        if not self.listas.get(origem):
+            return None
+        valor = self.listas[origem].pop()
+        self.lpush(destino, valor)
+        return valor
+
+    def brpoplpush(self, origem, destino, timeout=0):
+        return self.rpoplpush(origem, destino)
+
+    def lrem(self, chave, quantidade, valor):
+        self.listas.get(chave, []).remove(valor)
+
+    def sadd(self, chave, valor):
+        self.conjuntos.setdefault(chave, set()).add(valor)
+
+    def srem(self, chave, valor):
+        self.conjuntos.get(chave, set()).discard(valor)
+
+    def smembers(self, chave):
+        return set(self.conjuntos.get(chave, set()))
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+def _fila():
+    fila = FilaRedis()
+    fila.redis = RedisListas()
+    return fila
+
+
+def test_jobs_de_consumidor_morto_voltam_para_a_fila():
+    fila = _fila()
+    job = fila.enfileirar('Avenida Paulista, 1000')
+
+    # consumidor pegou o job e morreu antes de terminar: o batimento expirou
+    fila.redis.sadd(fila.consumidores, 'morto')
+    fila.redis.rpoplpush(fila.fila, fila._processando('morto'))
+    # consumidor vivo com um job em andamento não é mexido
+    outro = fila.enfileirar('Rua Augusta, 500')
+    fila.redis.sadd(fila.consumidores, 'vivo')
+    fila._bater('vivo')
+    fila.redis.rpoplpush(fila.fila, fila._processando('vivo'))
+
+    assert fila.recuperar_orfaos() == 1
+    assert fila.redis.listas[fila.fila] == [job['id']]
+    assert fila.redis.listas[fila._processando('vivo')] == [outro['id']]
+    assert fila.redis.smembers(fila.consumidores) == {'vivo'}
+
+
+def test_consumidor_so_tira_o_job_do_processamento_depois_de_gravar():
+    fila = _fila()
+    job = fila.enfileirar('Avenida Paulista, 1000')
+    parar = threading.Event()
+    vistos = []
+
+    def analisar(endereco):
+        vistos.append([list(lista) for chave, lista in fila.redis.listas.items() if ':processando:' in chave])
+        parar.set()
+        return {'bairro': 'Bela Vista'}
+
+    fila.consumir(analisar, parar)
+
+    assert vistos == [[[job['id']]]]
+    assert all(not lista for chave, lista in fila.redis.listas.items() if ':processando:' in chave)
+    assert fila.obter(job['id'])['status'] == jobs.CONCLUIDO
+    assert fila.redis.smembers(fila.consumidores) == set()
+
+
+def test_backend_automatico_volta_ao_redis(monkeypatch):
+    agora = [100.0]
+    monkeypatch.setattr(jobs.time, 'monotonic', lambda: agora[0])
+    fila = FilaAutomatica(lambda endereco: {'bairro': 'Centro'})
+    fila.redis = _fila()
+    real = fila.redis.enfileirar
+
+    def fora_do_ar(endereco):
+        raise redis.ConnectionError('recusado')
+
+    fila.redis.enfileirar = fora_do_ar
+    local = fila.enfileirar('Avenida Paulista, 1000')
+    assert fila.backend == 'local'
+    assert fila.obter(local['id'], espera=5)['status'] == jobs.CONCLUIDO
+
+    fila.redis.enfileirar = real
+    assert fila.enfileirar('Rua Augusta, 500') and fila.backend == 'local'
+
+    agora[0] += jobs.Config.REDIS_PROBE_INTERVAL
+    remoto = fila.enfileirar('Rua Augusta, 500')
+    assert fila.backend == 'redis'
+    assert fila.obter(remoto['id'])['status'] == jobs.NA_FILA
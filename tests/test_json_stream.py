@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from utils import json_stream
+from utils.json_stream import iterar_array_json
+
+
+def _pedacos(texto, tamanho):
+    dados = texto.encode('utf-8') if isinstance(texto, str) else texto
+    return iter([dados[inicio:inicio + tamanho] for inicio in range(0, len(dados), tamanho)])
+
+
+ELEMENTOS = [
+    {'type': 'node', 'id': 1, 'lat': -23.5, 'lon': -46.6, 'tags': {'name': 'Padaria São João', 'amenity': 'bakery'}},
+    {'type': 'way', 'id': 2, 'center': {'lat': -23.4, 'lon': -46.5}, 'nodes': [3, 4, 5], 'tags': {'name': 'Chave } ] { [ "aspas" \\ barra'}},
+    12.5, 'texto', None, True, [1, [2, []]], {},
+]
+
+
+@pytest.mark.parametrize('tamanho', [1, 3, 7, 64, 1 << 16])
+def test_itens_iguais_ao_json_loads(tamanho):
+    corpo = json.dumps({'version': 0.6, 'osm3s': {'copyright': 'OSM'}, 'elements': ELEMENTOS, 'remark': 'x'},
+                       ensure_ascii=False)
+    assert list(iterar_array_json(_pedacos(corpo, tamanho), 'elements')) == ELEMENTOS
+
+
+@pytest.mark.parametrize('corpo, esperado', [
+    ('{"meta":{"elements":[{"id":99}]},"elements":[{"id":5}]}', [5]),
+    ('{"nota":"\\"elements\\": [{\\"id\\": 99}]","elements":[{"id":5}]}', [5]),
+    ('{"lista":[{"elements":[{"id":99}]}],"elements":[{"id":5}]}', [5]),
+    ('{"elements":{"id":99},"elements":[{"id":5}]}', [5]),
+])
+def test_so_a_chave_do_objeto_de_cima(corpo, esperado):
+    for tamanho in (1, 5, 1 << 16):
+        assert [item['id'] for item in iterar_array_json(_pedacos(corpo, tamanho), 'elements')] == esperado
+
+
+def test_sem_a_chave_nao_devolve_nada():
+    assert list(iterar_array_json(_pedacos('{"meta":{"elements":[1]}}', 4), 'elements')) == []
+    assert list(iterar_array_json(_pedacos('[{"elements":[1]}]', 4), 'elements')) == []
+
+
+def test_json_cortado_dentro_do_array():
+    with pytest.raises(ValueError):
+        list(iterar_array_json(_pedacos('{"elements":[{"id":1},{"id":', 3), 'elements'))
+
+
+def test_numero_no_fim_do_pedaco_nao_e_cortado():
+    assert list(iterar_array_json(iter([b'{"elements":[12', b'34,5', b'6]}']), 'elements')) == [1234, 56]
+
+
+def test_item_cortado_e_decodificado_uma_vez(monkeypatch):
+    chamadas = []
+    original = json_stream._DECODER.raw_decode
+
+    class Contador:
+        def raw_decode(self, texto, posicao=0):
+            chamadas.append(posicao)
+            return original(texto, posicao)
+
+    monkeypatch.setattr(json_stream, '_DECODER', Contador())
+    monkeypatch.setattr(json_stream, 'LEITURA_MINIMA', 1)
+    item = {'id': 1, 'tags': {'name': 'x' * 2000}}
+    corpo = json.dumps({'elements': [item]})
+
+    # 1 byte por leitura: no máximo uma tentativa que falha e a decodificação final
+    assert list(iterar_array_json(_pedacos(corpo, 1), 'elements')) == [item]
+    assert len(chamadas) <= 2
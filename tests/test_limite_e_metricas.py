@@ -0,0 +1,67 @@
+import json
+import os
+
+from config import Config
+from utils.limite_taxa import LimiteTaxa
+from utils.metrics import Registro
+
+
+def test_limite_vale_para_todos_os_workers(redis_memoria):
+    # dois workers, cada um com o seu LimiteTaxa, contando no mesmo Redis
+    workers = [LimiteTaxa(), LimiteTaxa()]
+    aceitas = sum(workers[indice % 2].permitir('10.0.0.1', 5) for indice in range(20))
+
+    assert aceitas == 5
+    assert workers[0].local == workers[1].local == {}
+    assert workers[0].permitir('10.0.0.2', 5)
+
+
+def test_limite_sem_redis_cai_para_memoria(monkeypatch):
+    from utils import cache as cache_module
+
+    monkeypatch.setattr(cache_module, 'anel_redis', cache_module.AnelRedis(conexoes=[cache_module.ConexaoRedis()]))
+    monkeypatch.setattr(cache_module.anel_redis.conexoes[0], '_aberto', True)
+    limite = LimiteTaxa()
+    assert [limite.permitir('10.0.0.1', 2) for _ in range(3)] == [True, True, False]
+
+
+def _registro():
+    registro = Registro()
+    contador = registro.contador('teste_total', 'teste', ['rotulo'])
+    histograma = registro.histograma('teste_segundos', 'teste', buckets=(1.0,))
+    return registro, contador, histograma
+
+
+def test_metricas_somam_todos_os_processos(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_DIR', str(tmp_path))
+    registro, contador, histograma = _registro()
+
+    # estado gravado por outro worker
+    outro, contador_outro, histograma_outro = _registro()
+    contador_outro.inc(3, rotulo='a')
+    histograma_outro.observar(0.5)
+    (tmp_path / '999999.json').write_text(json.dumps(outro.estado()))
+
+    contador.inc(2, rotulo='a')
+    contador.inc(rotulo='b')
+    histograma.observar(2.0)
+    texto = registro.exportar()
+
+    assert 'teste_total{rotulo="a"} 5' in texto
+    assert 'teste_total{rotulo="b"} 1' in texto
+    assert 'teste_segundos_bucket{le="1"} 1' in texto
+    assert 'teste_segundos_count 2' in texto
+
+
+def test_processo_encerrado_continua_somado(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_DIR', str(tmp_path))
+    registro, contador, _ = _registro()
+
+    for pid, valor in ((111, 3), (222, 4)):
+        morto, contador_morto, _ = _registro()
+        contador_morto.inc(valor, rotulo='a')
+        (tmp_path / f'{pid}.json').write_text(json.dumps(morto.estado()))
+        registro.arquivar_processo(pid)
+
+    assert not os.path.exists(tmp_path / '111.json')
+    assert 'teste_total{rotulo="a"} 7' in registro.exportar()
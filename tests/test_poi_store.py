@@ -0,0 +1,133 @@
+import json
+import time
+
+import pytest
+
+from config import Config
+from services.poi_store import ArmazemPOI
+
+
+def classificar(tipo, tags):
+    return ('escolas',) if tags.get('amenity') == 'school' else ()
+
+
+CENTRO = (-23.55, -46.63)
+
+
+@pytest.fixture
+def armazem(tmp_path):
+    lat, lon = CENTRO
+    extrato = {'elements': [
+        {'type': 'node', 'id': 1, 'lat': lat, 'lon': lon, 'tags': {'amenity': 'school', 'name': 'EE Um'}},
+        # via escolar com quatro vértices e nós de canto que definem a bbox do armazém
+        {'type': 'way', 'id': 10, 'nodes': [11, 12, 13, 14], 'tags': {'amenity': 'school', 'name': 'EE Via'}},
+        {'type': 'node', 'id': 11, 'lat': lat + 0.001, 'lon': lon + 0.001},
+        {'type': 'node', 'id': 12, 'lat': lat + 0.001, 'lon': lon + 0.003},
+        {'type': 'node', 'id': 13, 'lat': lat + 0.003, 'lon': lon + 0.003},
+        {'type': 'node', 'id': 14, 'lat': lat + 0.003, 'lon': lon + 0.001},
+        {'type': 'node', 'id': 90, 'lat': lat - 0.05, 'lon': lon - 0.05},
+        {'type': 'node', 'id': 91, 'lat': lat + 0.05, 'lon': lon + 0.05},
+    ]}
+    caminho = tmp_path / 'extrato.json'
+    caminho.write_text(json.dumps(extrato))
+    armazem = ArmazemPOI(classificar, str(tmp_path / 'pois.json.gz'))
+    armazem.importar_overpass(str(caminho), sequencia=100)
+    return armazem
+
+
+def _diff(tmp_path, corpo, nome='101.osc'):
+    caminho = tmp_path / nome
+    caminho.write_text(f'<osmChange version="0.6">{corpo}</osmChange>')
+    return str(caminho)
+
+
+def _escolas(armazem, raio=2000):
+    return {elemento['id']: elemento for elemento in armazem.elementos(*CENTRO, raio, 'escolas')}
+
+
+def _centro(elemento):
+    return elemento.get('center') or {'lat': elemento['lat'], 'lon': elemento['lon']}
+
+
+def test_criar_mover_e_remover_no(armazem, tmp_path):
+    lat, lon = CENTRO
+    armazem.aplicar_diff(_diff(tmp_path, f'''
+        <create><node id="2" lat="{lat + 0.002}" lon="{lon}"><tag k="amenity" v="school"/></node></create>
+        <modify><node id="1" lat="{lat - 0.002}" lon="{lon}"><tag k="amenity" v="school"/></node></modify>
+    '''), 101)
+    escolas = _escolas(armazem)
+    assert set(escolas) == {1, 2, 10}
+    assert escolas[1]['lat'] == pytest.approx(lat - 0.002)
+    assert armazem.sequencia == 101
+
+    armazem.aplicar_diff(_diff(tmp_path, '<delete><node id="2" lat="0" lon="0"/></delete>', '102.osc'), 102)
+    assert set(_escolas(armazem)) == {1, 10}
+
+
+def test_mover_vertice_recentraliza_via(armazem, tmp_path):
+    lat, lon = CENTRO
+    antes = _centro(_escolas(armazem)[10])
+    assert antes['lat'] == pytest.approx(lat + 0.002)
+
+    armazem.aplicar_diff(_diff(tmp_path, f'<modify><node id="13" lat="{lat + 0.007}" lon="{lon + 0.003}"/></modify>'), 101)
+    depois = _centro(_escolas(armazem)[10])
+    assert depois['lat'] == pytest.approx(lat + 0.004)
+    assert depois['lon'] == pytest.approx(lon + 0.002)
+
+
+def test_diff_fora_da_area_e_ignorado(armazem, tmp_path):
+    lat, lon = CENTRO
+    resumo = armazem.aplicar_diff(_diff(tmp_path, f'''
+        <create><node id="3" lat="10.0" lon="10.0"><tag k="amenity" v="school"/></node></create>
+        <create><way id="20"><nd ref="500"/><nd ref="501"/><tag k="amenity" v="school"/></way></create>
+        <modify><node id="1" lat="{lat + 1}" lon="{lon}"><tag k="amenity" v="school"/></node></modify>
+    '''), 101)
+    assert resumo['fora_da_area'] == 3
+    assert ('n', 3) not in armazem._pois and ('w', 20) not in armazem._pois
+    assert 20 not in armazem._refs_vias
+    # o nó 1 saiu da área: deixa de ser POI do armazém
+    assert set(_escolas(armazem, 200000)) == {10}
+
+
+def test_snapshot_ida_e_volta(armazem, tmp_path):
+    armazem.aplicar_diff(_diff(tmp_path, f'<modify><node id="13" lat="{CENTRO[0] + 0.007}" lon="{CENTRO[1] + 0.003}"/></modify>'), 101)
+    armazem.salvar()
+
+    relido = ArmazemPOI(classificar, armazem.caminho)
+    relido.aquecer()
+    assert relido.sequencia == 101
+    assert relido.bbox == pytest.approx(armazem.bbox)
+    assert _escolas(relido) == _escolas(armazem)
+    assert relido._coordenadas == armazem._coordenadas
+
+
+def test_chave_do_cache_muda_com_a_sequencia(armazem, tmp_path):
+    from services.maps_service import MapsService
+
+    servico = MapsService()
+    servico.pois = armazem
+    funcao = MapsService.analise_transporte
+    chave = funcao.chave_cache((servico, *CENTRO), {})
+
+    armazem.aplicar_diff(_diff(tmp_path, '<delete><node id="1" lat="0" lon="0"/></delete>'), 101)
+    assert funcao.chave_cache((servico, *CENTRO), {}) != chave
+    # fora da área coberta a chave continua a do Overpass, sem sequência
+    assert funcao.chave_cache((servico, 10.0, 10.0), {}) == funcao.chave_cache((MapsService(), 10.0, 10.0), {})
+
+
+def test_atualizacao_periodica_aplica_diffs_no_proprio_processo(armazem, tmp_path, monkeypatch):
+    diffs = tmp_path / 'diffs'
+    diffs.mkdir()
+    monkeypatch.setattr(Config, 'POI_DIFF_DIR', str(diffs))
+    armazem.iniciar_atualizacao_periodica(intervalo=0.01)
+
+    lat, lon = CENTRO
+    _diff(diffs, f'<create><node id="2" lat="{lat}" lon="{lon}"><tag k="amenity" v="school"/></node></create>', '101.osc')
+    _diff(diffs, '<delete><node id="1" lat="0" lon="0"/></delete>', '102.osc')
+
+    limite = time.time() + 5
+    while armazem.sequencia < 102 and time.time() < limite:
+        assert 10 in _escolas(armazem)  # as leituras seguem durante a aplicação
+        time.sleep(0.01)
+    assert armazem.sequencia == 102
+    assert set(_escolas(armazem)) == {2, 10}
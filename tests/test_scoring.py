@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+from utils.scoring import MotorPontuacao, construir_distribuicoes
+
+
+def test_valores_ausentes_ficam_sem_nota(tmp_path):
+    caminho = str(tmp_path / 'distribuicoes.npz')
+    construir_distribuicoes(pd.DataFrame({'cidade': ['Campinas'] * 100, 'escolas': np.arange(100)}), caminho)
+    motor = MotorPontuacao(caminho)
+
+    notas = motor.pontuar_lote('Campinas', {'escolas': [np.nan, 50, None, 1000]})['escolas']
+    assert np.isnan(notas[0]) and np.isnan(notas[2])
+    assert 4.5 <= notas[1] <= 5.5
+    assert notas[3] == 10.0
+    assert motor.pontuar('Campinas', {'escolas': float('nan')}) == {}
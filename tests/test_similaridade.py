@@ -0,0 +1,48 @@
+import math
+
+from utils.similaridade import ConstrutorIndiceSimilaridade, IndiceSimilaridade, DIMENSOES, vetor_do_dossie
+
+
+def _dossie(bairro, escolas, seguranca=None):
+    return {
+        'bairro': bairro,
+        'cidade': 'São Paulo',
+        'estado': 'São Paulo',
+        'coordenadas': {'latitude': -23.5, 'longitude': -46.6},
+        'dados_brutos': {
+            'infraestrutura': {'escolas': {'contagem': escolas}},
+            'seguranca': seguranca or {},
+        }
+    }
+
+
+def test_safety_score_simulado_fica_fora_do_vetor():
+    posicao = DIMENSOES.index('seguranca')
+    simulado = {'safety_score': 8, 'data_source': 'Simulado - Em produção usaria dados oficiais'}
+    oficial = {'safety_score': 8, 'data_source': 'Dados abertos SSP (agregado por bairro)'}
+
+    assert math.isnan(vetor_do_dossie(_dossie('Sé', 3, simulado))[posicao])
+    assert vetor_do_dossie(_dossie('Sé', 3, oficial))[posicao] == 8
+
+
+def test_indice_montado_offline_e_somente_leitura(tmp_path):
+    caminho = str(tmp_path / 'bairros.npz')
+    construtor = ConstrutorIndiceSimilaridade()
+    for bairro, escolas in [('Sé', 3), ('Liberdade', 4), ('Moema', 20), ('Sé', 5)]:
+        assert construtor.adicionar(_dossie(bairro, escolas))
+    assert not construtor.adicionar(_dossie('Não identificado', 1))
+    construtor.salvar(caminho)
+
+    indice = IndiceSimilaridade(caminho)
+    assert len(indice) == 3
+    assert not hasattr(indice, 'adicionar')
+
+    similares = indice.buscar_similares(_dossie('Sé', 4), k=2)
+    assert [similar['bairro'] for similar in similares] == ['Liberdade', 'Moema']
+    assert similares[0]['distancia'] == 0
+
+
+def test_indice_sem_arquivo_responde_vazio(tmp_path):
+    indice = IndiceSimilaridade(str(tmp_path / 'inexistente.npz'))
+    assert indice.buscar_similares(_dossie('Sé', 4)) == []
+    assert len(indice) == 0
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from services.ssp_ingestion import IngestorSSP, IndiceSeguranca
+
+
+def _csv(caminho, linhas):
+    caminho.write_text('municipio;bairro;natureza;ano;mes;ocorrencias\n' + '\n'.join(linhas) + '\n', encoding='latin-1')
+    return str(caminho)
+
+
+@pytest.fixture
+def ingestor(tmp_path):
+    ingestor = IngestorSSP(str(tmp_path / 'ssp'))
+    populacao = tmp_path / 'populacao.csv'
+    populacao.write_text('municipio;populacao\nCampinas;1.000.000\nValinhos;100.000\n', encoding='latin-1')
+    ingestor.ingerir_populacao(str(populacao), 'SP')
+    return ingestor
+
+
+def test_arquivos_do_mesmo_mes_se_somam(ingestor, tmp_path):
+    capital = _csv(tmp_path / 'furtos.csv', ['Campinas;Centro;Furto;2024;1;10'])
+    interior = _csv(tmp_path / 'roubos.csv', ['Campinas;Centro;Roubo;2024;1;5'])
+
+    ingestor.ingerir_csv(capital, 'SP')
+    ingestor.ingerir_csv(interior, 'SP')
+    # reingerir o mesmo arquivo substitui a contribuição dele, não soma de novo
+    ingestor.ingerir_csv(capital, 'SP')
+
+    dados = IndiceSeguranca(ingestor.diretorio).consultar('Campinas', 'SP')
+    assert dados['total_ocorrencias'] == 15
+    assert set(dados['principais_tipos']) == {'furto', 'roubo'}
+
+
+def test_percentil_por_habitante(ingestor, tmp_path):
+    # Campinas tem mais ocorrencias absolutas, mas Valinhos tem a maior taxa por habitante
+    ingestor.ingerir_csv(_csv(tmp_path / 'jan.csv', [
+        'Campinas;;Furto;2024;1;200',
+        'Valinhos;;Furto;2024;1;50',
+    ]), 'SP')
+
+    indice = IndiceSeguranca(ingestor.diretorio)
+    campinas = indice.consultar('Campinas', 'SP')
+    valinhos = indice.consultar('Valinhos', 'SP')
+    assert campinas['taxa_100mil_habitantes'] == pytest.approx(20)
+    assert valinhos['taxa_100mil_habitantes'] == pytest.approx(50)
+    assert valinhos['percentil'] > campinas['percentil']
+
+
+def test_sem_populacao_nao_entra_na_comparacao(ingestor, tmp_path):
+    ingestor.ingerir_csv(_csv(tmp_path / 'jan.csv', [
+        'Campinas;Centro;Furto;2024;1;20',
+        'Vinhedo;;Furto;2024;1;50',
+    ]), 'SP')
+
+    indice = IndiceSeguranca(ingestor.diretorio)
+    assert indice.consultar('Vinhedo', 'SP') is None
+    # o bairro sem população cai para o municipio
+    assert indice.consultar('Campinas', 'SP', 'Centro')['nivel'] == 'municipio'
+
+
+def test_recarga_troca_linhas_e_dados_juntos(ingestor, tmp_path):
+    ingestor.ingerir_csv(_csv(tmp_path / 'jan.csv', ['Campinas;;Furto;2024;1;20']), 'SP')
+    indice = IndiceSeguranca(ingestor.diretorio)
+    indice.aquecer()
+    linhas, dados = indice._estado
+
+    ingestor.ingerir_csv(_csv(tmp_path / 'fev.csv', ['Valinhos;;Roubo;2024;2;5']), 'SP')
+    leitores = [threading.Thread(target=indice.consultar, args=('Valinhos', 'SP')) for _ in range(4)]
+    for leitor in leitores:
+        leitor.start()
+    for leitor in leitores:
+        leitor.join()
+
+    novas_linhas, novos_dados = indice._estado
+    assert novas_linhas is not linhas and novos_dados is not dados
+    assert len(novas_linhas) == len(novos_dados['uf'])
+
+
+def test_celulas_vazias_nao_viram_bairro_nan(ingestor, tmp_path):
+    ingestor.ingerir_csv(_csv(tmp_path / 'jan.csv', [
+        'Campinas;;Furto;2024;1;20',
+        'Campinas;Centro;Roubo;2024;1;5',
+        ';Centro;Roubo;2024;1;7',
+    ]), 'SP')
+
+    agregados = ingestor._carregar_agregados()
+    chaves = set(zip(agregados['municipio'], agregados['bairro']))
+    assert chaves == {('campinas', ''), ('campinas', 'centro')}
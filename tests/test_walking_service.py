@@ -0,0 +1,129 @@
+import json
+import os
+
+import pytest
+
+from config import Config
+from services import walking_service
+from services.walking_service import AcessibilidadePedestre, ConstrutorGrafoPedestre, _Grafo
+from utils.geometria import METROS_POR_GRAU
+
+
+# 100 m em graus no equador (onde a escala de longitude é 1)
+CEM = 100 / METROS_POR_GRAU
+
+#   4 --- 5
+#   |     |
+#   1 --- 2 --- 3
+NOS = {1: (0, 0), 2: (0, CEM), 3: (0, 2 * CEM), 4: (CEM, 0), 5: (CEM, CEM)}
+VIAS = [
+    ([1, 2, 3], {'highway': 'footway'}),
+    ([1, 4, 5], {'highway': 'residential'}),
+    ([5, 2], {'highway': 'footway'}),
+    ([4, 3], {'highway': 'motorway'}),  # não é via de pedestre
+    ([1, 5], {'highway': 'footway', 'foot': 'no'}),  # atalho proibido a pé
+    ([3, 999], {'highway': 'footway'}),  # nó fora do extrato: aresta descartada
+]
+
+
+def _construir(tmp_path, nos, vias):
+    elementos = [{'type': 'node', 'id': id_no, 'lat': lat, 'lon': lon} for id_no, (lat, lon) in nos.items()]
+    elementos += [{'type': 'way', 'id': 100 + indice, 'nodes': refs, 'tags': tags} for indice, (refs, tags) in enumerate(vias)]
+    caminho = tmp_path / 'osm.json'
+    caminho.write_text(json.dumps({'version': 0.6, 'elements': elementos}))
+    diretorio = tmp_path / 'grafos'
+    return str(diretorio), ConstrutorGrafoPedestre(str(diretorio)).construir('Cidade', str(caminho))
+
+
+@pytest.fixture
+def grafo(tmp_path):
+    diretorio, resumo = _construir(tmp_path, NOS, VIAS)
+    assert resumo == {'cidade': 'Cidade', 'nos': 5, 'arestas': 10}
+    assert os.listdir(diretorio) == ['cidade.npz']
+    return diretorio, _Grafo(os.path.join(diretorio, 'cidade.npz'))
+
+
+def _posicoes():
+    """id do OSM -> posição do nó no grafo (os nós são guardados ordenados pelo id)"""
+    return {id_no: posicao for posicao, id_no in enumerate(sorted(NOS))}
+
+
+def test_csr_nos_dois_sentidos(grafo):
+    _, grafo = grafo
+    posicao = _posicoes()
+    vizinhos = {
+        no: sorted(grafo.destinos[grafo.inicio[posicao[no]]:grafo.inicio[posicao[no] + 1]].tolist())
+        for no in NOS
+    }
+    assert vizinhos == {
+        1: [posicao[2], posicao[4]],
+        2: [posicao[1], posicao[3], posicao[5]],
+        3: [posicao[2]],
+        4: [posicao[1], posicao[5]],
+        5: [posicao[2], posicao[4]],
+    }
+
+
+def test_dijkstra_com_limite(grafo):
+    _, grafo = grafo
+    posicao = _posicoes()
+    nos, distancias = grafo.dijkstra(posicao[1], 1000)
+    assert dict(zip(nos.tolist(), distancias.tolist())) == pytest.approx({
+        posicao[1]: 0, posicao[2]: 100, posicao[3]: 200, posicao[4]: 100, posicao[5]: 200
+    }, abs=0.5)
+
+    nos, _ = grafo.dijkstra(posicao[1], 150)
+    assert nos.tolist() == sorted([posicao[1], posicao[2], posicao[4]])
+
+
+def test_no_mais_proximo_olha_o_anel_vizinho(grafo):
+    _, grafo = grafo
+    posicao = _posicoes()
+    # na célula do nó 1, mas a 5 m do nó 2, que está na célula ao lado
+    no, metros = grafo.no_mais_proximo(0, 0.95 * CEM, 300)
+    assert no == posicao[2] and metros == pytest.approx(5, abs=0.1)
+
+    assert grafo.no_mais_proximo(-5 * CEM, 0, 300) is None
+
+
+def test_no_mais_proximo_para_cedo(tmp_path):
+    # um nó a 2 km estica a grade para ~20 x 20 células
+    nos = {**NOS, 6: (20 * CEM, 20 * CEM)}
+    diretorio, _ = _construir(tmp_path, nos, VIAS + [([5, 6], {'highway': 'footway'})])
+    grafo = _Grafo(os.path.join(diretorio, 'cidade.npz'))
+
+    class Contador:
+        def __init__(self, vetor):
+            self.vetor, self.leituras = vetor, 0
+
+        def __getitem__(self, fatia):
+            self.leituras += 1
+            return self.vetor[fatia]
+
+    grafo.nos_celulas = Contador(grafo.nos_celulas)
+    no, _ = grafo.no_mais_proximo(0, 0.1 * CEM, 100_000)
+    assert no == 0
+    # acha o nó 1 no anel 0 e para depois do anel 1, sem varrer os outros anéis da grade
+    assert grafo.nos_celulas.leituras <= 3
+
+
+def test_lru_das_buscas(grafo, monkeypatch):
+    diretorio, _ = grafo
+    monkeypatch.setattr(Config, 'WALKING_CACHE_SIZE', 1)
+    chamadas = []
+    dijkstra = walking_service._Grafo.dijkstra
+    monkeypatch.setattr(walking_service._Grafo, 'dijkstra',
+                        lambda self, origem, limite: chamadas.append(origem) or dijkstra(self, origem, limite))
+
+    acessibilidade = AcessibilidadePedestre(diretorio)
+    isocrona = acessibilidade.isocrona(0, 0)
+    acessibilidade.isocrona(0.01 * CEM, 0)  # mesmo nó de origem: vem do LRU
+    assert len(chamadas) == 1
+
+    acessibilidade.isocrona(0, 2 * CEM)  # outro nó: tira o primeiro do LRU de tamanho 1
+    acessibilidade.isocrona(0, 0)
+    assert len(chamadas) == 3
+
+    minutos = isocrona.minutos_ate(CEM, CEM)
+    assert minutos == pytest.approx(200 / (Config.WALKING_SPEED_KMH * 1000 / 60), rel=0.01)
+    assert isocrona.contar([minutos, None, 12.0]) == {'5_min': 1, '10_min': 1, '15_min': 2}
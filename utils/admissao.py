@@ -0,0 +1,120 @@
+import contextvars
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import Config
+from utils.metrics import REJEICOES_ADMISSAO
+
+
+
+
+# janela, em segundos, das conclusões usadas para estimar a vazão
+JANELA_VAZAO = 30
+
+
+
+
+class SobrecargaError(Exception):
+    """Fila de admissão cheia (ou espera esgotada): a requisição deve virar 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Servidor sobrecarregado, tente em {retry_after}s")
+        self.retry_after = retry_after
+
+
+
+
+class ControleAdmissao:
+    """Limite de análises calculando ao mesmo tempo, com fila de espera limitada
+
+    Vale por processo (cada worker do gunicorn tem o seu). Quem não consegue vaga nem
+    lugar na fila, ou espera mais que `espera_maxima`, recebe SobrecargaError com um
+    Retry-After estimado pela vazão recente (análises concluídas por segundo).
+    """
+
+    def __init__(self, limite: int = None, tamanho_fila: int = None, espera_maxima: float = None):
+        self.limite = limite or Config.ADMISSION_MAX_CONCURRENT
+        self.tamanho_fila = Config.ADMISSION_QUEUE_SIZE if tamanho_fila is None else tamanho_fila
+        self.espera_maxima = Config.ADMISSION_QUEUE_TIMEOUT if espera_maxima is None else espera_maxima
+        self.em_execucao = 0
+        self.na_fila = 0
+        self._concluidas = deque(maxlen=200)
+        self._condicao = threading.Condition()
+
+    def retry_after(self) -> int:
+        """Segundos até a fila atual escoar, pela vazão das últimas análises"""
+        with self._condicao:
+            return self._retry_after()
+
+    def _retry_after(self) -> int:
+        agora = time.monotonic()
+        while self._concluidas and agora - self._concluidas[0] > JANELA_VAZAO:
+            self._concluidas.popleft()
+        if len(self._concluidas) < 2:
+            return 1
+        vazao = len(self._concluidas) / max(agora - self._concluidas[0], 1e-3)
+        pendentes = self.em_execucao + self.na_fila + 1
+        return min(max(int(math.ceil(pendentes / vazao)), 1), 60)
+
+    def entrar(self):
+        with self._condicao:
+            if self.em_execucao < self.limite:
+                self.em_execucao += 1
+                return
+            if self.na_fila >= self.tamanho_fila:
+                REJEICOES_ADMISSAO.inc(motivo='fila_cheia')
+                raise SobrecargaError(self._retry_after())
+
+            self.na_fila += 1
+            limite = time.monotonic() + self.espera_maxima
+            try:
+                while self.em_execucao >= self.limite:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        REJEICOES_ADMISSAO.inc(motivo='espera_esgotada')
+                        raise SobrecargaError(self._retry_after())
+                    self._condicao.wait(restante)
+            finally:
+                self.na_fila -= 1
+            self.em_execucao += 1
+
+    def sair(self):
+        with self._condicao:
+            self.em_execucao -= 1
+            self._concluidas.append(time.monotonic())
+            self._condicao.notify()
+
+    @contextmanager
+    def sob_demanda(self):
+        """Bloco em que a vaga só é pedida se algo precisar ser calculado (ver exigir_admissao)
+
+        Requisições servidas inteiras do cache nunca entram na fila.
+        """
+        estado = {'controle': self, 'admitido': False}
+        token = _admissao_atual.set(estado)
+        try:
+            yield
+        finally:
+            _admissao_atual.reset(token)
+            if estado['admitido']:
+                self.sair()
+
+
+
+
+# bloco de sob_demanda() da requisição atual (None fora dele: jobs, benchmarks)
+_admissao_atual = contextvars.ContextVar('admissao_atual', default=None)
+
+
+def exigir_admissao():
+    """Ocupa uma vaga antes de trabalho caro (chamadas às APIs externas), uma vez por bloco
+
+    Levanta SobrecargaError se não houver vaga; fora de sob_demanda() não faz nada.
+    """
+    estado = _admissao_atual.get()
+    if estado is None or estado['admitido']:
+        return
+    estado['controle'].entrar()
+    estado['admitido'] = True
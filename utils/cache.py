@@ -1,66 +1,294 @@
 import redis
 import json
 import hashlib
+import bisect
+import inspect
+import random
+import threading
+import time
 from functools import wraps
+from typing import Optional, Any, Callable, Dict, List
+from urllib.parse import urlsplit
 from config import Config
+from utils.metrics import CONSULTAS_CACHE, TRANSICOES_CIRCUITO_REDIS, observar_falhas_upstream
 
 
 
 
+class ConexaoRedis:
+    """Cliente Redis criado sob demanda, com circuit breaker e sonda de reconexão
 
-try:
-    redis_client = redis.from_url(Config.REDIS_URL, decode_responses=True)
-    redis_client.ping()
-    REDIS_DISPONIVEL = True
-except:
-    REDIS_DISPONIVEL = False
-    print("Redis não disponível - cache desabilitado")
+    Depois de REDIS_CIRCUIT_FAILURES falhas seguidas o circuito abre: o cache é pulado
+    sem tocar no Redis e uma thread em segundo plano faz ping a cada REDIS_PROBE_INTERVAL
+    segundos, fechando o circuito assim que o Redis volta.
+    """
 
+    def __init__(self, url: str = None, cliente=None):
+        self.url = url or Config.REDIS_URL
+        self._cliente = cliente
+        self._lock = threading.Lock()
+        self._falhas = 0
+        self._aberto = False
+        self._sonda = None
 
+    @property
+    def nome(self) -> str:
+        """host:porta/db, sem a senha da URL (para logs, métricas, o health check e o anel)"""
+        partes = urlsplit(self.url)
+        return f"{partes.hostname or 'localhost'}:{partes.port or 6379}/{partes.path.strip('/') or 0}"
 
+    @property
+    def disponivel(self) -> bool:
+        return not self._aberto
 
-def cache(prefix: str, timeout: int = None):
-    """Decorator para cache de funções"""
+    @property
+    def estado(self) -> str:
+        return 'aberto' if self._aberto else 'fechado'
+
+    def cliente(self) -> Optional[redis.Redis]:
+        """Cliente para usar agora, ou None enquanto o circuito estiver aberto"""
+        if self._aberto:
+            return None
+        if self._cliente is None:
+            with self._lock:
+                if self._cliente is None:
+                    self._cliente = self._criar_cliente()
+        return self._cliente
+
+    def _criar_cliente(self) -> redis.Redis:
+        return redis.from_url(
+            self.url,
+            decode_responses=True,
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT
+        )
+
+    def registrar_sucesso(self):
+        self._falhas = 0
+
+    def registrar_falha(self, erro: Exception):
+        with self._lock:
+            self._falhas += 1
+            if self._aberto or self._falhas < Config.REDIS_CIRCUIT_FAILURES:
+                return
+            self._aberto = True
+            self._sonda = threading.Thread(target=self._sondar, name='redis-sonda', daemon=True)
+            self._sonda.start()
+        TRANSICOES_CIRCUITO_REDIS.inc(estado='aberto', no=self.nome)
+        print(f"Redis {self.nome} indisponível ({erro}) - chaves desse nó vão direto à origem até a reconexão")
+
+    def _sondar(self):
+        while True:
+            time.sleep(Config.REDIS_PROBE_INTERVAL)
+            try:
+                cliente = self._cliente or self._criar_cliente()
+                cliente.ping()
+            except redis.RedisError:
+                continue
+
+            with self._lock:
+                self._cliente = cliente
+                self._falhas = 0
+                self._aberto = False
+                self._sonda = None
+            TRANSICOES_CIRCUITO_REDIS.inc(estado='fechado', no=self.nome)
+            print(f"Redis {self.nome} disponível novamente - cache reabilitado")
+            return
+
+    def reiniciar(self):
+        """Descarta conexões e estado herdados do processo pai (a thread da sonda não sobrevive ao fork)"""
+        with self._lock:
+            if self._cliente is not None:
+                self._cliente.connection_pool.reset()
+            self._falhas = 0
+            self._aberto = False
+            self._sonda = None
+
+
+
+
+class AnelRedis:
+    """Distribui as chaves do cache entre vários nós Redis por hash consistente
+
+    Cada nó ocupa REDIS_VIRTUAL_NODES pontos do anel (md5 de "host:porta/db#i"; a senha e
+    a forma de escrever a URL não mudam o lugar das chaves), e a chave fica no
+    primeiro ponto depois do hash dela. Incluir ou tirar um nó só move as chaves dos
+    arcos dele (~1/n do total). Cada nó tem sua ConexaoRedis com circuit breaker próprio:
+    um shard fora do ar só manda as chaves dele direto para a origem.
+    """
+
+    def __init__(self, urls: List[str] = None, conexoes: List[ConexaoRedis] = None, virtuais: int = None):
+        if conexoes is None:
+            conexoes = [ConexaoRedis(url) for url in (urls or Config.REDIS_NODES or [Config.REDIS_URL])]
+        self.conexoes = conexoes
+        virtuais = virtuais or Config.REDIS_VIRTUAL_NODES
+
+        pontos = sorted(
+            (_hash_anel(f"{conexao.nome}#{indice}"), posicao)
+            for posicao, conexao in enumerate(conexoes)
+            for indice in range(virtuais)
+        )
+        self._pontos = [ponto for ponto, _ in pontos]
+        self._donos = [conexoes[posicao] for _, posicao in pontos]
+
+    def no(self, chave: str) -> ConexaoRedis:
+        """Conexão do nó responsável pela chave"""
+        if len(self.conexoes) == 1:
+            return self.conexoes[0]
+        indice = bisect.bisect(self._pontos, _hash_anel(chave))
+        return self._donos[indice % len(self._donos)]
+
+    def agrupar(self, chaves: List[str]) -> Dict[ConexaoRedis, List[int]]:
+        """Posições das chaves agrupadas pelo nó responsável (uma ida ao Redis por nó)"""
+        grupos = {}
+        for posicao, chave in enumerate(chaves):
+            grupos.setdefault(self.no(chave), []).append(posicao)
+        return grupos
+
+    def reiniciar(self):
+        for conexao in self.conexoes:
+            conexao.reiniciar()
+
+
+def _hash_anel(texto: str) -> int:
+    return int.from_bytes(hashlib.md5(texto.encode()).digest()[:8], 'big')
+
+
+anel_redis = AnelRedis()
+
+
+
+
+class PoliticaCache:
+    """Quanto tempo guardar cada tipo de resultado de um prefixo
+
+    - resultado normal: `timeout` (ou CACHE_TIMEOUT)
+    - None (não encontrado): `timeout_negativo`; sem ele o None não é guardado
+    - degradado (houve falha de API externa durante a chamada, ou `degradado(resultado)`
+      é verdadeiro): `timeout_degradado`; 0 não guarda
+
+    Todos os TTLs recebem ±CACHE_TTL_JITTER de variação aleatória, para entradas criadas
+    juntas não expirarem juntas. Entradas degradadas são gravadas marcadas (ver _serializar)
+    e contam como 'stale' quando servidas.
+    """
+
+    def __init__(self, timeout: int = None, timeout_negativo: int = None,
+                 degradado: Callable[[Any], bool] = None, timeout_degradado: int = 0):
+        self.timeout = timeout
+        self.timeout_negativo = timeout_negativo
+        self.degradado = degradado
+        self.timeout_degradado = timeout_degradado
+
+    def eh_degradado(self, resultado: Any, falhas_upstream: int) -> bool:
+        return bool(falhas_upstream or (resultado is not None and self.degradado and self.degradado(resultado)))
+
+    def ttl(self, resultado: Any, falhas_upstream: int) -> Optional[int]:
+        """TTL para gravar o resultado, ou None para não gravar"""
+        if self.eh_degradado(resultado, falhas_upstream):
+            ttl = self.timeout_degradado
+        elif resultado is None:
+            ttl = self.timeout_negativo
+        else:
+            ttl = self.timeout or Config.CACHE_TIMEOUT
+        if not ttl:
+            return None
+        variacao = ttl * Config.CACHE_TTL_JITTER
+        return max(int(round(ttl + random.uniform(-variacao, variacao))), 1)
+
+
+# envelope das entradas degradadas: o valor servido é o mesmo, só a contagem muda
+MARCA_DEGRADADO = '__stale__'
+
+
+def _serializar(resultado: Any, degradado: bool) -> str:
+    return json.dumps({MARCA_DEGRADADO: resultado} if degradado else resultado, default=str)
+
+
+def _ler_valor(prefix: str, valor: str) -> Any:
+    """Decodifica um valor do cache ('null' é um resultado negativo guardado)"""
+    resultado = json.loads(valor)
+    if isinstance(resultado, dict) and len(resultado) == 1 and MARCA_DEGRADADO in resultado:
+        CONSULTAS_CACHE.inc(prefixo=prefix, resultado='stale')
+        return resultado[MARCA_DEGRADADO]
+    CONSULTAS_CACHE.inc(prefixo=prefix, resultado='hit' if resultado is not None else 'hit_negativo')
+    return resultado
+
+
+
+
+def cache(prefix: str, timeout: int = None, versao: int = None, timeout_negativo: int = None,
+          degradado: Callable[[Any], bool] = None, timeout_degradado: int = 0,
+          variante: Callable[..., Optional[str]] = None):
+    """Decorator para cache de funções
+
+    `versao` entra na chave: mudar o formato do resultado e subir a versão descarta as
+    entradas antigas sem precisar limpar o Redis. `variante(*args, **kwargs)`, se dada,
+    também entra (quando não for None), para a chave mudar junto com dados locais que o
+    resultado usa. Os demais parâmetros formam a PoliticaCache do prefixo.
+    """
+    politica = PoliticaCache(timeout, timeout_negativo, degradado, timeout_degradado)
 
 
     def decorator(func):
+        # em métodos o self fica fora da chave: o repr dele muda a cada processo
+        pular = 1 if list(inspect.signature(func).parameters)[:1] == ['self'] else 0
+
+        prefixo_chave = f"{prefix}:v{versao}" if versao is not None else prefix
+
+        def chave_cache(args: tuple, kwargs: dict) -> str:
+            sufixo = variante(*args, **kwargs) if variante is not None else None
+            prefixo = f"{prefixo_chave}:{sufixo}" if sufixo is not None else prefixo_chave
+            return _gerar_chave_cache(prefixo, args[pular:], kwargs)
+
         @wraps(func)
 
 
         def wrapper(*args, **kwargs):
-            if not REDIS_DISPONIVEL:
+            cache_key = chave_cache(args, kwargs)
+            conexao = anel_redis.no(cache_key)
+            cliente = conexao.cliente()
+            if cliente is None:
+                CONSULTAS_CACHE.inc(prefixo=prefix, resultado='desabilitado')
                 return func(*args, **kwargs)
-            
-            cache_key = _gerar_chave_cache(prefix, args, kwargs)
-            
+
             try:
 
                 #tenta buscar no cache
-                cache_resultado = redis_client.get(cache_key)
+                cache_resultado = cliente.get(cache_key)
+                conexao.registrar_sucesso()
                 if cache_resultado:
-                    return json.loads(cache_resultado)
-                
+                    return _ler_valor(prefix, cache_resultado)
+                CONSULTAS_CACHE.inc(prefixo=prefix, resultado='miss')
+            except (redis.RedisError, ValueError) as e:
+                CONSULTAS_CACHE.inc(prefixo=prefix, resultado='erro')
+                print(f"Erro no cache: {e}")
+                if isinstance(e, redis.RedisError):
+                    conexao.registrar_falha(e)
+
+            with observar_falhas_upstream() as falhas:
                 resultado = func(*args, **kwargs)
-                if resultado is not None:
-                    cache_timeout = timeout or Config.CACHE_TIMEOUT
-                    redis_client.setex(
-                        cache_key, 
-                        cache_timeout, 
-                        json.dumps(resultado, default=str)
+            cache_timeout = politica.ttl(resultado, falhas[0])
+            if cache_timeout is not None:
+                try:
+                    cliente.setex(
+                        cache_key,
+                        cache_timeout,
+                        _serializar(resultado, politica.eh_degradado(resultado, falhas[0]))
                     )
-                
+                except redis.RedisError as e:
+                    print(f"Erro no cache: {e}")
+                    conexao.registrar_falha(e)
 
 
-                return resultado
-            
 
-                
-            except Exception as e:
-                print(f"Erro no cache: {e}")
-                return func(*args, **kwargs)
-        
+            return resultado
+
+        wrapper.prefixo = prefix
+        wrapper.politica = politica
+        wrapper.versao = versao
+        wrapper.chave_cache = chave_cache
         return wrapper
-    
+
 
     return decorator
 
@@ -72,4 +300,110 @@ def cache(prefix: str, timeout: int = None):
 def _gerar_chave_cache(prefix: str, args: tuple, kwargs: dict) -> str:
     """Gera chave unica para o cache"""
     key_data = f"{prefix}:{args}:{sorted(kwargs.items())}"
-    return hashlib.md5(key_data.encode()).hexdigest()
\ No newline at end of file
+    return hashlib.md5(key_data.encode()).hexdigest()
+
+
+class LoteCache:
+    """Leituras e gravações de várias funções @cache em poucas idas ao Redis
+
+        lote = LoteCache(antes_de_calcular=exigir_admissao)
+        lote.adicionar('ibge', ibge_service.obter_info_municipio, cidade, estado)
+        lote.adicionar('seguranca', security_service.analisar_segurança, cidade, estado, bairro)
+        lote.buscar()                      # um MGET por nó Redis para tudo que foi adicionado
+        dados = lote.resultado('ibge')     # hit devolve o valor; miss chama antes_de_calcular e a função
+        lote.gravar()                      # um pipeline por nó com todos os SETEX pendentes
+    """
+
+    def __init__(self, antes_de_calcular: Callable[[], None] = None):
+        # chamado antes de cada cálculo (miss); pode levantar exceção para recusar o trabalho
+        self.antes_de_calcular = antes_de_calcular
+        self._entradas = {}
+        self._em_cache = {}
+        self._buscados = set()
+        self._gravacoes = []
+        self.origens = {}
+
+    def adicionar(self, nome: str, funcao: Callable, *args, **kwargs):
+        """Registra a chamada de uma função decorada com @cache (pode ser método ligado)"""
+        alvo = getattr(funcao, '__self__', None)
+        original = getattr(funcao, '__func__', funcao)
+        argumentos = ((alvo,) if alvo is not None else ()) + args
+        self._entradas[nome] = (original, argumentos, kwargs, original.chave_cache(argumentos, kwargs))
+
+    def buscar(self):
+        """Busca as chaves adicionadas desde a última busca, num MGET por nó
+
+        Um nó fora do ar só transforma as chaves dele em miss.
+        """
+        nomes = [nome for nome in self._entradas if nome not in self._buscados]
+        self._buscados.update(nomes)
+        chaves = [self._entradas[nome][3] for nome in nomes]
+
+        for conexao, posicoes in anel_redis.agrupar(chaves).items():
+            cliente = conexao.cliente()
+            if cliente is None:
+                continue
+            try:
+                valores = cliente.mget([chaves[posicao] for posicao in posicoes])
+                conexao.registrar_sucesso()
+            except redis.RedisError as e:
+                print(f"Erro no cache: {e}")
+                conexao.registrar_falha(e)
+                continue
+
+            for posicao, valor in zip(posicoes, valores):
+                if valor:
+                    self._em_cache[nomes[posicao]] = valor
+
+    def resultado(self, nome: str) -> Any:
+        """Valor em cache ou, se não houver, o resultado da função (gravado depois em gravar())"""
+        funcao, argumentos, kwargs, chave = self._entradas[nome]
+        if nome not in self._buscados:
+            self.buscar()
+
+        valor = self._em_cache.pop(nome, None)
+        if valor is not None:
+            try:
+                resultado = _ler_valor(funcao.prefixo, valor)
+                self.origens[nome] = 'cache'
+                return resultado
+            except ValueError as e:
+                CONSULTAS_CACHE.inc(prefixo=funcao.prefixo, resultado='erro')
+                print(f"Erro no cache: {e}")
+        else:
+            disponivel = anel_redis.no(chave).disponivel
+            CONSULTAS_CACHE.inc(prefixo=funcao.prefixo, resultado='miss' if disponivel else 'desabilitado')
+
+        if self.antes_de_calcular is not None:
+            self.antes_de_calcular()
+        with observar_falhas_upstream() as falhas:
+            resultado = funcao.__wrapped__(*argumentos, **kwargs)
+        self.origens[nome] = 'calculado'
+        ttl = funcao.politica.ttl(resultado, falhas[0])
+        if ttl is not None:
+            degradado = funcao.politica.eh_degradado(resultado, falhas[0])
+            self._gravacoes.append((chave, ttl, _serializar(resultado, degradado)))
+        return resultado
+
+    def gravar(self):
+        """Grava os resultados calculados por resultado(), num pipeline por nó"""
+        gravacoes, self._gravacoes = self._gravacoes, []
+
+        for conexao, posicoes in anel_redis.agrupar([chave for chave, _, _ in gravacoes]).items():
+            cliente = conexao.cliente()
+            if cliente is None:
+                continue
+            try:
+                pipeline = cliente.pipeline(transaction=False)
+                for posicao in posicoes:
+                    pipeline.setex(*gravacoes[posicao])
+                pipeline.execute()
+                conexao.registrar_sucesso()
+            except redis.RedisError as e:
+                print(f"Erro no cache: {e}")
+                conexao.registrar_falha(e)
+
+
+def reiniciar_conexoes():
+    """Descarta as conexões herdadas do processo pai (chamado em cada worker após o fork)"""
+    anel_redis.reiniciar()
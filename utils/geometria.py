@@ -0,0 +1,26 @@
+from typing import Dict, Any, List
+import numpy as np
+
+
+
+
+# metros em um grau de latitude (e de longitude no equador)
+METROS_POR_GRAU = 111320.0
+
+
+
+
+def aneis_do_poligono(geometria: Dict[str, Any]) -> List[List[np.ndarray]]:
+    """Retorna a lista de poligonos de uma geometria GeoJSON, cada um como lista de aneis (lon, lat)
+
+    Polygon vira um poligono, MultiPolygon vira vários; outros tipos e aneis com menos de
+    três pontos são ignorados.
+    """
+    if geometria['type'] == 'Polygon':
+        poligonos = [geometria['coordinates']]
+    elif geometria['type'] == 'MultiPolygon':
+        poligonos = geometria['coordinates']
+    else:
+        return []
+    return [[np.asarray(anel, dtype=np.float64)[:, :2] for anel in poligono if len(anel) >= 3]
+            for poligono in poligonos]
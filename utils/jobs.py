@@ -0,0 +1,298 @@
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Any, Optional, Callable
+import redis
+from config import Config
+
+
+
+
+PREFIXO = 'dossie:jobs'
+
+# status possíveis de um job
+NA_FILA = 'na_fila'
+EXECUTANDO = 'executando'
+CONCLUIDO = 'concluido'
+ERRO = 'erro'
+
+
+
+
+def novo_job(endereco: str) -> Dict[str, Any]:
+    return {
+        'id': uuid.uuid4().hex,
+        'status': NA_FILA,
+        'endereco': endereco,
+        'criado_em': time.time(),
+        'iniciado_em': None,
+        'concluido_em': None,
+        'resultado': None
+    }
+
+
+def executar_job(job: Dict[str, Any], analisar: Callable[[str], Dict[str, Any]]) -> Dict[str, Any]:
+    """Roda a análise do job e devolve o job com o resultado (nunca levanta exceção)"""
+    inicio = time.time()
+    try:
+        resultado = analisar(job['endereco'])
+        if 'error' not in resultado:
+            resultado['metadata'] = {
+                'analysis_time_seconds': round(time.time() - inicio, 2),
+                'api_version': '1.0.0',
+                'request_id': job['id']
+            }
+        status = ERRO if 'error' in resultado else CONCLUIDO
+    except Exception as e:
+        resultado = {'error': 'Erro na análise', 'message': str(e)}
+        status = ERRO
+    return {**job, 'status': status, 'resultado': resultado, 'concluido_em': time.time()}
+
+
+
+
+class FilaRedis:
+    """Fila de jobs no Redis, consumida pelos processos do worker.py
+
+    Os ids esperam numa lista e cada job fica numa chave própria com TTL. O consumidor
+    move o id com BRPOPLPUSH para a sua lista de processamento e só o remove dela depois
+    de gravar o resultado; enquanto roda, renova uma chave de batimento. Se o processo
+    morrer no meio (OOM, SIGKILL, deploy), o batimento expira e qualquer outro consumidor
+    devolve os ids da lista dele à fila (recuperar_orfaos).
+
+    Ao terminar, o worker coloca um marcador numa lista do job. Quem faz long-poll espera
+    nela com BRPOPLPUSH da lista para ela mesma, que devolve o marcador e o deixa lá para
+    os próximos.
+    """
+
+    backend = 'redis'
+
+    def __init__(self, url: str = None):
+        # cliente próprio sem socket_timeout: os comandos bloqueantes passam o timeout deles
+        self.redis = redis.from_url(
+            url or Config.REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT
+        )
+        self.fila = f"{PREFIXO}:fila"
+        self.consumidores = f"{PREFIXO}:consumidores"
+
+    def _processando(self, consumidor: str) -> str:
+        return f"{PREFIXO}:processando:{consumidor}"
+
+    def _batimento(self, consumidor: str) -> str:
+        return f"{PREFIXO}:batimento:{consumidor}"
+
+    def _chave(self, job_id: str) -> str:
+        return f"{PREFIXO}:{job_id}"
+
+    def _gravar(self, job: Dict[str, Any], pipeline=None):
+        (pipeline or self.redis).setex(self._chave(job['id']), Config.JOB_RESULT_TTL, json.dumps(job, default=str))
+
+    def enfileirar(self, endereco: str) -> Dict[str, Any]:
+        job = novo_job(endereco)
+        pipeline = self.redis.pipeline()
+        self._gravar(job, pipeline)
+        pipeline.lpush(self.fila, job['id'])
+        pipeline.execute()
+        return job
+
+    def obter(self, job_id: str, espera: float = 0) -> Optional[Dict[str, Any]]:
+        """Estado do job; com espera > 0 bloqueia até ele terminar ou o tempo acabar"""
+        job = self._ler(job_id)
+        if job is None or espera <= 0 or job['status'] in (CONCLUIDO, ERRO):
+            return job
+        pronto = f"{self._chave(job_id)}:pronto"
+        self.redis.brpoplpush(pronto, pronto, timeout=max(1, int(espera)))
+        return self._ler(job_id)
+
+    def _ler(self, job_id: str) -> Optional[Dict[str, Any]]:
+        valor = self.redis.get(self._chave(job_id))
+        return json.loads(valor) if valor else None
+
+    def _bater(self, consumidor: str):
+        self.redis.setex(self._batimento(consumidor), Config.JOB_HEARTBEAT_TTL, 1)
+
+    def _manter_batimento(self, consumidor: str, parar: threading.Event):
+        while not parar.wait(Config.JOB_HEARTBEAT_TTL / 3):
+            try:
+                self._bater(consumidor)
+            except redis.RedisError as e:
+                print(f"Erro no batimento da fila de jobs: {e}")
+
+    def recuperar_orfaos(self) -> int:
+        """Devolve à fila os jobs de consumidores sem batimento e retorna quantos voltaram"""
+        devolvidos = 0
+        for consumidor in self.redis.smembers(self.consumidores):
+            if self.redis.exists(self._batimento(consumidor)):
+                continue
+            processando = self._processando(consumidor)
+            # RPOPLPUSH é atômico: dois consumidores recuperando juntos nunca duplicam um id
+            while True:
+                job_id = self.redis.rpoplpush(processando, self.fila)
+                if job_id is None:
+                    break
+                devolvidos += 1
+                print(f"Job {job_id} devolvido à fila (consumidor {consumidor} sem batimento)")
+            self.redis.srem(self.consumidores, consumidor)
+        return devolvidos
+
+    def consumir(self, analisar: Callable[[str], Dict[str, Any]], parar: threading.Event = None):
+        """Laço do worker: pega um job por vez e grava o resultado"""
+        parar = parar or threading.Event()
+        consumidor = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        processando = self._processando(consumidor)
+        self._bater(consumidor)
+        self.redis.sadd(self.consumidores, consumidor)
+        threading.Thread(target=self._manter_batimento, args=(consumidor, parar),
+                         name='jobs-batimento', daemon=True).start()
+
+        proxima_recuperacao = 0
+        while not parar.is_set():
+            try:
+                if time.monotonic() >= proxima_recuperacao:
+                    self.recuperar_orfaos()
+                    proxima_recuperacao = time.monotonic() + Config.JOB_REAPER_INTERVAL
+                job_id = self.redis.brpoplpush(self.fila, processando, timeout=5)
+            except redis.RedisError as e:
+                print(f"Erro na fila de jobs: {e}")
+                time.sleep(1)
+                continue
+            if job_id is None:
+                continue
+
+            job = self._ler(job_id)
+            if job is None:
+                self.redis.lrem(processando, 1, job_id)
+                continue  # expirou antes de ser processado
+            job = {**job, 'status': EXECUTANDO, 'iniciado_em': time.time()}
+            self._gravar(job)
+
+            job = executar_job(job, analisar)
+            pronto = f"{self._chave(job['id'])}:pronto"
+            pipeline = self.redis.pipeline()
+            self._gravar(job, pipeline)
+            pipeline.rpush(pronto, 1)
+            pipeline.expire(pronto, Config.JOB_RESULT_TTL)
+            pipeline.lrem(processando, 1, job_id)
+            pipeline.execute()
+
+        # saída limpa: nada em processamento, o registro do consumidor pode sair
+        pipeline = self.redis.pipeline()
+        pipeline.srem(self.consumidores, consumidor)
+        pipeline.delete(self._batimento(consumidor))
+        pipeline.execute()
+
+
+class FilaLocal:
+    """Fila de jobs em memória com threads do próprio processo (desenvolvimento/sem Redis)
+
+    Os jobs só existem no processo que os criou, então com vários workers web o
+    GET pode cair num processo que não conhece o job.
+    """
+
+    backend = 'local'
+
+    def __init__(self, analisar: Callable[[str], Dict[str, Any]], trabalhadores: int = None):
+        self.analisar = analisar
+        self.fila = queue.Queue()
+        self.jobs = {}
+        self._condicao = threading.Condition()
+        for indice in range(trabalhadores or Config.JOB_LOCAL_WORKERS):
+            threading.Thread(target=self._consumir, name=f"job-local-{indice}", daemon=True).start()
+
+    def enfileirar(self, endereco: str) -> Dict[str, Any]:
+        job = novo_job(endereco)
+        with self._condicao:
+            self._remover_expirados()
+            self.jobs[job['id']] = job
+        self.fila.put(job['id'])
+        return job
+
+    def obter(self, job_id: str, espera: float = 0) -> Optional[Dict[str, Any]]:
+        limite = time.monotonic() + espera
+        with self._condicao:
+            while True:
+                job = self.jobs.get(job_id)
+                restante = limite - time.monotonic()
+                if job is None or job['status'] in (CONCLUIDO, ERRO) or restante <= 0:
+                    return job
+                self._condicao.wait(restante)
+
+    def _remover_expirados(self):
+        limite = time.time() - Config.JOB_RESULT_TTL
+        for job_id in [job_id for job_id, job in self.jobs.items() if job['criado_em'] < limite]:
+            del self.jobs[job_id]
+
+    def _consumir(self):
+        while True:
+            job_id = self.fila.get()
+            with self._condicao:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    continue
+                job = self.jobs[job_id] = {**job, 'status': EXECUTANDO, 'iniciado_em': time.time()}
+
+            job = executar_job(job, self.analisar)
+            with self._condicao:
+                self.jobs[job_id] = job
+                self._condicao.notify_all()
+
+
+
+
+class FilaAutomatica:
+    """JOB_BACKEND=auto: enfileira no Redis e, só enquanto ele estiver fora, em threads locais
+
+    A escolha é refeita a cada job: depois de uma falha o Redis é pulado por
+    REDIS_PROBE_INTERVAL segundos e então tentado de novo. Jobs locais continuam
+    consultáveis no processo que os criou.
+    """
+
+    def __init__(self, analisar: Callable[[str], Dict[str, Any]]):
+        self.analisar = analisar
+        self.redis = FilaRedis()
+        self._local = None
+        self._lock = threading.Lock()
+        self._local_ate = 0
+        self.backend = 'redis'
+
+    def local(self) -> FilaLocal:
+        # as threads locais só nascem na primeira vez que o Redis falha
+        if self._local is None:
+            with self._lock:
+                if self._local is None:
+                    self._local = FilaLocal(self.analisar)
+        return self._local
+
+    def enfileirar(self, endereco: str) -> Dict[str, Any]:
+        if time.monotonic() >= self._local_ate:
+            try:
+                job = self.redis.enfileirar(endereco)
+                self.backend = 'redis'
+                return job
+            except redis.RedisError as e:
+                print(f"Redis não disponível ({e}) - jobs rodando em threads locais por {Config.REDIS_PROBE_INTERVAL}s")
+                self._local_ate = time.monotonic() + Config.REDIS_PROBE_INTERVAL
+        self.backend = 'local'
+        return self.local().enfileirar(endereco)
+
+    def obter(self, job_id: str, espera: float = 0) -> Optional[Dict[str, Any]]:
+        if self._local is not None and job_id in self._local.jobs:
+            return self._local.obter(job_id, espera)
+        return self.redis.obter(job_id, espera)
+
+
+
+
+def criar_fila(analisar: Callable[[str], Dict[str, Any]]):
+    """Fila conforme JOB_BACKEND: 'redis', 'local' ou 'auto' (Redis enquanto responder)"""
+    if Config.JOB_BACKEND == 'redis':
+        return FilaRedis()
+    if Config.JOB_BACKEND == 'auto':
+        return FilaAutomatica(analisar)
+    return FilaLocal(analisar)
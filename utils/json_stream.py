@@ -0,0 +1,207 @@
+import codecs
+import json
+import re
+from typing import Iterable, Iterator, Any, Optional
+
+
+
+
+_DECODER = json.JSONDecoder()
+_SEPARADORES = re.compile(r'[\s,]*')
+_ESPACOS = re.compile(r'\s*')
+# "chave": do objeto de cima (o conteúdo da string sem as aspas fica no grupo 1)
+_CHAVE = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"\s*:\s*')
+# pula tudo até o próximo colchete/chave fora de string, ou até uma string sem fim no buffer
+_ATE_ESTRUTURA = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*')
+
+# valor simples que pode ter sido cortado no fim do buffer
+_INCOMPLETO = object()
+
+# bytes juntados, no mínimo, a cada leitura dos pedaços
+LEITURA_MINIMA = 16 * 1024
+
+
+
+
+class _Leitor:
+    """Texto decodificado dos pedaços, com uma varredura de {}/[] que continua entre leituras
+
+    `posicao` é o início do que ainda não foi consumido; o que vem antes é descartado a
+    cada leitura. A varredura guarda onde parou e a profundidade, então um item que
+    chega em muitos pedaços é percorrido uma vez só.
+    """
+
+    def __init__(self, partes: Iterable[bytes]):
+        self.partes = iter(partes)
+        self.decodificador = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.posicao = 0
+        self.fim_dos_dados = False
+        self._varredura = None
+        self._profundidade = 0
+
+    def ler(self) -> bool:
+        """Acrescenta ao buffer pelo menos LEITURA_MINIMA bytes; False quando os dados acabaram
+
+        Pedaços pequenos são juntados antes de decodificar, para o custo por leitura
+        (cópia do buffer, varredura) não se repetir a cada poucos bytes.
+        """
+        if self.fim_dos_dados:
+            return False
+        lidos, tamanho = [], 0
+        for parte in self.partes:
+            lidos.append(parte)
+            tamanho += len(parte)
+            if tamanho >= LEITURA_MINIMA:
+                break
+        else:
+            self.fim_dos_dados = True
+        texto = self.decodificador.decode(b''.join(lidos), final=self.fim_dos_dados)
+        self._acrescentar(texto)
+        return not self.fim_dos_dados or bool(texto)
+
+    def _acrescentar(self, texto: str):
+        descartado = self.posicao
+        self.buffer = self.buffer[descartado:] + texto
+        self.posicao = 0
+        if self._varredura is not None:
+            self._varredura -= descartado
+
+    def fim_do_composto(self) -> Optional[int]:
+        """Fim do objeto/array que começa em `posicao`, ou None se ainda não chegou inteiro"""
+        buffer = self.buffer
+        if self._varredura is None:
+            self._varredura, self._profundidade = self.posicao, 0
+        while True:
+            indice = _ATE_ESTRUTURA.match(buffer, self._varredura).end()
+            if indice >= len(buffer) or buffer[indice] == '"':
+                # string cortada no fim do buffer: volta a ela na próxima leitura
+                self._varredura = indice
+                return None
+            self._varredura = indice + 1
+            if buffer[indice] in '{[':
+                self._profundidade += 1
+            else:
+                self._profundidade -= 1
+                if self._profundidade == 0:
+                    self._varredura = None
+                    return indice + 1
+
+    def simples(self):
+        """(valor, fim) do número/string/literal em `posicao`, ou _INCOMPLETO"""
+        try:
+            valor, fim = _DECODER.raw_decode(self.buffer, self.posicao)
+        except json.JSONDecodeError:
+            if self.fim_dos_dados:
+                raise
+            return _INCOMPLETO
+        # um número no fim do buffer pode continuar no próximo pedaço
+        if fim >= len(self.buffer) and not self.fim_dos_dados:
+            return _INCOMPLETO
+        return valor, fim
+
+    def fim_do_valor(self) -> Optional[int]:
+        if self.buffer[self.posicao] in '{[':
+            return self.fim_do_composto()
+        resultado = self.simples()
+        return None if resultado is _INCOMPLETO else resultado[1]
+
+
+
+
+def _abrir_array(leitor: _Leitor, chave: str) -> bool:
+    """Avança o leitor até logo depois do '[' de `chave` no objeto de cima (False se não houver)"""
+    dentro_do_objeto = False
+    no_valor = False
+    while True:
+        buffer = leitor.buffer
+        posicao = _ESPACOS.match(buffer, leitor.posicao).end()
+        leitor.posicao = posicao
+        if posicao >= len(buffer):
+            if not leitor.ler():
+                return False
+            continue
+
+        caractere = buffer[posicao]
+        if not dentro_do_objeto:
+            if caractere != '{':
+                return False
+            leitor.posicao = posicao + 1
+            dentro_do_objeto = True
+        elif no_valor:
+            # valor de outra chave: pulado inteiro, sem olhar o que há dentro
+            fim = leitor.fim_do_valor()
+            if fim is None:
+                if not leitor.ler():
+                    return False
+                continue
+            leitor.posicao = fim
+            no_valor = False
+        elif caractere == ',':
+            leitor.posicao = posicao + 1
+        elif caractere == '}':
+            return False
+        else:
+            encontrado = _CHAVE.match(buffer, posicao)
+            if encontrado is None or encontrado.end() >= len(buffer):
+                if not leitor.ler():
+                    return False
+                continue
+            leitor.posicao = encontrado.end()
+            if json.loads(f'"{encontrado.group(1)}"') == chave and buffer[encontrado.end()] == '[':
+                leitor.posicao += 1
+                return True
+            no_valor = True
+
+
+def iterar_array_json(partes: Iterable[bytes], chave: str) -> Iterator[Any]:
+    """Itera os itens do array `chave` de um objeto JSON lido em pedaços
+
+    Os itens inteiros no buffer são decodificados direto; o que ficou cortado no fim do
+    pedaço tem o fim procurado pela varredura de {}/[] (que continua de onde parou a cada
+    pedaço novo) e só então é decodificado, uma vez. A memória fica limitada ao item atual
+    mais um pedaço, em vez da resposta inteira. Feito para as respostas do Overpass
+    ({"version": ..., "elements": [...]}): só vale a chave do objeto de cima (uma chave
+    de mesmo nome dentro de outro valor é ignorada), e o que vier depois do array não é lido.
+    """
+    leitor = _Leitor(partes)
+    if not _abrir_array(leitor, chave):
+        return
+
+    cortado = False  # o item em `posicao` já falhou uma vez: espera a varredura achar o fim
+    while True:
+        buffer = leitor.buffer
+        posicao = _SEPARADORES.match(buffer, leitor.posicao).end()
+        leitor.posicao = posicao
+        if posicao >= len(buffer):
+            if not leitor.ler():
+                raise ValueError(f"JSON terminou dentro do array '{chave}'")
+            continue
+        if buffer[posicao] == ']':
+            return
+
+        if cortado:
+            if leitor.fim_do_valor() is None:
+                if not leitor.ler():
+                    raise ValueError(f"JSON terminou dentro do array '{chave}'")
+                continue
+            cortado = False
+        elif buffer[posicao] not in '{[':
+            resultado = leitor.simples()
+            if resultado is _INCOMPLETO:
+                if not leitor.ler():
+                    raise ValueError(f"JSON terminou dentro do array '{chave}'")
+                continue
+            leitor.posicao = resultado[1]
+            yield resultado[0]
+            continue
+
+        try:
+            item, fim = _DECODER.raw_decode(buffer, posicao)
+        except json.JSONDecodeError:
+            if leitor.fim_dos_dados:
+                raise
+            cortado = True
+            continue
+        leitor.posicao = fim
+        yield item
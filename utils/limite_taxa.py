@@ -0,0 +1,69 @@
+import time
+import threading
+from typing import Dict, List
+import redis
+from utils import cache as cache_module
+
+
+
+
+PREFIXO = 'dossie:limite'
+
+
+
+
+class LimiteTaxa:
+    """Rate limit por cliente compartilhado entre workers, no Redis do cache
+
+    Janela deslizante aproximada: um contador por janela fixa (INCR + EXPIRE) e a
+    estimativa `anterior * fração restante da janela anterior + atual`, como se as
+    requisições da janela anterior estivessem espalhadas por igual. Custa dois comandos
+    num pipeline e uma chave pequena por cliente e janela.
+
+    Com o nó do Redis fora do ar (circuito aberto) cai para o histórico em memória do
+    processo, que vale por worker.
+    """
+
+    def __init__(self):
+        # cliente -> instantes das requisições aceitas, só usado sem Redis
+        self.local: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def permitir(self, cliente_id: str, maximo: int, janela: int = 60) -> bool:
+        """Conta a requisição do cliente e diz se ela cabe no limite"""
+        agora = time.time()
+        atual, decorrido = divmod(agora, janela)
+        chave_atual = f"{PREFIXO}:{cliente_id}:{int(atual)}"
+        chave_anterior = f"{PREFIXO}:{cliente_id}:{int(atual) - 1}"
+
+        conexao = cache_module.anel_redis.no(f"{PREFIXO}:{cliente_id}")
+        cliente = conexao.cliente()
+        if cliente is not None:
+            try:
+                pipeline = cliente.pipeline(transaction=False)
+                pipeline.incr(chave_atual)
+                pipeline.expire(chave_atual, janela * 2)
+                pipeline.get(chave_anterior)
+                contagem, _, anterior = pipeline.execute()
+                conexao.registrar_sucesso()
+
+                estimativa = int(anterior or 0) * (1 - decorrido / janela) + contagem
+                if estimativa <= maximo:
+                    return True
+                cliente.decr(chave_atual)  # a recusada não ocupa lugar na janela
+                return False
+            except redis.RedisError as e:
+                print(f"Erro no rate limit: {e}")
+                conexao.registrar_falha(e)
+
+        return self._permitir_local(cliente_id, maximo, janela, agora)
+
+    def _permitir_local(self, cliente_id: str, maximo: int, janela: int, agora: float) -> bool:
+        with self._lock:
+            recentes = [instante for instante in self.local.get(cliente_id, []) if agora - instante < janela]
+            if len(recentes) >= maximo:
+                self.local[cliente_id] = recentes
+                return False
+            recentes.append(agora)
+            self.local[cliente_id] = recentes
+            return True
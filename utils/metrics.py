@@ -0,0 +1,343 @@
+import contextvars
+import fcntl
+import glob
+import json
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Tuple, Iterable, List
+from config import Config
+
+
+
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+
+
+def _formatar_rotulos(nomes: Tuple[str, ...], valores: Tuple[str, ...], extra: str = '') -> str:
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatar_numero(valor: float) -> str:
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+
+
+class Contador:
+    """Contador monotônico com rótulos, no formato de texto do Prometheus"""
+
+    tipo = 'counter'
+
+    def __init__(self, nome: str, descricao: str, rotulos: Iterable[str] = ()):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor: float = 1, **rotulos):
+        chave = tuple(str(rotulos.get(nome, '')) for nome in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def valores(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._valores)
+
+    def estado(self) -> List[list]:
+        """Valores serializáveis em JSON (para somar com os dos outros processos)"""
+        return [[list(chave), valor] for chave, valor in self.valores().items()]
+
+    @staticmethod
+    def somar(total: Dict[tuple, Any], estado: List[list]):
+        for chave, valor in estado:
+            chave = tuple(chave)
+            total[chave] = total.get(chave, 0) + valor
+
+    def exportar(self, valores: Dict[tuple, Any] = None) -> Iterable[str]:
+        valores = self.valores() if valores is None else valores
+        for chave, valor in sorted(valores.items()):
+            yield f"{self.nome}{_formatar_rotulos(self.rotulos, chave)} {_formatar_numero(valor)}"
+
+
+class Histograma:
+    """Histograma cumulativo com rótulos, no formato de texto do Prometheus"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome: str, descricao: str, rotulos: Iterable[str] = (), buckets: Tuple[float, ...] = BUCKETS_PADRAO):
+        self.nome = nome
+        self.descricao = descricao
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, **rotulos):
+        chave = tuple(str(rotulos.get(nome, '')) for nome in self.rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = {'buckets': [0] * len(self.buckets), 'soma': 0.0, 'total': 0}
+            for indice, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie['buckets'][indice] += 1
+                    break
+            serie['soma'] += valor
+            serie['total'] += 1
+
+    def valores(self) -> Dict[Tuple[str, ...], Dict[str, Any]]:
+        with self._lock:
+            return {chave: {**serie, 'buckets': list(serie['buckets'])} for chave, serie in self._series.items()}
+
+    def estado(self) -> List[list]:
+        return [[list(chave), serie] for chave, serie in self.valores().items()]
+
+    @staticmethod
+    def somar(total: Dict[tuple, Any], estado: List[list]):
+        for chave, serie in estado:
+            chave = tuple(chave)
+            atual = total.get(chave)
+            if atual is None:
+                total[chave] = {**serie, 'buckets': list(serie['buckets'])}
+                continue
+            atual['buckets'] = [a + b for a, b in zip(atual['buckets'], serie['buckets'])]
+            atual['soma'] += serie['soma']
+            atual['total'] += serie['total']
+
+    def exportar(self, series: Dict[tuple, Any] = None) -> Iterable[str]:
+        series = self.valores() if series is None else series
+
+        for chave, serie in sorted(series.items()):
+            acumulado = 0
+            for limite, quantidade in zip(self.buckets, serie['buckets']):
+                acumulado += quantidade
+                rotulos = _formatar_rotulos(self.rotulos, chave, f'le="{_formatar_numero(limite)}"')
+                yield f"{self.nome}_bucket{rotulos} {acumulado}"
+            rotulos = _formatar_rotulos(self.rotulos, chave)
+            yield f"{self.nome}_sum{rotulos} {_formatar_numero(serie['soma'])}"
+            yield f"{self.nome}_count{rotulos} {serie['total']}"
+
+
+
+
+class Registro:
+    """Conjunto de métricas do processo
+
+    Com METRICS_DIR configurado (vários workers do gunicorn), cada processo grava o seu
+    estado em METRICS_DIR/<pid>.json a cada METRICS_FLUSH_INTERVAL segundos e exportar()
+    soma os arquivos de todos, então o /metrics dá o mesmo total em qualquer worker. O
+    mestre junta o arquivo de um worker encerrado em arquivados.json (arquivar_processo),
+    para os contadores não voltarem atrás quando o max_requests recicla workers.
+    """
+
+    def __init__(self):
+        self._metricas = []
+        self._gravacao = None
+
+    def contador(self, nome: str, descricao: str, rotulos: Iterable[str] = ()) -> Contador:
+        metrica = Contador(nome, descricao, rotulos)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nome: str, descricao: str, rotulos: Iterable[str] = (), **kwargs) -> Histograma:
+        metrica = Histograma(nome, descricao, rotulos, **kwargs)
+        self._metricas.append(metrica)
+        return metrica
+
+    def estado(self) -> Dict[str, List[list]]:
+        return {metrica.nome: metrica.estado() for metrica in self._metricas}
+
+    def gravar_estado(self, diretorio: str = None):
+        """Grava o estado deste processo em <diretorio>/<pid>.json (troca atômica do arquivo)"""
+        diretorio = diretorio or Config.METRICS_DIR
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = os.path.join(diretorio, f"{os.getpid()}.json")
+        temporario = os.path.join(diretorio, f".{os.getpid()}.json")
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(self.estado(), arquivo)
+        os.replace(temporario, caminho)
+
+    def iniciar_gravacao_periodica(self):
+        """Thread que grava o estado do processo a cada METRICS_FLUSH_INTERVAL (no worker, depois do fork)"""
+        if not Config.METRICS_DIR:
+            return
+
+        def gravar_periodicamente():
+            while True:
+                time.sleep(Config.METRICS_FLUSH_INTERVAL)
+                try:
+                    self.gravar_estado()
+                except OSError as e:
+                    print(f"Erro ao gravar métricas: {e}")
+
+        self._gravacao = threading.Thread(target=gravar_periodicamente, name='metricas', daemon=True)
+        self._gravacao.start()
+
+    def exportar(self) -> str:
+        """Todas as métricas no formato de exposição de texto do Prometheus"""
+        totais = self._somar_processos() if Config.METRICS_DIR else {}
+        linhas = []
+        for metrica in self._metricas:
+            linhas.append(f"# HELP {metrica.nome} {metrica.descricao}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas.extend(metrica.exportar(totais.get(metrica.nome)))
+        return '\n'.join(linhas) + '\n'
+
+    def _somar_processos(self) -> Dict[str, Dict[tuple, Any]]:
+        """Soma os arquivos dos outros processos com o estado ao vivo deste"""
+        estados = [self.estado()]
+        proprio = os.path.join(Config.METRICS_DIR, f"{os.getpid()}.json")
+        with _travar(Config.METRICS_DIR, fcntl.LOCK_SH):
+            for caminho in glob.glob(os.path.join(Config.METRICS_DIR, '*.json')):
+                if caminho != proprio:
+                    estados.append(_ler_estado(caminho))
+
+        totais = {metrica.nome: {} for metrica in self._metricas}
+        for estado in estados:
+            for metrica in self._metricas:
+                metrica.somar(totais[metrica.nome], estado.get(metrica.nome, []))
+        return totais
+
+    def arquivar_processo(self, pid: int, diretorio: str = None):
+        """Soma o arquivo de um processo encerrado ao arquivados.json (chamado no mestre)"""
+        diretorio = diretorio or Config.METRICS_DIR
+        caminho = os.path.join(diretorio, f"{pid}.json")
+        if not os.path.exists(caminho):
+            return
+        arquivados = os.path.join(diretorio, 'arquivados.json')
+
+        # travado: quem exporta nunca vê o processo nos dois arquivos, nem em nenhum
+        with _travar(diretorio, fcntl.LOCK_EX):
+            estados = [_ler_estado(caminho), _ler_estado(arquivados)]
+            somado = {}
+            for metrica in self._metricas:
+                total = {}
+                for estado in estados:
+                    metrica.somar(total, estado.get(metrica.nome, []))
+                somado[metrica.nome] = [[list(chave), valor] for chave, valor in total.items()]
+
+            temporario = os.path.join(diretorio, '.arquivados.json')
+            with open(temporario, 'w', encoding='utf-8') as arquivo:
+                json.dump(somado, arquivo)
+            os.replace(temporario, arquivados)
+            os.remove(caminho)
+
+    @staticmethod
+    def limpar(diretorio: str = None):
+        """Apaga os estados de uma execução anterior (no início do mestre)"""
+        diretorio = diretorio or Config.METRICS_DIR
+        for caminho in glob.glob(os.path.join(diretorio, '*.json')):
+            os.remove(caminho)
+
+
+@contextmanager
+def _travar(diretorio: str, modo: int):
+    os.makedirs(diretorio, exist_ok=True)
+    with open(os.path.join(diretorio, '.trava'), 'a') as trava:
+        fcntl.flock(trava, modo)
+        try:
+            yield
+        finally:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+
+
+def _ler_estado(caminho: str) -> Dict[str, List[list]]:
+    try:
+        with open(caminho, encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except (OSError, ValueError):
+        return {}
+
+
+
+
+REGISTRO = Registro()
+
+DURACAO_ETAPA = REGISTRO.histograma(
+    'dossie_etapa_duracao_segundos', 'Duração de cada etapa da análise', ['etapa']
+)
+DURACAO_REQUISICAO = REGISTRO.histograma(
+    'dossie_http_requisicao_duracao_segundos', 'Duração das requisições HTTP por endpoint', ['endpoint', 'status']
+)
+RESPOSTAS_UPSTREAM = REGISTRO.contador(
+    'dossie_upstream_respostas_total', 'Respostas das APIs externas por status (erro = sem resposta)', ['servico', 'status']
+)
+CONSULTAS_CACHE = REGISTRO.contador(
+    'dossie_cache_consultas_total', 'Consultas ao cache por prefixo e resultado (hit, hit_negativo, stale, miss, erro, desabilitado)', ['prefixo', 'resultado']
+)
+TRANSICOES_CIRCUITO_REDIS = REGISTRO.contador(
+    'dossie_redis_circuito_transicoes_total', 'Aberturas e fechamentos do circuit breaker de cada nó Redis', ['estado', 'no']
+)
+REJEICOES_RATE_LIMIT = REGISTRO.contador(
+    'dossie_rate_limit_rejeicoes_total', 'Requisições rejeitadas pelo rate limit', ['endpoint']
+)
+REJEICOES_ADMISSAO = REGISTRO.contador(
+    'dossie_admissao_rejeicoes_total', 'Análises rejeitadas com 503 pelo controle de admissão', ['motivo']
+)
+
+# ultimo status visto de cada API externa, para o health check
+ultimo_status_upstream = {}
+
+# falhas de API externa registradas no bloco de observar_falhas_upstream() atual
+_falhas_no_bloco = contextvars.ContextVar('falhas_upstream_no_bloco', default=None)
+
+
+
+
+@contextmanager
+def medir_etapa(etapa: str):
+    """Mede a duração de um bloco e registra no histograma de etapas"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        DURACAO_ETAPA.observar(time.perf_counter() - inicio, etapa=etapa)
+
+
+def hooks_upstream(servico: str) -> Dict[str, Any]:
+    """Hooks do requests que contam o status das respostas de um serviço externo"""
+    def registrar(resposta, *args, **kwargs):
+        RESPOSTAS_UPSTREAM.inc(servico=servico, status=resposta.status_code)
+        ultimo_status_upstream[servico] = {'status': resposta.status_code, 'timestamp': time.time()}
+    return {'response': registrar}
+
+
+@contextmanager
+def observar_falhas_upstream():
+    """Conta as falhas de API externa registradas dentro do bloco (inclusive em blocos aninhados)
+
+    O cache usa isso para não guardar como definitivo um resultado montado com fallback.
+    """
+    externo = _falhas_no_bloco.get()
+    falhas = [0]
+    token = _falhas_no_bloco.set(falhas)
+    try:
+        yield falhas
+    finally:
+        _falhas_no_bloco.reset(token)
+        if externo is not None:
+            externo[0] += falhas[0]
+
+
+def registrar_falha_upstream(servico: str, erro: Exception):
+    """Conta falhas sem resposta HTTP (timeout, conexão recusada) e marca o bloco observado"""
+    falhas = _falhas_no_bloco.get()
+    if falhas is not None:
+        falhas[0] += 1
+    if getattr(erro, 'response', None) is None and getattr(erro, 'request', None) is not None:
+        RESPOSTAS_UPSTREAM.inc(servico=servico, status='erro')
+        ultimo_status_upstream[servico] = {'status': 'erro', 'timestamp': time.time()}
@@ -173,7 +173,12 @@ class NarrativeGenerator:
             if 'security' in all_data:
                 scores.append(all_data['security'].get('safety_score', 5))
             if 'transport' in all_data:
-                scores.append(all_data['transport'].get('transport_score', 5))
+                scores.append(all_data['transport'].get('pontuaçao_transporte', 5))
+            if all_data.get('infrastructure'):
+                notas_infraestrutura = [
+                    categoria.get('pontuacao', 5) for categoria in all_data['infrastructure'].values()
+                ]
+                scores.append(sum(notas_infraestrutura) / len(notas_infraestrutura))
             if 'environmental' in all_data:
                 scores.append(all_data['environmental'].get('environmental_score', 5))
             
@@ -0,0 +1,36 @@
+import unicodedata
+from typing import Optional
+
+
+
+
+UF_POR_ESTADO = {
+    'acre': 'AC', 'alagoas': 'AL', 'amapa': 'AP', 'amazonas': 'AM',
+    'bahia': 'BA', 'ceara': 'CE', 'distrito federal': 'DF', 'espirito santo': 'ES',
+    'goias': 'GO', 'maranhao': 'MA', 'mato grosso': 'MT', 'mato grosso do sul': 'MS',
+    'minas gerais': 'MG', 'para': 'PA', 'paraiba': 'PB', 'parana': 'PR',
+    'pernambuco': 'PE', 'piaui': 'PI', 'rio de janeiro': 'RJ', 'rio grande do norte': 'RN',
+    'rio grande do sul': 'RS', 'rondonia': 'RO', 'roraima': 'RR', 'santa catarina': 'SC',
+    'sao paulo': 'SP', 'sergipe': 'SE', 'tocantins': 'TO'
+}
+
+
+
+
+def normalizar_texto(texto: Optional[str]) -> str:
+    """Normaliza nomes para comparação (minúsculas, sem acentos e espaços extras)"""
+    if not texto:
+        return ''
+    sem_acento = unicodedata.normalize('NFKD', str(texto))
+    sem_acento = ''.join(c for c in sem_acento if not unicodedata.combining(c))
+    return ' '.join(sem_acento.lower().split())
+
+
+
+
+def sigla_uf(estado: Optional[str]) -> str:
+    """Converte nome do estado (como vem do Nominatim) ou sigla em sigla da UF"""
+    normalizado = normalizar_texto(estado)
+    if len(normalizado) == 2:
+        return normalizado.upper()
+    return UF_POR_ESTADO.get(normalizado, '')
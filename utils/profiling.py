@@ -0,0 +1,185 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import nullcontext
+from typing import Dict, Any, List, Optional
+from config import Config
+
+
+
+
+# tracemalloc é global no processo, então só uma requisição é perfilada por vez
+_lock_perfil = threading.Lock()
+
+
+
+
+def token_valido(token: Optional[str]) -> bool:
+    """Confere o token de perfil/admin (sempre falso se nenhum token estiver configurado)"""
+    return bool(Config.PROFILE_TOKEN) and bool(token) and hmac.compare_digest(token, Config.PROFILE_TOKEN)
+
+
+def perfilar_se_solicitado(headers, rotulo: str):
+    """Context manager de perfil quando pedido pelo header protegido ou pela amostragem
+
+    Com o perfil desligado (sem token e taxa 0) devolve um nullcontext, sem custo extra.
+    """
+    gatilho = None
+    if Config.PROFILE_TOKEN and token_valido(headers.get('X-Profile-Token')):
+        gatilho = 'header'
+    elif Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE:
+        gatilho = 'amostragem'
+
+    if gatilho is None or not _lock_perfil.acquire(blocking=False):
+        return nullcontext()
+    return PerfilRequisicao(rotulo, gatilho)
+
+
+def _nome_frame(frame) -> str:
+    modulo = frame.f_globals.get('__name__', '?')
+    return f"{modulo}:{frame.f_code.co_name}".replace(';', ',')
+
+
+
+
+class PerfilRequisicao:
+    """Amostra as pilhas da thread (CPU) e as alocações (tracemalloc) durante um bloco
+
+    As pilhas são gravadas no formato "folded" (uma pilha por linha com a contagem), que
+    o flamegraph.pl, o speedscope e o inferno leem direto.
+    """
+
+    def __init__(self, rotulo: str, gatilho: str):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.rotulo = rotulo
+        self.gatilho = gatilho
+        self.intervalo = Config.PROFILE_INTERVAL_MS / 1000
+        self._amostras = Counter()
+        self._parar = threading.Event()
+        self._thread_alvo = None
+        self._amostrador = None
+        self._snapshot_inicial = None
+        self._tracemalloc_ja_ativo = False
+
+    def __enter__(self):
+        try:
+            self._thread_alvo = threading.get_ident()
+            self._tracemalloc_ja_ativo = tracemalloc.is_tracing()
+            if not self._tracemalloc_ja_ativo:
+                tracemalloc.start(Config.PROFILE_TRACEMALLOC_FRAMES)
+            self._snapshot_inicial = tracemalloc.take_snapshot()
+
+            self._inicio = time.perf_counter()
+            self._amostrador = threading.Thread(target=self._amostrar, name='perfil-amostrador', daemon=True)
+            self._amostrador.start()
+        except Exception:
+            _lock_perfil.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            duracao = time.perf_counter() - self._inicio
+            self._parar.set()
+            self._amostrador.join()
+
+            snapshot_final = tracemalloc.take_snapshot()
+            if not self._tracemalloc_ja_ativo:
+                tracemalloc.stop()
+
+            self._salvar(duracao, snapshot_final)
+        except Exception as e:
+            print(f"Erro ao gravar perfil {self.id}: {e}")
+        finally:
+            _lock_perfil.release()
+        return False
+
+    def _amostrar(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self._thread_alvo)
+            pilha = []
+            while frame is not None:
+                pilha.append(_nome_frame(frame))
+                frame = frame.f_back
+            if pilha:
+                self._amostras[';'.join(reversed(pilha))] += 1
+
+    def _salvar(self, duracao: float, snapshot_final):
+        os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+        base = os.path.join(Config.PROFILE_DIR, self.id)
+
+        with open(f"{base}.cpu.folded", 'w', encoding='utf-8') as arquivo:
+            for pilha, quantidade in self._amostras.most_common():
+                arquivo.write(f"{pilha} {quantidade}\n")
+
+        # bytes alocados durante o bloco e ainda vivos no fim, por pilha de alocação
+        filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        diferencas = snapshot_final.filter_traces(filtros).compare_to(
+            self._snapshot_inicial.filter_traces(filtros), 'traceback'
+        )
+        alocacoes = [diferenca for diferenca in diferencas if diferenca.size_diff > 0]
+        with open(f"{base}.mem.folded", 'w', encoding='utf-8') as arquivo:
+            for diferenca in alocacoes:
+                pilha = ';'.join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in diferenca.traceback)
+                arquivo.write(f"{pilha} {diferenca.size_diff}\n")
+
+        metadados = {
+            'id': self.id,
+            'rotulo': self.rotulo,
+            'gatilho': self.gatilho,
+            'timestamp': time.time(),
+            'duracao_segundos': round(duracao, 4),
+            'amostras_cpu': sum(self._amostras.values()),
+            'intervalo_ms': Config.PROFILE_INTERVAL_MS,
+            'bytes_alocados': sum(diferenca.size_diff for diferenca in alocacoes),
+            'maiores_alocacoes': [
+                {'origem': str(diferenca.traceback[-1]), 'bytes': diferenca.size_diff}
+                for diferenca in sorted(alocacoes, key=lambda d: d.size_diff, reverse=True)[:10]
+            ]
+        }
+        with open(f"{base}.json", 'w', encoding='utf-8') as arquivo:
+            json.dump(metadados, arquivo, ensure_ascii=False, indent=2)
+
+        _remover_antigos()
+
+
+
+
+def _remover_antigos():
+    """Mantém só os PROFILE_MAX_FILES perfis mais recentes"""
+    perfis = sorted(nome[:-5] for nome in os.listdir(Config.PROFILE_DIR) if nome.endswith('.json'))
+    for antigo in perfis[:-Config.PROFILE_MAX_FILES]:
+        for sufixo in ('.json', '.cpu.folded', '.mem.folded'):
+            caminho = os.path.join(Config.PROFILE_DIR, antigo + sufixo)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+
+def listar_perfis() -> List[Dict[str, Any]]:
+    """Metadados dos perfis gravados, do mais recente para o mais antigo"""
+    if not os.path.isdir(Config.PROFILE_DIR):
+        return []
+    perfis = []
+    for nome in sorted(os.listdir(Config.PROFILE_DIR), reverse=True):
+        if nome.endswith('.json'):
+            with open(os.path.join(Config.PROFILE_DIR, nome), encoding='utf-8') as arquivo:
+                perfis.append(json.load(arquivo))
+    return perfis
+
+
+def ler_perfil(perfil_id: str, tipo: str) -> Optional[str]:
+    """Conteúdo folded de um perfil (tipo 'cpu' ou 'mem')"""
+    if tipo not in ('cpu', 'mem') or os.path.basename(perfil_id) != perfil_id:
+        return None
+    caminho = os.path.join(Config.PROFILE_DIR, f"{perfil_id}.{tipo}.folded")
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as arquivo:
+        return arquivo.read()
@@ -0,0 +1,153 @@
+import os
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Optional
+from config import Config
+from utils.normalizacao import normalizar_texto
+
+
+
+
+# indicadores brutos produzidos pelo pipeline (contagens num raio e cobertura verde)
+INDICADORES = (
+    'transporte', 'escolas', 'hospitais', 'supermercados',
+    'farmacias', 'bancos', 'restaurantes', 'cobertura_verde'
+)
+
+# distribuição nacional, usada quando a cidade não tem observações suficientes
+TODAS_CIDADES = '*'
+
+# cada distribuição é guardada como quantis - tamanho fixo por cidade/indicador
+QUANTIS = 1001
+MINIMO_OBSERVACOES = 30
+
+
+
+
+class MotorPontuacao:
+    """Pontuações de 0 a 10 relativas à distribuição de cada indicador na cidade
+
+    A nota é o percentil (meio-rank) do valor bruto dentro das observações da cidade,
+    então 10 escolas no centro de São Paulo e 10 escolas numa cidade pequena deixam de
+    valer a mesma coisa e nenhuma região satura no teto.
+    """
+
+    def __init__(self, caminho: str = None):
+        self.caminho = caminho or Config.SCORING_DISTRIBUTIONS_PATH
+        self._distribuicoes = None
+        self._lock = threading.Lock()
+
+    def _carregar(self) -> Dict[str, np.ndarray]:
+        if self._distribuicoes is not None:
+            return self._distribuicoes
+
+        with self._lock:
+            if self._distribuicoes is None:
+                distribuicoes = {}
+                if os.path.exists(self.caminho):
+                    with np.load(self.caminho) as arquivo:
+                        distribuicoes = {chave: arquivo[chave] for chave in arquivo.files}
+                self._distribuicoes = distribuicoes
+        return self._distribuicoes
+
+    def aquecer(self):
+        """Carrega as distribuições agora, em vez de na primeira pontuação"""
+        self._carregar()
+
+    def distribuicao(self, cidade: str, indicador: str) -> Optional[np.ndarray]:
+        """Quantis ordenados do indicador na cidade (ou nacionais)"""
+        distribuicoes = self._carregar()
+        quantis = distribuicoes.get(f"{normalizar_texto(cidade)}|{indicador}")
+        if quantis is None:
+            quantis = distribuicoes.get(f"{TODAS_CIDADES}|{indicador}")
+        return quantis
+
+    def pontuar_lote(self, cidade: str, indicadores: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """Pontua um lote de localizações de uma vez (um searchsorted por indicador)
+
+        Valores ausentes (NaN ou None) ficam com nota NaN, como indicador sem distribuição.
+        """
+        notas = {}
+        for indicador, valores in indicadores.items():
+            valores = np.asarray(valores, dtype=np.float64)
+            quantis = self.distribuicao(cidade, indicador)
+
+            if quantis is None:
+                # sem distribuição conhecida - quem chama mantém a nota que já tinha
+                notas[indicador] = np.full(valores.shape, np.nan)
+                continue
+
+            # o searchsorted põe NaN depois de todos os quantis, o que daria nota 10
+            ausentes = np.isnan(valores)
+            esquerda = np.searchsorted(quantis, valores, side='left')
+            direita = np.searchsorted(quantis, valores, side='right')
+            nota = np.round(10 * (esquerda + direita) / (2 * len(quantis)), 1)
+            nota[ausentes] = np.nan
+            notas[indicador] = nota
+        return notas
+
+    def pontuar(self, cidade: str, indicadores: Dict[str, Optional[float]]) -> Dict[str, float]:
+        """Pontua uma única localização (omite indicadores sem valor ou sem distribuição)"""
+        validos = {nome: [valor] for nome, valor in indicadores.items() if valor is not None}
+        return {
+            nome: float(nota[0])
+            for nome, nota in self.pontuar_lote(cidade, validos).items()
+            if not np.isnan(nota[0])
+        }
+
+
+def construir_distribuicoes(observacoes: pd.DataFrame, caminho: str = None) -> Dict[str, int]:
+    """Gera o arquivo de quantis a partir de observações brutas (coluna cidade + indicadores)"""
+    caminho = caminho or Config.SCORING_DISTRIBUTIONS_PATH
+    observacoes = observacoes.assign(cidade=observacoes['cidade'].map(normalizar_texto))
+    colunas = [coluna for coluna in INDICADORES if coluna in observacoes.columns]
+    niveis = np.linspace(0, 1, QUANTIS)
+
+    distribuicoes = {}
+    observadas = {}
+    grupos = [(TODAS_CIDADES, observacoes)] + list(observacoes.groupby('cidade'))
+    for cidade, grupo in grupos:
+        for indicador in colunas:
+            valores = grupo[indicador].dropna().to_numpy(dtype=np.float64)
+            if len(valores) < MINIMO_OBSERVACOES:
+                continue
+            distribuicoes[f"{cidade}|{indicador}"] = np.quantile(valores, niveis).astype(np.float32)
+            observadas[f"{cidade}|{indicador}"] = len(valores)
+
+    diretorio = os.path.dirname(caminho)
+    if diretorio:
+        os.makedirs(diretorio, exist_ok=True)
+    np.savez_compressed(caminho, **distribuicoes)
+    return observadas
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distribuições por cidade e pontuação em lote')
+    subcomandos = parser.add_subparsers(dest='comando', required=True)
+
+    construir = subcomandos.add_parser('construir', help='gera as distribuições a partir de observações')
+    construir.add_argument('observacoes', help='CSV com a coluna cidade e um indicador por coluna')
+
+    pontuar = subcomandos.add_parser('pontuar', help='pontua um CSV de localizações')
+    pontuar.add_argument('entrada', help='CSV com a coluna cidade e um indicador por coluna')
+    pontuar.add_argument('saida')
+
+    args = parser.parse_args()
+
+    if args.comando == 'construir':
+        gerados = construir_distribuicoes(pd.read_csv(args.observacoes))
+        print(f"{len(gerados)} distribuições gravadas em {Config.SCORING_DISTRIBUTIONS_PATH}")
+    else:
+        entrada = pd.read_csv(args.entrada)
+        motor = MotorPontuacao()
+        colunas = [coluna for coluna in INDICADORES if coluna in entrada.columns]
+        for cidade, indices in entrada.groupby('cidade').groups.items():
+            notas = motor.pontuar_lote(cidade, {c: entrada.loc[indices, c].to_numpy() for c in colunas})
+            for indicador, nota in notas.items():
+                entrada.loc[indices, f"nota_{indicador}"] = nota
+        entrada.to_csv(args.saida, index=False)
+        print(f"{len(entrada)} localizações pontuadas em {args.saida}")
@@ -0,0 +1,217 @@
+import json
+import math
+import os
+import argparse
+import threading
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+from config import Config
+from utils.normalizacao import normalizar_texto, sigla_uf
+
+
+
+
+CATEGORIAS_INFRAESTRUTURA = ('escolas', 'hospitais', 'supermercados', 'farmacias', 'bancos', 'restaurantes')
+
+# ordem fixa das dimensões do vetor de um dossiê
+DIMENSOES = CATEGORIAS_INFRAESTRUTURA + (
+    'transporte', 'seguranca', 'populacao_log', 'densidade_log', 'cobertura_verde'
+)
+
+
+
+
+def _numero(valor: Any) -> float:
+    try:
+        return float(valor) if valor is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _seguranca_oficial(seguranca: Dict[str, Any]) -> float:
+    """safety_score só quando vem dos dados abertos da SSP (o simulado não descreve o bairro)"""
+    if seguranca.get('error') or not str(seguranca.get('data_source', '')).startswith('Dados abertos SSP'):
+        return math.nan
+    return _numero(seguranca.get('safety_score'))
+
+
+def vetor_do_dossie(dossie: Dict[str, Any]) -> np.ndarray:
+    """Reduz um dossiê (saída de analyze_neighborhood) ao vetor de tamanho fixo"""
+    brutos = dossie.get('dados_brutos', {})
+    infraestrutura = brutos.get('infraestrutura') or {}
+    demografia = brutos.get('demografia') or {}
+
+    valores = [_numero(infraestrutura.get(categoria, {}).get('contagem')) for categoria in CATEGORIAS_INFRAESTRUTURA]
+    valores.append(_numero((brutos.get('transporte') or {}).get('estaçoes_contagem')))
+    valores.append(_seguranca_oficial(brutos.get('seguranca') or {}))
+    valores.append(math.log1p(_numero(demografia.get('populacao'))))
+    valores.append(math.log1p(_numero(demografia.get('densidade_demografica'))))
+    valores.append(_numero((brutos.get('ambiental') or {}).get('green_coverage')))
+    return np.asarray(valores, dtype=np.float32)
+
+
+def _chave(rotulo: Dict[str, Any]) -> Tuple[str, str, str]:
+    return (sigla_uf(rotulo['estado']), normalizar_texto(rotulo['cidade']), normalizar_texto(rotulo['bairro']))
+
+
+
+
+class ConstrutorIndiceSimilaridade:
+    """Monta, fora do servidor, o arquivo do indice a partir de dossiês salvos
+
+    Cada bairro (uf, cidade, bairro) fica com a média dos vetores dos seus dossiês,
+    dimensão a dimensão, ignorando valores ausentes.
+    """
+
+    def __init__(self):
+        self._posicoes = {}
+        self._rotulos = []
+        self._somas = []
+        self._contagens = []
+
+    def adicionar(self, dossie: Dict[str, Any]) -> bool:
+        """Adiciona (ou atualiza a média de) o bairro do dossiê; ignora bairros não identificados"""
+        bairro, cidade, estado = dossie.get('bairro'), dossie.get('cidade'), dossie.get('estado')
+        if not bairro or not cidade or not estado or bairro == 'Não identificado':
+            return False
+
+        rotulo = {
+            'bairro': bairro,
+            'cidade': cidade,
+            'estado': estado,
+            'coordenadas': dossie.get('coordenadas')
+        }
+        vetor = vetor_do_dossie(dossie)
+        chave = _chave(rotulo)
+        posicao = self._posicoes.get(chave)
+        if posicao is None:
+            self._posicoes[chave] = len(self._rotulos)
+            self._rotulos.append(rotulo)
+            self._somas.append(np.nan_to_num(vetor).astype(np.float64))
+            self._contagens.append((~np.isnan(vetor)).astype(np.int32))
+        else:
+            self._somas[posicao] += np.nan_to_num(vetor)
+            self._contagens[posicao] += ~np.isnan(vetor)
+        return True
+
+    def salvar(self, caminho: str = None) -> str:
+        """Grava os vetores médios (gravação atômica: os workers nunca leem um arquivo pela metade)"""
+        caminho = caminho or Config.SIMILARITY_INDEX_PATH
+        somas = np.vstack(self._somas) if self._somas else np.zeros((0, len(DIMENSOES)))
+        contagens = np.vstack(self._contagens) if self._contagens else np.zeros((0, len(DIMENSOES)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vetores = np.where(contagens > 0, somas / contagens, np.nan).astype(np.float32)
+
+        diretorio = os.path.dirname(caminho)
+        if diretorio:
+            os.makedirs(diretorio, exist_ok=True)
+        temporario = os.path.join(diretorio, f".{os.path.basename(caminho)}")
+        with open(temporario, 'wb') as arquivo:
+            np.savez_compressed(arquivo, vetores=vetores, rotulos=np.array(json.dumps(self._rotulos, ensure_ascii=False)))
+        os.replace(temporario, caminho)
+        return caminho
+
+    def __len__(self) -> int:
+        return len(self._rotulos)
+
+
+
+
+class IndiceSimilaridade:
+    """Indice kNN (força bruta com NumPy) sobre os vetores de bairros, somente leitura
+
+    O arquivo é montado offline (ConstrutorIndiceSimilaridade, pela linha de comando) e
+    carregado uma vez por processo; as requisições só consultam, então todos os workers
+    respondem igual. As dimensões são padronizadas (z-score) antes da distância euclidiana,
+    e valores ausentes ficam na média, para que nenhuma dimensão domine só pela escala.
+    """
+
+    def __init__(self, caminho: str = None):
+        self.caminho = caminho or Config.SIMILARITY_INDEX_PATH
+        self._lock = threading.Lock()
+        self._dados = None
+
+    def _carregar(self):
+        """(posicoes, rotulos, matriz, ufs, media, desvio), lidos e padronizados uma única vez"""
+        if self._dados is not None:
+            return self._dados
+        with self._lock:
+            if self._dados is None:
+                self._dados = self._ler()
+            return self._dados
+
+    def _ler(self):
+        if not os.path.exists(self.caminho):
+            return {}, [], None, None, None, None
+        with np.load(self.caminho) as arquivo:
+            medias = arquivo['vetores'].astype(np.float64)
+            rotulos = json.loads(str(arquivo['rotulos']))
+        if not rotulos:
+            return {}, [], None, None, None, None
+
+        posicoes = {}
+        for posicao, rotulo in enumerate(rotulos):
+            posicoes.setdefault(_chave(rotulo), posicao)
+
+        # média e desvio só sobre os valores presentes de cada dimensão
+        presentes = np.maximum((~np.isnan(medias)).sum(axis=0), 1)
+        media = np.nansum(medias, axis=0) / presentes
+        desvio = np.sqrt(np.nansum((medias - media) ** 2, axis=0) / presentes)
+        desvio = np.where(desvio == 0, 1.0, desvio)
+
+        matriz = np.nan_to_num((medias - media) / desvio).astype(np.float32)
+        ufs = np.array([_chave(rotulo)[0] for rotulo in rotulos])
+        return posicoes, rotulos, matriz, ufs, media, desvio
+
+    def aquecer(self):
+        """Carrega o indice e monta a matriz padronizada agora, em vez de na primeira busca"""
+        self._carregar()
+
+    def buscar_similares(self, dossie: Dict[str, Any], k: int = 5, mesmo_estado: bool = False) -> List[Dict[str, Any]]:
+        """Os k bairros mais parecidos com o do dossiê (excluindo o próprio)"""
+        posicoes, rotulos, matriz, ufs, media, desvio = self._carregar()
+        if matriz is None:
+            return []
+
+        consulta = np.nan_to_num((vetor_do_dossie(dossie) - media) / desvio).astype(np.float32)
+        distancias = ((matriz - consulta) ** 2).sum(axis=1)
+
+        proprio = posicoes.get(_chave({
+            'estado': dossie.get('estado'), 'cidade': dossie.get('cidade'), 'bairro': dossie.get('bairro')
+        }))
+        if proprio is not None:
+            distancias[proprio] = np.inf
+        if mesmo_estado:
+            distancias[ufs != sigla_uf(dossie.get('estado'))] = np.inf
+
+        k = min(k, int(np.isfinite(distancias).sum()))
+        if k <= 0:
+            return []
+        candidatos = np.argpartition(distancias, k - 1)[:k]
+        candidatos = candidatos[np.argsort(distancias[candidatos])]
+
+        return [
+            {**rotulos[indice], 'distancia': round(float(math.sqrt(distancias[indice])), 4)}
+            for indice in candidatos
+        ]
+
+    def __len__(self) -> int:
+        return len(self._carregar()[1])
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monta o indice de similaridade a partir de dossiês salvos')
+    parser.add_argument('dossies', help='arquivo JSON Lines com um dossiê de analyze_neighborhood por linha')
+    parser.add_argument('--saida', default=Config.SIMILARITY_INDEX_PATH, help='arquivo .npz do indice')
+    args = parser.parse_args()
+
+    construtor = ConstrutorIndiceSimilaridade()
+    adicionados = 0
+    with open(args.dossies, encoding='utf-8') as arquivo:
+        for linha in arquivo:
+            if linha.strip() and construtor.adicionar(json.loads(linha)):
+                adicionados += 1
+    caminho = construtor.salvar(args.saida)
+    print(f"{adicionados} dossiês, {len(construtor)} bairros em {caminho}")
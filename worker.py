@@ -0,0 +1,64 @@
+"""Processos que consomem a fila de análises do Redis (POST /api/jobs)
+
+    python worker.py                  # JOB_WORKER_PROCESSES processos
+    python worker.py --processos 8
+
+Como no gunicorn, os indices locais são carregados uma vez no processo pai e os
+filhos nascem por fork, compartilhando essa memória.
+"""
+import argparse
+import gc
+import multiprocessing
+import signal
+import sys
+import threading
+
+from config import Config
+from models.analysis import UrbanAnalysis
+from utils import cache as cache_module
+from utils.jobs import FilaRedis
+
+
+
+
+def consumir(analisador: UrbanAnalysis):
+    cache_module.reiniciar_conexoes()
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: parar.set())
+    signal.signal(signal.SIGINT, lambda *args: parar.set())
+
+    print(f"Worker {multiprocessing.current_process().name} consumindo a fila de jobs")
+    FilaRedis().consumir(analisador.analyze_neighborhood, parar)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Workers da fila de análises')
+    parser.add_argument('--processos', type=int, default=Config.JOB_WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    analisador = UrbanAnalysis()
+    analisador.aquecer()
+    gc.freeze()
+
+    contexto = multiprocessing.get_context('fork')
+    processos = [
+        contexto.Process(target=consumir, args=(analisador,), name=f"worker-{indice}")
+        for indice in range(args.processos)
+    ]
+    for processo in processos:
+        processo.start()
+
+    # o pai só repassa o sinal e espera os filhos terminarem o job atual
+    def encerrar(*args):
+        for processo in processos:
+            processo.terminate()
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+
+    for processo in processos:
+        processo.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())